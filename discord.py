@@ -6,14 +6,29 @@ import aiosqlite
 import aiohttp
 from dotenv import load_dotenv
 import re
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
+from email.utils import parsedate_to_datetime
 import json
 import asyncio
-from collections import deque
-from time import time
+from collections import deque, OrderedDict
+from contextlib import asynccontextmanager
+from time import time, monotonic
 import shutil
 import traceback
 import sys
+import hashlib
+import math
+import random
+import csv
+import gzip
+import io
+import sqlite3
+import tempfile
+import functools
+import uuid
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from purchase_parser import Purchase, PurchaseFormatError, parse_purchase
 
 # Verifica se o bot está sendo executado através da interface gráfica
 if not any('bot_gui.py' in arg for arg in sys.argv) and __name__ == '__main__':
@@ -23,17 +38,77 @@ if not any('bot_gui.py' in arg for arg in sys.argv) and __name__ == '__main__':
 # Carrega as variáveis de ambiente
 load_dotenv()
 
-# Dicionário para armazenar locks de arquivos
-file_locks = {}
+class LockTable:
+    """Locks por chave criados sob demanda e descartados quando ninguém mais os usa"""
+    def __init__(self):
+        self._entries = {}  # chave -> [asyncio.Lock, referências (dono + espera)]
+        self.acquisitions = 0
+        self.contended = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.max_queue = 0
+        self.peak_size = 0
+
+    @asynccontextmanager
+    async def hold(self, key):
+        # Busca e inserção sem await no meio: não há como duas tarefas criarem locks diferentes
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = self._entries[key] = [asyncio.Lock(), 0]
+            self.peak_size = max(self.peak_size, len(self._entries))
+        entry[1] += 1
+        try:
+            if entry[0].locked():
+                self.contended += 1
+                self.max_queue = max(self.max_queue, entry[1] - 1)
+            started = monotonic()
+            async with entry[0]:
+                waited = monotonic() - started
+                self.acquisitions += 1
+                self.total_wait += waited
+                self.max_wait = max(self.max_wait, waited)
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0 and self._entries.get(key) is entry:
+                del self._entries[key]
+
+    def busiest(self, limit: int = 3) -> list[tuple[str, int]]:
+        """Chaves com mais tarefas aguardando no momento"""
+        waiting = [(key, entry[1] - 1) for key, entry in self._entries.items() if entry[1] > 1]
+        return sorted(waiting, key=lambda item: item[1], reverse=True)[:limit]
 
-# Cache para evitar processamento duplicado
-processed_files = {}
+    def stats(self) -> dict:
+        return {
+            'size': len(self._entries),
+            'peak_size': self.peak_size,
+            'acquisitions': self.acquisitions,
+            'contended': self.contended,
+            'avg_wait': self.total_wait / self.acquisitions if self.acquisitions else 0.0,
+            'max_wait': self.max_wait,
+            'max_queue': self.max_queue,
+            'waiting': sum(entry[1] - 1 for entry in self._entries.values())
+        }
 
-async def get_file_lock(file_path):
-    """Obtém um lock para um arquivo específico"""
-    if file_path not in file_locks:
-        file_locks[file_path] = asyncio.Lock()
-    return file_locks[file_path]
+# Criar instância global dos locks dos arquivos de saldo
+bank_file_locks = LockTable()
+
+def write_json_atomic(path: str, data, prefix: str = '.tmp.'):
+    """Grava JSON em um arquivo temporário no mesmo diretório, faz fsync e substitui o original"""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(prefix=prefix, suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=4)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    except Exception:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
 
 def create_backup(file_path):
     """Cria um backup do arquivo com timestamp"""
@@ -51,1228 +126,5204 @@ def create_backup(file_path):
         print(f"Erro ao criar backup: {e}")
         return None
 
-def validate_json_structure(data):
-    """Valida a estrutura básica do arquivo JSON"""
-    required_fields = ['purchase', 'user', 'delivered_products']
-    missing_fields = [field for field in required_fields if field not in data]
-    
-    if missing_fields:
-        print(f"Campos obrigatórios ausentes: {', '.join(missing_fields)}")
-        return False
-    return True
-
 # Carrega as variáveis de ambiente
 CONFIG_FILE = 'config.json'
 
 # Rate Limiting para API Steam
+PRIORITY_INTERACTIVE = 0  # Ações de usuários (modais, menus)
+PRIORITY_BACKGROUND = 1   # Atualizações em segundo plano e operações em lote
+
 class SteamRateLimiter:
-    def __init__(self, requests_per_second=1):
-        self.requests_per_second = requests_per_second
-        self.requests = deque()
-        
-    async def acquire(self):
-        now = time()
-        
-        # Remove requisições antigas (mais de 1 segundo)
-        while self.requests and self.requests[0] < now - 1:
-            self.requests.popleft()
-        
-        # Se atingiu o limite, espera
-        if len(self.requests) >= self.requests_per_second:
-            wait_time = self.requests[0] - (now - 1)
-            if wait_time > 0:
-                await asyncio.sleep(wait_time)
-        
-        # Adiciona nova requisição
-        self.requests.append(now)
+    """Token bucket assíncrono com duas filas de prioridade e suporte a Retry-After"""
+    def __init__(self, rate: float = 1.0, burst: int = 1):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated = monotonic()
+        self._blocked_until = 0.0
+        self._lanes = {PRIORITY_INTERACTIVE: deque(), PRIORITY_BACKGROUND: deque()}
+        self._dispatcher = None
+        self._granted = {PRIORITY_INTERACTIVE: 0, PRIORITY_BACKGROUND: 0}
+        self._total_wait = {PRIORITY_INTERACTIVE: 0.0, PRIORITY_BACKGROUND: 0.0}
+        self._max_wait = {PRIORITY_INTERACTIVE: 0.0, PRIORITY_BACKGROUND: 0.0}
+        self.penalties = 0
+
+    def _refill(self, now: float):
+        if now <= self._updated:
+            return
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _record_wait(self, priority: int, waited: float):
+        self._granted[priority] += 1
+        self._total_wait[priority] += waited
+        self._max_wait[priority] = max(self._max_wait[priority], waited)
+
+    async def acquire(self, priority: int = PRIORITY_INTERACTIVE):
+        started = monotonic()
+        self._refill(started)
+
+        # Caminho rápido: sem fila, sem bloqueio e com token disponível
+        if (self._tokens >= 1 and started >= self._blocked_until
+                and not any(self._lanes.values())):
+            self._tokens -= 1
+            self._record_wait(priority, 0.0)
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        self._lanes[priority].append(future)
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._dispatch())
+
+        await future
+        self._record_wait(priority, monotonic() - started)
+
+    def _next_waiter(self):
+        for priority in (PRIORITY_INTERACTIVE, PRIORITY_BACKGROUND):
+            lane = self._lanes[priority]
+            while lane:
+                future = lane.popleft()
+                if not future.done():  # Ignora quem desistiu (cancelado)
+                    return future
+        return None
+
+    async def _dispatch(self):
+        """Libera os tokens um a um, sempre atendendo primeiro a fila interativa"""
+        while any(self._lanes.values()):
+            now = monotonic()
+            if now < self._blocked_until:
+                await asyncio.sleep(self._blocked_until - now)
+                continue
+
+            self._refill(now)
+            if self._tokens < 1:
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+                continue
+
+            future = self._next_waiter()
+            if future is None:
+                break
+            self._tokens -= 1
+            future.set_result(None)
+
+    def penalize(self, retry_after: float):
+        """Bloqueia todas as requisições após um 429 (respeitando o Retry-After)"""
+        self.penalties += 1
+        self._blocked_until = max(self._blocked_until, monotonic() + retry_after)
+        # Os tokens só voltam a acumular depois do bloqueio
+        self._tokens = 0.0
+        self._updated = self._blocked_until
+
+    def stats(self) -> dict:
+        lanes = {}
+        for priority, name in ((PRIORITY_INTERACTIVE, 'interactive'), (PRIORITY_BACKGROUND, 'background')):
+            granted = self._granted[priority]
+            lanes[name] = {
+                'queue_depth': sum(1 for future in self._lanes[priority] if not future.done()),
+                'granted': granted,
+                'avg_wait': (self._total_wait[priority] / granted) if granted else 0.0,
+                'max_wait': self._max_wait[priority]
+            }
+        return {
+            'rate': self.rate,
+            'burst': self.burst,
+            'penalties': self.penalties,
+            'blocked_for': max(0.0, self._blocked_until - monotonic()),
+            'lanes': lanes
+        }
 
 # Criar instância global do rate limiter
-steam_rate_limiter = SteamRateLimiter()
+steam_rate_limiter = SteamRateLimiter(
+    rate=float(os.getenv('STEAM_API_RATE', 1)),
+    burst=int(os.getenv('STEAM_API_BURST', 1))
+)
 
-def load_config():
+STEAM_API_BASE = 'https://api.steampowered.com'
+
+def steam_api_params(**params) -> dict:
+    """Monta os parâmetros de uma chamada à Steam Web API incluindo a chave"""
+    return {'key': os.getenv('STEAM_API_KEY', ''), **params}
+
+class HttpClient:
+    """Sessão HTTP compartilhada, com keep-alive e cache de DNS, criada na inicialização"""
+    def __init__(self, limit: int = 20, limit_per_host: int = 8, dns_ttl: int = 300,
+                 keepalive_timeout: float = 30, total_timeout: float = 10, connect_timeout: float = 5):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.dns_ttl = dns_ttl
+        self.keepalive_timeout = keepalive_timeout
+        self.timeout = aiohttp.ClientTimeout(
+            total=total_timeout,
+            connect=connect_timeout,
+            sock_read=total_timeout
+        )
+        self._session = None
+
+    async def start(self):
+        """Cria a sessão uma única vez (chamadas repetidas são ignoradas)"""
+        if self._session is not None and not self._session.closed:
+            return
+        connector = aiohttp.TCPConnector(
+            limit=self.limit,
+            limit_per_host=self.limit_per_host,
+            ttl_dns_cache=self.dns_ttl,
+            keepalive_timeout=self.keepalive_timeout
+        )
+        self._session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+
+    async def get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            await self.start()
+        return self._session
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+# Criar instância global do cliente HTTP da Steam
+steam_http = HttpClient(
+    limit_per_host=int(os.getenv('STEAM_HTTP_MAX_CONNECTIONS', 8)),
+    total_timeout=float(os.getenv('STEAM_HTTP_TIMEOUT', 10))
+)
+
+# Criar instância global do cliente HTTP dos anexos (CDN do Discord)
+attachment_http = HttpClient(
+    limit_per_host=int(os.getenv('ATTACHMENT_HTTP_MAX_CONNECTIONS', 8)),
+    total_timeout=float(os.getenv('ATTACHMENT_HTTP_TIMEOUT', 30))
+)
+
+# Tamanho máximo de um anexo de venda (bytes)
+PURCHASE_MAX_BYTES = int(os.getenv('PURCHASE_MAX_BYTES', 1024 * 1024))
+
+class AttachmentTooLarge(Exception):
+    """O anexo passou do limite de tamanho (declarado ou durante o download)"""
+    def __init__(self, size: int, limit: int):
+        super().__init__(f"{size} bytes (limite: {limit} bytes)")
+        self.size = size
+        self.limit = limit
+
+async def read_attachment_limited(attachment: discord.Attachment, max_bytes: int, chunk_size: int = 64 * 1024) -> bytearray:
+    """Baixa o anexo em partes, interrompendo o download assim que ele passar de max_bytes"""
+    if attachment.size > max_bytes:
+        raise AttachmentTooLarge(attachment.size, max_bytes)
+    session = await attachment_http.get_session()
+    async with session.get(attachment.url) as response:
+        response.raise_for_status()
+        # O tamanho declarado no Discord pode não bater com o que o CDN entrega
+        if response.content_length is not None and response.content_length > max_bytes:
+            raise AttachmentTooLarge(response.content_length, max_bytes)
+        content = bytearray()
+        async for chunk in response.content.iter_chunked(chunk_size):
+            content += chunk
+            if len(content) > max_bytes:
+                # Sair do bloco sem ler o resto descarta a conexão e interrompe o download
+                raise AttachmentTooLarge(len(content), max_bytes)
+        return content
+
+class SingleFlight:
+    """Compartilha uma única execução entre chamadas concorrentes com a mesma chave"""
+    def __init__(self, name: str):
+        self.name = name
+        self._inflight = {}  # key -> Task
+        self.calls = 0
+        self.duplicates = 0
+
+    async def do(self, key, factory):
+        """Executa `factory()` ou aguarda a execução já em andamento para `key`"""
+        task = self._inflight.get(key)
+        if task is not None:
+            self.duplicates += 1
+            return await asyncio.shield(task)
+
+        self.calls += 1
+        task = asyncio.ensure_future(factory())
+        self._inflight[key] = task
+
+        def forget(finished):
+            if self._inflight.get(key) is finished:
+                del self._inflight[key]
+
+        task.add_done_callback(forget)
+        # shield: se quem iniciou desistir, os outros continuam aguardando o mesmo resultado
+        return await asyncio.shield(task)
+
+    def stats(self) -> dict:
+        return {
+            'calls': self.calls,
+            'duplicates': self.duplicates,
+            'in_flight': len(self._inflight)
+        }
+
+# Criar instâncias globais de deduplicação das consultas Steam
+vanity_lookups = SingleFlight('vanity')
+profile_lookups = SingleFlight('profile')
+
+STEAM_MAX_RETRIES = int(os.getenv('STEAM_MAX_RETRIES', 4))
+STEAM_BACKOFF_BASE = 1.0
+STEAM_BACKOFF_MAX = 60.0
+
+def parse_retry_after(value) -> float:
+    """Interpreta o cabeçalho Retry-After (segundos ou data HTTP)"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
     try:
-        with open(CONFIG_FILE, 'r') as f:
-            return json.load(f)
-    except:
+        retry_at = parsedate_to_datetime(value)
+        if retry_at.tzinfo is None:
+            retry_at = retry_at.replace(tzinfo=timezone.utc)
+        return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+def backoff_delay(attempt: int) -> float:
+    """Backoff exponencial limitado com jitter"""
+    delay = min(STEAM_BACKOFF_MAX, STEAM_BACKOFF_BASE * (2 ** attempt))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+class SteamUnavailable(Exception):
+    """A API da Steam não respondeu (conexão, timeout, 5xx, 429 esgotado): o resultado não vai para o cache"""
+
+async def steam_api_get(endpoint: str, priority: int = PRIORITY_INTERACTIVE, **params):
+    """GET na Steam Web API com rate limit, Retry-After e novas tentativas limitadas. Levanta SteamUnavailable"""
+    api_url = f'{STEAM_API_BASE}/{endpoint}'
+    for attempt in range(STEAM_MAX_RETRIES + 1):
+        is_last_attempt = attempt == STEAM_MAX_RETRIES
+        await steam_rate_limiter.acquire(priority)
+        try:
+            session = await steam_http.get_session()
+            async with session.get(api_url, params=steam_api_params(**params)) as response:
+                if response.status == 429:  # Too Many Requests
+                    retry_after = parse_retry_after(response.headers.get('Retry-After'))
+                    delay = min(STEAM_BACKOFF_MAX, retry_after) if retry_after is not None else backoff_delay(attempt)
+                    print(f"Rate limit atingido ({endpoint}). Aguardando {delay:.1f} segundos...")
+                    # O limiter segura todas as requisições até o fim da espera
+                    steam_rate_limiter.penalize(delay)
+                    if is_last_attempt:
+                        break
+                    continue
+
+                if response.status >= 500:
+                    print(f"Erro na API Steam ({endpoint}): Status {response.status}")
+                    if is_last_attempt:
+                        break
+                    await asyncio.sleep(backoff_delay(attempt))
+                    continue
+
+                if response.status != 200:
+                    print(f"Erro na API Steam ({endpoint}): Status {response.status}")
+                    raise SteamUnavailable(f"API Steam ({endpoint}) respondeu com status {response.status}")
+
+                return await response.json()
+
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            print(f"Falha de conexão com a API Steam ({endpoint}): {e or type(e).__name__}")
+            if is_last_attempt:
+                break
+            await asyncio.sleep(backoff_delay(attempt))
+
+    print(f"❌ API Steam ({endpoint}) indisponível após {STEAM_MAX_RETRIES + 1} tentativas")
+    raise SteamUnavailable(f"API Steam ({endpoint}) indisponível após {STEAM_MAX_RETRIES + 1} tentativas")
+
+class ConfigStore:
+    """Mantém o config.json em memória e recarrega quando o arquivo é alterado"""
+    def __init__(self, path: str, check_interval: float = 2.0):
+        self.path = path
+        self.check_interval = check_interval
+        self._data = None
+        self._signature = None
+        self._last_check = 0.0
+
+    def _defaults(self) -> dict:
         # Usar valores do .env como padrão
-        config = {
+        return {
             'registration_channel_id': os.getenv('REGISTRATION_CHANNEL_ID'),
             'registered_role_id': os.getenv('REGISTERED_ROLE_ID'),
             'sales_confirmation_channel_id': os.getenv('SALES_CONFIRMATION_CHANNEL_ID', None)
         }
-        save_config(config)
-        return config
+
+    def _file_signature(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+    def _reload(self, signature):
+        if signature is None:
+            print(f"Arquivo {self.path} não encontrado, criando com valores do .env")
+            self.save(self._defaults())
+            return
+
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+            if not isinstance(data, dict):
+                raise ValueError("conteúdo não é um objeto JSON")
+        except (OSError, ValueError) as e:
+            # Arquivo inválido ou sendo editado: mantém a última versão válida
+            print(f"⚠️ Erro ao ler {self.path}: {e}")
+            if self._data is None:
+                self._data = self._defaults()
+            return
+
+        # Troca a referência de uma vez para que leitores nunca vejam estado parcial
+        self._data = data
+        self._signature = signature
+        print(f"Configuração carregada de {self.path}")
+
+    def _refresh(self):
+        now = time()
+        if self._data is not None and now - self._last_check < self.check_interval:
+            return
+        self._last_check = now
+        signature = self._file_signature()
+        if self._data is None or signature != self._signature:
+            self._reload(signature)
+
+    def snapshot(self) -> dict:
+        """Retorna uma cópia da configuração atual"""
+        self._refresh()
+        return dict(self._data)
+
+    def get(self, key: str, default=None):
+        self._refresh()
+        value = self._data.get(key)
+        return value if value not in (None, '') else default
+
+    def get_int(self, key: str, default=None):
+        value = self.get(key, default)
+        if value in (None, ''):
+            return None
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            print(f"⚠️ Valor inválido para {key}: {value}")
+            return None
+
+    def save(self, config: dict):
+        """Grava a configuração de forma atômica e atualiza a cópia em memória"""
+        write_json_atomic(self.path, config, prefix='.config.')
+
+        self._data = dict(config)
+        self._signature = self._file_signature()
+        self._last_check = time()
+
+    def update(self, **values):
+        config = self.snapshot()
+        config.update(values)
+        self.save(config)
+
+# Criar instância global da configuração
+config_store = ConfigStore(CONFIG_FILE)
+
+def load_config():
+    return config_store.snapshot()
 
 def save_config(config):
-    with open(CONFIG_FILE, 'w') as f:
-        json.dump(config, f, indent=4)
+    config_store.save(config)
 
 def get_channel_id():
-    config = load_config()
-    return int(config.get('registration_channel_id') or os.getenv('REGISTRATION_CHANNEL_ID'))
+    return config_store.get_int('registration_channel_id', os.getenv('REGISTRATION_CHANNEL_ID'))
 
 def get_role_id():
-    config = load_config()
-    return int(config.get('registered_role_id') or os.getenv('REGISTERED_ROLE_ID'))
+    return config_store.get_int('registered_role_id', os.getenv('REGISTERED_ROLE_ID'))
 
 def get_sales_confirmation_channel_id():
-    config = load_config()
-    return int(config.get('sales_confirmation_channel_id')) if config.get('sales_confirmation_channel_id') else None
+    return config_store.get_int('sales_confirmation_channel_id')
 
-# Configuração do bot
-intents = discord.Intents.all()
-bot = commands.Bot(command_prefix='!', intents=intents)
+DATABASE_FILE = 'users.db'
 
-# Regex para validar URL da Steam
-STEAM_PROFILE_REGEX = r'(?:https?:\/\/)?steamcommunity\.com\/(?:profiles\/[0-9]+|id\/[\w-]+)'
+class UserDatabase:
+    """Conexão persistente com o users.db compartilhada por todo o bot"""
+    def __init__(self, path: str, cached_statements: int = 256):
+        self.path = path
+        self.cached_statements = cached_statements
+        self._conn = None
+        self._write_lock = None
 
-class SteamLinkModal(discord.ui.Modal, title='Vincular Conta Steam'):
-    def __init__(self, is_update=False):
-        super().__init__()
-        self.is_update = is_update
-        
-    steam_url = discord.ui.TextInput(
-        label='Link do Perfil Steam',
-        placeholder='https://steamcommunity.com/id/seunome',
-        required=True,
-        min_length=10,
-        max_length=100
-    )
+    @property
+    def is_running(self) -> bool:
+        return self._conn is not None
 
-    async def on_submit(self, interaction: discord.Interaction):
-        await interaction.response.defer(ephemeral=True)
-        
-        # Validar formato da URL
-        if not re.match(STEAM_PROFILE_REGEX, str(self.steam_url)):
-            await interaction.followup.send(
-                "❌ Link inválido! Por favor, use um link válido do Steam.\n"
-                "Exemplos:\n"
-                "- https://steamcommunity.com/id/seunome\n"
-                "- https://steamcommunity.com/profiles/76561198xxxxxxxxx\n"
-                "Certifique-se de copiar o link completo do seu perfil.",
-                ephemeral=True
-            )
+    async def start(self):
+        """Abre a conexão uma única vez (chamadas repetidas são ignoradas)"""
+        if self._conn is not None:
             return
 
-        await interaction.followup.send("🔍 Verificando seu perfil Steam... Por favor, aguarde.", ephemeral=True)
-        steam_id = await get_steam_id64(str(self.steam_url))
+        # isolation_level=None: as transações são controladas explicitamente em transaction()
+        conn = await aiosqlite.connect(
+            self.path,
+            isolation_level=None,
+            cached_statements=self.cached_statements
+        )
+        await conn.execute('PRAGMA journal_mode=WAL')
+        await conn.execute('PRAGMA synchronous=NORMAL')
+        await conn.execute('PRAGMA busy_timeout=5000')
 
-        if not steam_id:
-            await interaction.followup.send(
-                "❌ Não foi possível verificar seu perfil da Steam. Certifique-se de que:\n"
-                "1. O link está correto e completo\n"
-                "2. O perfil existe\n"
-                "3. Você copiou o link diretamente do seu perfil Steam\n\n"
-                "Dica: Abra seu perfil Steam no navegador e copie a URL completa.",
-                ephemeral=True
-            )
-            return
+        self._conn = conn
+        self._write_lock = asyncio.Lock()
+        print(f"Banco de dados conectado: {self.path} (WAL, synchronous=NORMAL)")
 
-        # Buscar dados do perfil
-        profile_data = await get_steam_profile_data(steam_id)
-        if not profile_data:
-            await interaction.followup.send(
-                "❌ Não foi possível obter os dados do perfil. Erro ao acessar a API da Steam.",
-                ephemeral=True
-            )
+    async def close(self):
+        if self._conn is None:
             return
+        conn, self._conn = self._conn, None
+        async with self._write_lock:
+            await conn.close()
+        print("Conexão com o banco de dados encerrada")
 
-        # Criar embed com os dados do perfil
-        embed = discord.Embed(
-            title="Confirmar Perfil Steam",
-            description="Por favor, confirme se este é seu perfil Steam:",
-            color=discord.Color.blue()
-        )
-        
-        embed.add_field(name="Nome Steam", value=profile_data.get('personaname', 'N/A'), inline=True)
-        embed.add_field(name="Steam ID", value=steam_id, inline=True)
-        
-        if profile_data.get('profileurl'):
-            embed.add_field(name="Link do Perfil", value=profile_data['profileurl'], inline=False)
-        
-        # Status do perfil
-        visibility = "Público" if profile_data.get('communityvisibilitystate', 1) == 3 else "Privado/Limitado"
-        embed.add_field(name="Visibilidade", value=visibility, inline=True)
-        
-        # Status online
-        status_map = {
-            0: "Offline",
-            1: "Online",
-            2: "Ocupado",
-            3: "Ausente",
-            4: "Dormindo",
-            5: "Trocando",
-            6: "Jogando"
-        }
-        status = status_map.get(profile_data.get('personastate', 0), "Desconhecido")
-        embed.add_field(name="Status", value=status, inline=True)
-        
-        if profile_data.get('avatarfull'):
-            embed.set_thumbnail(url=profile_data['avatarfull'])
+    async def fetchone(self, sql: str, params=()):
+        async with self._conn.execute(sql, params) as cursor:
+            return await cursor.fetchone()
 
-        # Criar view com botões de confirmação
-        view = ConfirmationView(steam_id, profile_data, self.is_update)
-        message = await interaction.followup.send(
-            embed=embed,
-            view=view,
-            ephemeral=True
-        )
-        view.message = message
+    async def fetchall(self, sql: str, params=()):
+        async with self._conn.execute(sql, params) as cursor:
+            return await cursor.fetchall()
 
-class ConfirmationView(discord.ui.View):
-    def __init__(self, steam_id: str, profile_data: dict, is_update: bool = False):
-        super().__init__(timeout=180)  # 3 minutos de timeout
-        self.steam_id = steam_id
-        self.profile_data = profile_data
-        self.is_update = is_update
+    async def iterate(self, sql: str, params=(), batch_size: int = 500):
+        """Percorre o resultado em lotes, sem carregar a tabela inteira"""
+        async with self._conn.execute(sql, params) as cursor:
+            while True:
+                rows = await cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield row
 
-    @discord.ui.button(label="Confirmar", style=discord.ButtonStyle.green)
-    async def confirm(self, interaction: discord.Interaction, button: discord.ui.Button):
-        # Salvar/Atualizar no banco de dados
-        async with aiosqlite.connect('users.db') as db:
-            await db.execute(
-                'INSERT OR REPLACE INTO users (discord_id, discord_name, steam_id) VALUES (?, ?, ?)',
-                (str(interaction.user.id), interaction.user.name, self.steam_id)
-            )
-            await db.commit()
+    @asynccontextmanager
+    async def transaction(self):
+        """Agrupa várias escritas em uma única transação"""
+        async with self._write_lock:
+            await self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield self._conn
+            except BaseException:
+                await self._conn.rollback()
+                raise
+            else:
+                await self._conn.commit()
 
-        # Adicionar cargo de registro
-        registered_role = interaction.guild.get_role(get_role_id())
-        if registered_role:
-            await interaction.user.add_roles(registered_role)
-            action = "atualizada" if self.is_update else "vinculada"
-            await interaction.response.edit_message(
-                content=f"✅ Conta Steam {action} com sucesso!\n"
-                f"Steam ID: {self.steam_id}\n"
-                f"Cargo {registered_role.mention} {'mantido' if self.is_update else 'adicionado'}!",
-                view=None,
-                embed=None
-            )
+    async def execute(self, sql: str, params=()) -> int:
+        """Executa uma única escrita em transação e retorna o número de linhas afetadas"""
+        async with self.transaction() as db:
+            cursor = await db.execute(sql, params)
+            rowcount = cursor.rowcount
+            await cursor.close()
+            return rowcount
+
+    async def executemany(self, sql: str, params_seq) -> None:
+        async with self.transaction() as db:
+            await db.executemany(sql, params_seq)
+
+# Criar instância global do banco de dados
+user_db = UserDatabase(DATABASE_FILE)
+
+class SteamIdCache:
+    """Cache LRU limitado de discord_id ↔ steam_id com escrita direta no banco"""
+    def __init__(self, db: UserDatabase, max_size: int = 100000):
+        self.db = db
+        self.max_size = max_size
+        self._by_discord = OrderedDict()  # discord_id -> steam_id
+        self._by_steam = {}  # steam_id -> discord_id
+        self._warmed = False
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._by_discord)
+
+    def _store(self, discord_id: str, steam_id: str):
+        previous = self._by_discord.pop(discord_id, None)
+        if previous is not None and self._by_steam.get(previous) == discord_id:
+            del self._by_steam[previous]
+
+        self._by_discord[discord_id] = steam_id
+        self._by_steam[steam_id] = discord_id
+
+        # Remover as entradas menos usadas quando passar do limite
+        while len(self._by_discord) > self.max_size:
+            old_discord, old_steam = self._by_discord.popitem(last=False)
+            if self._by_steam.get(old_steam) == old_discord:
+                del self._by_steam[old_steam]
+
+    def set(self, discord_id, steam_id):
+        """Atualiza o cache após uma escrita no banco"""
+        if steam_id:
+            self._store(str(discord_id), str(steam_id))
         else:
-            await interaction.response.edit_message(
-                content="⚠️ Registro concluído, mas não foi possível gerenciar o cargo (cargo não encontrado).",
-                view=None,
-                embed=None
-            )
+            self.remove(discord_id)
 
-    @discord.ui.button(label="Alterar", style=discord.ButtonStyle.primary)
-    async def change(self, interaction: discord.Interaction, button: discord.ui.Button):
-        modal = SteamLinkModal(self.is_update)
-        await interaction.response.send_modal(modal)
+    def remove(self, discord_id):
+        steam_id = self._by_discord.pop(str(discord_id), None)
+        if steam_id is not None and self._by_steam.get(steam_id) == str(discord_id):
+            del self._by_steam[steam_id]
 
-    @discord.ui.button(label="Cancelar", style=discord.ButtonStyle.red)
-    async def cancel(self, interaction: discord.Interaction, button: discord.ui.Button):
-        await interaction.response.edit_message(
-            content="❌ Verificação cancelada.",
-            view=None,
-            embed=None
-        )
+    async def warm(self):
+        """Carrega os registros do users.db na inicialização"""
+        if self._warmed:
+            return
+        async for discord_id, steam_id in self.db.iterate(
+            'SELECT discord_id, steam_id FROM users WHERE steam_id IS NOT NULL LIMIT ?',
+            (self.max_size,)
+        ):
+            self._store(str(discord_id), str(steam_id))
+        self._warmed = True
+        print(f"Cache de Steam IDs carregado: {len(self)} registros")
 
-    async def on_timeout(self):
-        for child in self.children:
-            child.disabled = True
-        try:
-            await self.message.edit(
-                content="⏰ Tempo expirado. Por favor, inicie o processo novamente.",
-                view=self
-            )
-        except:
-            pass
+    async def get_steam_id(self, discord_id):
+        """Retorna o steam_id vinculado ao discord_id ou None"""
+        discord_id = str(discord_id)
+        steam_id = self._by_discord.get(discord_id)
+        if steam_id is not None:
+            self.hits += 1
+            self._by_discord.move_to_end(discord_id)
+            return steam_id
 
-class RegistrationSelect(discord.ui.Select):
-    def __init__(self):
-        options = [
-            discord.SelectOption(
-                label="Registrar",
-                description="Vincular sua conta Steam",
-                emoji="🟢",
-                value="register"
-            ),
-            discord.SelectOption(
-                label="Consultar Cadastro",
-                description="Ver sua conta vinculada",
-                emoji="🔵",
-                value="check"
-            ),
-            discord.SelectOption(
-                label="Alterar Conta Steam",
-                description="Mudar sua conta Steam",
-                emoji="⚫",
-                value="change"
-            ),
-            discord.SelectOption(
-                label="Remover Cadastro",
-                description="Desvincular sua conta",
-                emoji="🔴",
-                value="remove"
-            )
-        ]
-        super().__init__(
-            placeholder="Selecione uma ação...",
-            min_values=1,
-            max_values=1,
-            options=options
-        )
+        self.misses += 1
+        result = await self.db.fetchone('SELECT steam_id FROM users WHERE discord_id = ?', (discord_id,))
+        if result and result[0]:
+            self._store(discord_id, str(result[0]))
+            return str(result[0])
+        return None
 
-    async def callback(self, interaction: discord.Interaction):
-        try:
-            # Verificar registro existente para opções que requerem cadastro
-            if self.values[0] in ["check", "change", "remove"]:
-                async with aiosqlite.connect('users.db') as db:
-                    cursor = await db.execute('SELECT steam_id FROM users WHERE discord_id = ?', (str(interaction.user.id),))
-                    existing_user = await cursor.fetchone()
-                    
-                if not existing_user:
-                    await interaction.response.send_message(
-                        "❌ Você não possui uma conta Steam vinculada. Use a opção 'Registrar' primeiro.",
-                        ephemeral=True
-                    )
-                    return
+    async def get_discord_id(self, steam_id):
+        """Retorna o discord_id vinculado ao steam_id ou None"""
+        steam_id = str(steam_id)
+        discord_id = self._by_steam.get(steam_id)
+        if discord_id is not None:
+            self.hits += 1
+            self._by_discord.move_to_end(discord_id)
+            return discord_id
 
-            # Processar cada opção
-            if self.values[0] == "register":
-                # Verificar permissões antes de prosseguir
-                registered_role = interaction.guild.get_role(get_role_id())
-                if registered_role:
-                    has_perm, message = await check_role_permissions(interaction.guild, interaction.guild.me, registered_role)
-                    if not has_perm:
-                        await interaction.response.send_message(
-                            f"⚠️ {message}\nPor favor, contate um administrador do servidor.",
-                            ephemeral=True
-                        )
-                        return
+        self.misses += 1
+        result = await self.db.fetchone('SELECT discord_id FROM users WHERE steam_id = ?', (steam_id,))
+        if result:
+            self._store(str(result[0]), steam_id)
+            return str(result[0])
+        return None
 
-                # Verificar se já tem registro
-                async with aiosqlite.connect('users.db') as db:
-                    cursor = await db.execute('SELECT steam_id FROM users WHERE discord_id = ?', (str(interaction.user.id),))
-                    existing_user = await cursor.fetchone()
-                    
-                if existing_user:
-                    await interaction.response.send_message(
-                        "Você já possui uma conta Steam vinculada. Use a opção 'Alterar Conta Steam' se desejar fazer alterações.",
-                        ephemeral=True
-                    )
-                    return
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            'size': len(self),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': (self.hits / total) if total else 0.0
+        }
 
-                modal = SteamLinkModal()
-                await interaction.response.send_modal(modal)
+# Criar instância global do cache de Steam IDs
+steam_id_cache = SteamIdCache(user_db)
 
-            elif self.values[0] == "check":
-                async with aiosqlite.connect('users.db') as db:
-                    cursor = await db.execute('SELECT steam_id FROM users WHERE discord_id = ?', (str(interaction.user.id),))
-                    user_data = await cursor.fetchone()
-                    
-                steam_id = user_data[0]
-                profile_data = await get_steam_profile_data(steam_id)
+# Limite de tamanho por anexo do Discord (bytes)
+DISCORD_ATTACHMENT_LIMIT = int(os.getenv('DISCORD_ATTACHMENT_LIMIT', 8 * 1024 * 1024))
 
-                if not profile_data:
-                    await interaction.response.send_message(
-                        "❌ Não foi possível obter os dados atualizados do seu perfil Steam.",
-                        ephemeral=True
-                    )
-                    return
+class UserExporter:
+    """Exporta a tabela users em CSV compactado (gzip), em lotes e com memória constante"""
+    HEADER = ['Discord ID', 'Discord Name', 'Steam ID', 'Registered At']
 
-                embed = discord.Embed(
-                    title="Seu Perfil Steam Vinculado",
-                    description="Estes são os dados do seu perfil Steam atual:",
-                    color=discord.Color.blue()
-                )
-                embed.add_field(name="Nome Steam", value=profile_data.get('personaname', 'N/A'), inline=True)
-                embed.add_field(name="Steam ID", value=steam_id, inline=True)
-                if profile_data.get('avatarfull'):
-                    embed.set_thumbnail(url=profile_data['avatarfull'])
+    def __init__(self, db: UserDatabase, batch_size: int = 1000, part_limit: int = DISCORD_ATTACHMENT_LIMIT):
+        self.db = db
+        self.batch_size = batch_size
+        # Margem para os dados ainda no buffer do compressor
+        self.part_limit = max(part_limit - 256 * 1024, 64 * 1024)
 
-                await interaction.response.send_message(embed=embed, ephemeral=True)
+    @staticmethod
+    def build_query(since: str = None, until: str = None, only_without_steam: bool = False):
+        conditions = []
+        params = []
+        if since:
+            conditions.append('registered_at >= ?')
+            params.append(since)
+        if until:
+            conditions.append('registered_at < ?')
+            params.append(until)
+        if only_without_steam:
+            conditions.append("(steam_id IS NULL OR steam_id = '')")
 
-            elif self.values[0] == "change":
-                modal = SteamLinkModal(is_update=True)
-                await interaction.response.send_modal(modal)
+        sql = 'SELECT discord_id, discord_name, steam_id, registered_at FROM users'
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+        return sql, tuple(params)
 
-            elif self.values[0] == "remove":
-                try:
-                    # Verificar permissões antes de prosseguir
-                    registered_role = interaction.guild.get_role(get_role_id())
-                    if not registered_role:
-                        await interaction.response.send_message(
-                            "❌ Erro: Cargo de registro não encontrado. Verifique a configuração do REGISTERED_ROLE_ID.",
-                            ephemeral=True
-                        )
-                        return
+    def _open_part(self):
+        fd, path = tempfile.mkstemp(prefix='users_export_', suffix='.csv.gz')
+        raw = os.fdopen(fd, 'wb')
+        text = io.TextIOWrapper(gzip.GzipFile(fileobj=raw, mode='wb'), encoding='utf-8', newline='')
+        writer = csv.writer(text)
+        writer.writerow(self.HEADER)
+        return path, raw, text, writer
 
-                    # Debug: Imprimir informações detalhadas
-                    print(f"\nInformações de Remoção de Cargo:")
-                    print(f"Usuário: {interaction.user.name} (ID: {interaction.user.id})")
-                    print(f"Cargo a remover: {registered_role.name} (ID: {registered_role.id})")
-                    print(f"Bot tem admin: {interaction.guild.me.guild_permissions.administrator}")
-                    print(f"Cargos do usuário: {[r.name for r in interaction.user.roles]}")
-                    print(f"Cargo está no usuário: {registered_role in interaction.user.roles}")
-                    
-                    # Verificar permissões do bot
-                    has_perm, perm_message = await check_role_permissions(interaction.guild, interaction.guild.me, registered_role)
-                    if not has_perm:
-                        await interaction.response.send_message(
-                            f"❌ Erro de permissões: {perm_message}\nPor favor, contate um administrador do servidor.",
-                            ephemeral=True
-                        )
-                        return
+    @staticmethod
+    def _close_part(raw, text):
+        text.close()  # Finaliza o gzip sem fechar o arquivo bruto
+        raw.close()
 
-                    # Remover do banco de dados primeiro
-                    async with aiosqlite.connect('users.db') as db:
-                        await db.execute('DELETE FROM users WHERE discord_id = ?', (str(interaction.user.id),))
-                        await db.commit()
+    def _write_batch(self, part, rows):
+        """Executado em thread: grava um lote e indica se a parte atingiu o limite"""
+        path, raw, text, writer = part
+        writer.writerows(rows)
+        text.flush()
+        return raw.tell() >= self.part_limit
 
-                    # Tentar remover o cargo usando a função segura
-                    success, message = await remove_role_safely(interaction.user, registered_role)
-                    
-                    if success:
-                        await interaction.response.send_message(
-                            f"✅ Cadastro removido com sucesso!\n{message}",
-                            ephemeral=True
-                        )
-                    else:
-                        await interaction.response.send_message(
-                            f"✅ Cadastro removido do banco de dados!\n⚠️ {message}\n" +
-                            "Recomendações:\n" +
-                            "1. Verifique se o cargo do bot está acima do cargo a ser removido\n" +
-                            "2. Certifique-se que o bot tem todas as permissões necessárias\n" +
-                            "3. O cargo não deve ser gerenciado por integração",
-                            ephemeral=True
-                        )
+    async def export(self, **filters) -> tuple[list[str], int]:
+        """Gera os arquivos da exportação e retorna (caminhos, total de linhas)"""
+        sql, params = self.build_query(**filters)
+        paths = []
+        total_rows = 0
+        part = None
+        batch = []
 
-                except Exception as e:
-                    print(f"Erro geral na função remove: {str(e)}")
-                    await interaction.response.send_message(
-                        f"❌ Erro ao remover cadastro: {str(e)}",
-                        ephemeral=True
-                    )
+        async def flush_batch():
+            nonlocal part
+            if part is None:
+                part = await asyncio.to_thread(self._open_part)
+                paths.append(part[0])
+            is_full = await asyncio.to_thread(self._write_batch, part, batch)
+            if is_full:
+                await asyncio.to_thread(self._close_part, part[1], part[2])
+                part = None
 
-        except Exception as e:
-            # Se algo der errado, tentar enviar uma mensagem de erro
+        try:
+            async for row in self.db.iterate(sql, params, batch_size=self.batch_size):
+                batch.append(row)
+                total_rows += 1
+                if len(batch) >= self.batch_size:
+                    await flush_batch()
+                    batch = []
+            if batch:
+                await flush_batch()
+        except BaseException:
+            if part is not None:
+                self._close_part(part[1], part[2])
+            self.cleanup(paths)
+            raise
+
+        if part is not None:
+            await asyncio.to_thread(self._close_part, part[1], part[2])
+        return paths, total_rows
+
+    @staticmethod
+    def cleanup(paths):
+        for path in paths:
             try:
-                await interaction.response.send_message(
-                    f"❌ Ocorreu um erro ao processar sua solicitação: {str(e)}",
-                    ephemeral=True
-                )
-            except:
-                # Se já respondeu, usar followup
-                await interaction.followup.send(
-                    f"❌ Ocorreu um erro ao processar sua solicitação: {str(e)}",
-                    ephemeral=True
-                )
+                os.remove(path)
+            except OSError as e:
+                print(f"Erro ao remover arquivo temporário {path}: {e}")
 
-class RegistrationView(discord.ui.View):
-    def __init__(self):
-        super().__init__()
-        self.add_item(RegistrationSelect())
+class StatsStore:
+    """Estatísticas materializadas: totais e contadores diários mantidos de forma incremental"""
+    def __init__(self, db: UserDatabase):
+        self.db = db
 
-class AdminSelect(discord.ui.Select):
-    def __init__(self):
-        options = [
-            discord.SelectOption(
-                label="Estatísticas",
-                description="Ver dados gerais do sistema",
-                emoji="📊",
-                value="stats"
-            ),
-            discord.SelectOption(
-                label="Exportar Dados",
-                description="Baixar CSV com todos os registros",
-                emoji="📥",
-                value="export"
-            ),
-            discord.SelectOption(
-                label="Canal de Registro",
-                description="Configurar canal do sistema",
-                emoji="⚙️",
-                value="channel"
-            ),
-            discord.SelectOption(
-                label="Canal de Confirmação de Vendas",
-                description="Configurar canal para confirmação de vendas",
-                emoji="📡",
-                value="sales_confirmation"
+    async def record_credit(self, valor: int):
+        """Registra um crédito aplicado (chamado pelo fluxo de vendas)"""
+        async with self.db.transaction() as db:
+            await db.execute(
+                "UPDATE stats_totals SET value = value + 1 WHERE name = 'total_credits'"
             )
-        ]
-        super().__init__(
-            placeholder="Selecione uma ação administrativa...",
-            min_values=1,
-            max_values=1,
-            options=options
+            await db.execute(
+                "UPDATE stats_totals SET value = value + ? WHERE name = 'total_credited_value'",
+                (valor,)
+            )
+            await db.execute(
+                '''
+                INSERT INTO stats_daily (day, credits, credited_value) VALUES (date('now'), 1, ?)
+                ON CONFLICT(day) DO UPDATE SET
+                    credits = credits + 1,
+                    credited_value = credited_value + excluded.credited_value
+                ''',
+                (valor,)
+            )
+
+    async def snapshot(self, days: int = 7) -> dict:
+        """Retorna os totais e os últimos `days` dias (e o período anterior, para tendência)"""
+        totals = dict(await self.db.fetchall('SELECT name, value FROM stats_totals'))
+        rows = await self.db.fetchall(
+            '''
+            SELECT day, registrations, credits, credited_value
+            FROM stats_daily
+            WHERE day > date('now', ?)
+            ORDER BY day
+            ''',
+            (f'-{days * 2} days',)
         )
+        cutoff = (datetime.utcnow() - timedelta(days=days)).strftime('%Y-%m-%d')
+        current = [row for row in rows if row[0] > cutoff]
+        previous = [row for row in rows if row[0] <= cutoff]
 
-    async def callback(self, interaction: discord.Interaction):
-        await interaction.response.defer(ephemeral=True)
-        
-        if self.values[0] == "sales_confirmation":
-            current_channel = interaction.guild.get_channel(get_sales_confirmation_channel_id() or 0)
-            current_status = f"Canal atual: {current_channel.mention if current_channel else 'Não configurado'}"
-            
-            embed = discord.Embed(
-                title="📡 Configuração do Canal de Confirmação de Vendas",
-                description=(
-                    f"{current_status}\n\n"
-                    "Selecione abaixo o novo canal de confirmação de vendas.\n"
-                    "O bot irá processar as confirmações de vendas neste canal."
-                ),
-                color=discord.Color.blue()
-            )
-            
-            # Criar view para seleção de canal
-            class SalesConfirmationChannelSelect(discord.ui.ChannelSelect):
-                def __init__(self):
-                    super().__init__(placeholder="Selecione o canal...")
+        def summarize(period):
+            return {
+                'registrations': sum(row[1] for row in period),
+                'credits': sum(row[2] for row in period),
+                'credited_value': sum(row[3] for row in period)
+            }
 
-                async def callback(self, interaction: discord.Interaction):
-                    channel = self.values[0]
-                    config = load_config()
-                    config['sales_confirmation_channel_id'] = str(channel.id)
-                    save_config(config)
-                    
-                    await interaction.response.send_message(
-                        f"✅ Canal de confirmação de vendas configurado para {channel.mention}",
-                        ephemeral=True
-                    )
+        return {
+            'total_users': totals.get('total_users', 0),
+            'total_credits': totals.get('total_credits', 0),
+            'total_credited_value': totals.get('total_credited_value', 0),
+            'daily': current,
+            'current': summarize(current),
+            'previous': summarize(previous)
+        }
 
-            view = discord.ui.View()
-            view.add_item(SalesConfirmationChannelSelect())
-            await interaction.followup.send(embed=embed, view=view, ephemeral=True)
-            
-        elif self.values[0] == "stats":
-            async with aiosqlite.connect('users.db') as db:
-                cursor = await db.execute('SELECT COUNT(*) FROM users')
-                total_users = (await cursor.fetchone())[0]
-                
-                cursor = await db.execute('''
-                    SELECT discord_name, steam_id 
-                    FROM users 
-                    ORDER BY ROWID DESC 
-                    LIMIT 5
-                ''')
-                recent_users = await cursor.fetchall()
+# Criar instância global das estatísticas
+stats_store = StatsStore(user_db)
 
-            embed = discord.Embed(
-                title="📊 Estatísticas do Sistema",
-                description="Informações sobre o sistema de verificação",
-                color=discord.Color.blue(),
-                timestamp=datetime.now()
-            )
-            
-            embed.add_field(
-                name="Total de Usuários Verificados",
-                value=f"🔰 {total_users} usuários",
-                inline=False
-            )
-            
-            if recent_users:
-                recent_list = "\n".join([f"• {name} (Steam: {steam_id})" for name, steam_id in recent_users])
-                embed.add_field(
-                    name="Últimos Registros",
-                    value=recent_list,
-                    inline=False
-                )
-            
-            await interaction.followup.send(embed=embed, ephemeral=True)
+class BloomFilter:
+    """Filtro de Bloom simples: pode dar falso positivo, nunca falso negativo"""
+    def __init__(self, capacity: int = 100000, error_rate: float = 0.001):
+        capacity = max(1, capacity)
+        self.size = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self._bits = bytearray((self.size + 7) // 8)
 
-        elif self.values[0] == "export":
-            async with aiosqlite.connect('users.db') as db:
-                cursor = await db.execute('SELECT discord_id, discord_name, steam_id FROM users')
-                users = await cursor.fetchall()
-            
-            if not users:
-                await interaction.followup.send("❌ Não há dados para exportar.", ephemeral=True)
-                return
-            
-            csv_content = "Discord ID,Discord Name,Steam ID\n"
-            csv_content += "\n".join([f"{user[0]},{user[1]},{user[2]}" for user in users])
+    def _positions(self, key: str):
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:], 'little') | 1
+        for index in range(self.hash_count):
+            yield (first + index * second) % self.size
+
+    def add(self, key: str):
+        for position in self._positions(key):
+            self._bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, key: str) -> bool:
+        return all(self._bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+PURCHASE_RECEIVED = 'received'
+PURCHASE_CREDITED = 'credited'
+PURCHASE_FAILED = 'failed'
+PURCHASE_RETRYING = 'retrying'  # Crédito aguardando nova tentativa na fila de créditos
+PURCHASE_UNCERTAIN = 'uncertain'  # Gravação do saldo incerta: aguardando conferência pela recuperação do journal
+
+class PurchaseStore:
+    """Índice persistente de idempotência das compras (purchase_id) com cache em memória"""
+    def __init__(self, db: UserDatabase, retention_days: float = 180, front_cache_size: int = 10000,
+                 eviction_interval: float = 6 * 3600):
+        self.db = db
+        self.retention_days = retention_days
+        self.front_cache_size = front_cache_size
+        self.eviction_interval = eviction_interval
+        self._front = OrderedDict()  # purchase_id -> status
+        self._bloom = BloomFilter()
+        self._eviction_task = None
+        self.bloom_skips = 0
+        self.front_hits = 0
+        self.disk_lookups = 0
+
+    def _remember(self, purchase_id: str, status: str):
+        self._front[purchase_id] = status
+        self._front.move_to_end(purchase_id)
+        while len(self._front) > self.front_cache_size:
+            self._front.popitem(last=False)
+
+    async def _rebuild_bloom(self):
+        total = (await self.db.fetchone('SELECT COUNT(*) FROM purchases'))[0]
+        bloom = BloomFilter(capacity=max(100000, total * 2))
+        async for (purchase_id,) in self.db.iterate('SELECT purchase_id FROM purchases'):
+            bloom.add(purchase_id)
+        self._bloom = bloom
+        return total
+
+    async def start(self):
+        if self._eviction_task is not None and not self._eviction_task.done():
+            return
+        total = await self._rebuild_bloom()
+        print(f"Índice de compras carregado: {total} compras registradas")
+
+        stuck = await self.db.fetchall(
+            'SELECT purchase_id FROM purchases WHERE status = ? ORDER BY updated_at LIMIT 20',
+            (PURCHASE_RECEIVED,)
+        )
+        if stuck:
+            print(
+                f"⚠️ Compras recebidas sem conclusão em execução anterior (verificar manualmente): "
+                f"{', '.join(row[0] for row in stuck)}"
+            )
+        self._eviction_task = asyncio.create_task(self._evict_periodically())
+
+    async def close(self):
+        if self._eviction_task is not None:
+            self._eviction_task.cancel()
+            await asyncio.gather(self._eviction_task, return_exceptions=True)
+            self._eviction_task = None
+
+    async def get_status(self, purchase_id) -> str:
+        purchase_id = str(purchase_id)
+        status = self._front.get(purchase_id)
+        if status is not None:
+            self.front_hits += 1
+            return status
+        if purchase_id not in self._bloom:
+            # Nunca visto: responde sem acessar o disco
+            self.bloom_skips += 1
+            return None
+
+        self.disk_lookups += 1
+        row = await self.db.fetchone('SELECT status FROM purchases WHERE purchase_id = ?', (purchase_id,))
+        if row is None:
+            return None
+        self._remember(purchase_id, row[0])
+        return row[0]
+
+    async def is_duplicate(self, purchase_id) -> bool:
+        """Só compras com falha podem ser processadas de novo; as incertas esperam a conferência do journal"""
+        return await self.get_status(purchase_id) in (
+            PURCHASE_RECEIVED, PURCHASE_CREDITED, PURCHASE_RETRYING, PURCHASE_UNCERTAIN
+        )
+
+    async def claim(self, purchase_id, user_id=None) -> bool:
+        """Registra o recebimento de forma atômica. Retorna False se a compra já foi reservada"""
+        purchase_id = str(purchase_id)
+        now = time()
+        claimed = await self.db.execute(
+            '''
+            INSERT INTO purchases (purchase_id, status, user_id, created_at, updated_at)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(purchase_id) DO UPDATE SET
+                status = excluded.status,
+                updated_at = excluded.updated_at
+            WHERE purchases.status = ?
+            ''',
+            (purchase_id, PURCHASE_RECEIVED, str(user_id) if user_id is not None else None, now, now, PURCHASE_FAILED)
+        )
+        if claimed:
+            self._bloom.add(purchase_id)
+            self._remember(purchase_id, PURCHASE_RECEIVED)
+        return bool(claimed)
+
+    async def mark(self, purchase_id, status: str, steam_id: str = None, valor: int = None, detail: str = None):
+        purchase_id = str(purchase_id)
+        await self.db.execute(
+            '''
+            UPDATE purchases
+            SET status = ?, steam_id = COALESCE(?, steam_id), valor = COALESCE(?, valor),
+                detail = ?, updated_at = ?
+            WHERE purchase_id = ?
+            ''',
+            (status, steam_id, valor, detail, time(), purchase_id)
+        )
+        self._remember(purchase_id, status)
+
+    async def evict_expired(self) -> int:
+        cutoff = time() - self.retention_days * 24 * 3600
+        removed = await self.db.execute('DELETE FROM purchases WHERE updated_at < ?', (cutoff,))
+        if removed:
+            self._front.clear()
+            await self._rebuild_bloom()
+        return removed
+
+    async def _evict_periodically(self):
+        while True:
+            try:
+                removed = await self.evict_expired()
+                if removed:
+                    print(f"Índice de compras: {removed} registros antigos removidos")
+            except Exception as e:
+                print(f"Erro ao limpar índice de compras: {e}")
+            await asyncio.sleep(self.eviction_interval)
+
+    async def count_by_status(self) -> dict:
+        rows = await self.db.fetchall('SELECT status, COUNT(*) FROM purchases GROUP BY status')
+        return {status: count for status, count in rows}
+
+    def stats(self) -> dict:
+        return {
+            'front_size': len(self._front),
+            'front_hits': self.front_hits,
+            'bloom_skips': self.bloom_skips,
+            'disk_lookups': self.disk_lookups
+        }
+
+# Criar instância global do índice de compras
+purchase_store = PurchaseStore(user_db, retention_days=float(os.getenv('PURCHASE_RETENTION_DAYS', 180)))
+
+class SalesLedger:
+    """Ledger de vendas em segmentos JSON Lines, gravado em lotes e indexado no SQLite"""
+    SEGMENT_PREFIX = 'vendas-'
+
+    def __init__(self, db: UserDatabase, directory: str = 'vendas', flush_size: int = 100,
+                 flush_interval: float = 0.5, segment_max_bytes: int = 16 * 1024 * 1024):
+        self.db = db
+        self.directory = directory
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.segment_max_bytes = segment_max_bytes
+        self._buffer = []  # (entradas, Future) aguardando a próxima gravação
+        self._buffered = 0
+        self._unindexed = []  # Linhas já gravadas no segmento cuja inserção no índice falhou
+        self._wakeup = None
+        self._task = None
+        self._segment = None  # nome do segmento ativo, sem extensão
+        self._segment_file = None
+        self._segment_day = None
+        self.entries_written = 0
+        self.flushes = 0
+        self.rotations = 0
+
+    async def start(self):
+        if self._task is not None and not self._task.done():
+            return
+        await asyncio.to_thread(self._open_directory)
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+        print(f"Ledger de vendas ativo: {os.path.abspath(self.directory)}")
+
+    def _open_directory(self):
+        """Executado em thread: compacta segmentos deixados abertos por uma execução anterior"""
+        os.makedirs(self.directory, exist_ok=True)
+        for name in sorted(os.listdir(self.directory)):
+            if name.startswith(self.SEGMENT_PREFIX) and name.endswith('.jsonl'):
+                self._compress_segment(name[:-len('.jsonl')])
+
+    def _segment_path(self, segment: str, compressed: bool = False) -> str:
+        return os.path.join(self.directory, f"{segment}.jsonl{'.gz' if compressed else ''}")
+
+    def _compress_segment(self, segment: str):
+        source = self._segment_path(segment)
+        with open(source, 'rb') as raw, gzip.open(self._segment_path(segment, compressed=True), 'wb') as compressed:
+            shutil.copyfileobj(raw, compressed)
+        os.remove(source)
+
+    def _rotate(self):
+        """Executado em thread: fecha e compacta o segmento ativo e abre um novo"""
+        if self._segment_file is not None:
+            self._segment_file.close()
+            self._compress_segment(self._segment)
+            self.rotations += 1
+        now = datetime.now()
+        self._segment = f"{self.SEGMENT_PREFIX}{now.strftime('%Y%m%d-%H%M%S-%f')}"
+        self._segment_day = now.date()
+        self._segment_file = open(self._segment_path(self._segment), 'ab')
+
+    @staticmethod
+    def _encode(entries: list[dict]) -> list[tuple]:
+        """(linha, campos do índice) de cada entrada; erros de formato aparecem antes de tocar no arquivo"""
+        return [
+            ((json.dumps(entry, ensure_ascii=False) + '\n').encode('utf-8'), (
+                str(entry['purchase_id']), entry['steam_id'], str(entry['user_id']), entry['valor_total'],
+                int(entry['credited']), entry['balance_info'], entry['recorded_at']
+            ))
+            for entry in entries
+        ]
+
+    def _write_entries(self, encoded: list[tuple]) -> list[tuple]:
+        """Executado em thread: grava o lote no segmento ativo e retorna as linhas do índice"""
+        if (self._segment_file is None or self._segment_day != datetime.now().date()
+                or self._segment_file.tell() >= self.segment_max_bytes):
+            self._rotate()
+        start = position = self._segment_file.tell()
+        rows = []
+        for line, fields in encoded:
+            rows.append(fields + (self._segment, position))
+            position += len(line)
+        try:
+            self._segment_file.write(b''.join(line for line, _ in encoded))
+            self._segment_file.flush()
+            os.fsync(self._segment_file.fileno())
+        except Exception:
+            # Desfaz a gravação parcial: o lote volta inteiro para o buffer
+            try:
+                self._segment_file.seek(start)
+                self._segment_file.truncate()
+            except (OSError, ValueError):
+                pass
+            raise
+        return rows
+
+    def write(self, entries: list[dict]) -> asyncio.Future:
+        """Coloca as entradas no buffer. O Future termina quando elas estiverem gravadas e indexadas"""
+        future = asyncio.get_running_loop().create_future()
+        self._buffer.append((entries, future))
+        self._buffered += len(entries)
+        if self._buffered >= self.flush_size and self._wakeup is not None:
+            self._wakeup.set()
+        return future
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self._flush()
+
+    async def _index(self):
+        """Insere no índice as linhas pendentes; a posição no segmento torna a inserção idempotente"""
+        if not self._unindexed:
+            return
+        rows, self._unindexed = self._unindexed, []
+        try:
+            await self.db.executemany(
+                '''
+                INSERT OR IGNORE INTO sales_ledger
+                    (purchase_id, steam_id, user_id, valor, credited, balance_info, recorded_at, segment, position)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ''',
+                rows
+            )
+        except Exception as e:
+            print(f"❌ Erro ao indexar ledger de vendas ({len(rows)} vendas ficam para o próximo lote): {e}")
+            self._unindexed = rows + self._unindexed
+
+    async def _flush(self):
+        if not self._buffer:
+            await self._index()
+            return
+        batch, self._buffer, self._buffered = self._buffer, [], 0
+        
+        encoded, accepted = [], []
+        for batch_entries, future in batch:
+            try:
+                encoded.extend(self._encode(batch_entries))
+            except Exception as e:
+                # Entradas fora do formato não voltam ao buffer: repetir não resolveria
+                print(f"❌ Vendas descartadas do ledger (formato inválido): {e}")
+                if future is not None and not future.done():
+                    future.set_exception(e)
+                continue
+            accepted.append((batch_entries, future))
+        if not encoded:
+            await self._index()
+            return
+        
+        try:
+            rows = await asyncio.to_thread(self._write_entries, encoded)
+        except Exception as e:
+            print(f"❌ Erro ao gravar ledger de vendas ({len(encoded)} vendas voltam para o buffer): {e}")
+            # Quem espera é avisado do erro; as vendas são regravadas no próximo lote
+            for batch_entries, future in accepted:
+                if future is not None and not future.done():
+                    future.set_exception(e)
+            self._buffer = [(batch_entries, None) for batch_entries, _ in accepted] + self._buffer
+            self._buffered += len(encoded)
+            return
+        self._unindexed.extend(rows)
+        await self._index()
+        
+        self.entries_written += len(encoded)
+        self.flushes += 1
+        for _, future in accepted:
+            if future is not None and not future.done():
+                future.set_result(None)
+
+    async def close(self):
+        """Grava o que ainda está no buffer e fecha o segmento ativo"""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self._flush()
+        if self._buffered or self._unindexed:
+            print(f"⚠️ Ledger de vendas encerrado com {self._buffered} vendas não gravadas e {len(self._unindexed)} não indexadas")
+        if self._segment_file is not None:
+            await asyncio.to_thread(self._segment_file.close)
+            self._segment_file = None
+
+    async def find(self, purchase_id: str = None, steam_id: str = None, since: float = None,
+                   until: float = None, limit: int = 20) -> list[tuple]:
+        """Consulta o índice: (purchase_id, steam_id, user_id, valor, creditado, status, data, segmento, posição)"""
+        conditions, params = [], []
+        if purchase_id:
+            conditions.append('purchase_id = ?')
+            params.append(str(purchase_id))
+        if steam_id:
+            conditions.append('steam_id = ?')
+            params.append(steam_id)
+        if since is not None:
+            conditions.append('recorded_at >= ?')
+            params.append(since)
+        if until is not None:
+            conditions.append('recorded_at < ?')
+            params.append(until)
+        sql = '''
+            SELECT purchase_id, steam_id, user_id, valor, credited, balance_info, recorded_at, segment, position
+            FROM sales_ledger
+        '''
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+        sql += ' ORDER BY recorded_at DESC, id DESC LIMIT ?'
+        params.append(limit)
+        return await self.db.fetchall(sql, tuple(params))
+
+    def _read_entry(self, segment: str, position: int) -> dict:
+        path = self._segment_path(segment)
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                f.seek(position)
+                return json.loads(f.readline())
+        with gzip.open(self._segment_path(segment, compressed=True), 'rb') as f:
+            f.seek(position)
+            return json.loads(f.readline())
+
+    async def read_entry(self, segment: str, position: int) -> dict:
+        """Carrega a entrada completa (com códigos) a partir do segmento indicado no índice"""
+        return await asyncio.to_thread(self._read_entry, segment, position)
+
+    def stats(self) -> dict:
+        return {
+            'buffered': self._buffered,
+            'unindexed': len(self._unindexed),
+            'entries_written': self.entries_written,
+            'flushes': self.flushes,
+            'rotations': self.rotations,
+            'segment': self._segment
+        }
+
+# Criar instância global do ledger de vendas
+sales_ledger = SalesLedger(
+    user_db,
+    directory=os.getenv('SALES_LEDGER_DIR', 'vendas'),
+    flush_size=int(os.getenv('SALES_LEDGER_FLUSH_SIZE', 100)),
+    flush_interval=float(os.getenv('SALES_LEDGER_FLUSH_INTERVAL', 0.5))
+)
+
+class SteamCache:
+    """Cache em dois níveis (memória + tabela steam_cache no SQLite) para consultas à Steam"""
+    def __init__(self, db: UserDatabase, kind: str, ttl: float, stale_ttl: float,
+                 negative_ttl: float, max_memory: int = 10000):
+        self.db = db
+        self.kind = kind
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl  # Por quanto tempo após expirar ainda pode ser servido
+        self.negative_ttl = negative_ttl
+        self.max_memory = max_memory
+        self._memory = OrderedDict()  # key -> (value, expires_at, stale_until)
+        self._revalidating = set()
+        self._tasks = set()
+        self.hits = 0
+        self.stale_hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+
+    def _remember(self, key, entry):
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory:
+            self._memory.popitem(last=False)
+
+    async def _load(self, key):
+        entry = self._memory.get(key)
+        if entry is not None:
+            self._memory.move_to_end(key)
+            return entry
+        if not self.db.is_running:
+            return None
+
+        row = await self.db.fetchone(
+            'SELECT value, expires_at, stale_until FROM steam_cache WHERE kind = ? AND cache_key = ?',
+            (self.kind, key)
+        )
+        if row is None:
+            return None
+        entry = (json.loads(row[0]) if row[0] is not None else None, row[1], row[2])
+        self._remember(key, entry)
+        return entry
+
+    async def store(self, key, value):
+        now = time()
+        if value is None:
+            expires_at = stale_until = now + self.negative_ttl
+        else:
+            expires_at = now + self.ttl
+            stale_until = expires_at + self.stale_ttl
+        self._remember(key, (value, expires_at, stale_until))
+
+        if self.db.is_running:
+            try:
+                await self.db.execute(
+                    '''
+                    INSERT OR REPLACE INTO steam_cache (kind, cache_key, value, expires_at, stale_until)
+                    VALUES (?, ?, ?, ?, ?)
+                    ''',
+                    (self.kind, key, json.dumps(value) if value is not None else None, expires_at, stale_until)
+                )
+            except Exception as e:
+                print(f"Erro ao salvar cache Steam ({self.kind}): {e}")
+
+    async def get_or_fetch(self, key, fetcher, priority: int = PRIORITY_INTERACTIVE):
+        """Retorna o valor em cache ou chama `fetcher(priority)` (coroutine) e guarda o resultado"""
+        key = str(key)
+        entry = await self._load(key)
+        now = time()
+
+        if entry is not None:
+            value, expires_at, stale_until = entry
+            if now < expires_at:
+                if value is None:
+                    self.negative_hits += 1
+                else:
+                    self.hits += 1
+                return value
+            if value is not None and now < stale_until:
+                # Serve o valor antigo e atualiza em segundo plano
+                self.stale_hits += 1
+                self._revalidate(key, fetcher)
+                return value
+
+        self.misses += 1
+        # Só respostas da Steam vão para o cache: SteamUnavailable chega ao chamador sem ser guardada
+        value = await fetcher(priority)
+        await self.store(key, value)
+        return value
+
+    def _revalidate(self, key, fetcher):
+        if key in self._revalidating:
+            return
+        self._revalidating.add(key)
+
+        async def refresh():
+            try:
+                # A revalidação nunca passa na frente das ações dos usuários
+                value = await fetcher(PRIORITY_BACKGROUND)
+                if value is not None:
+                    await self.store(key, value)
+            except Exception as e:
+                print(f"Erro ao revalidar cache Steam ({self.kind}) para {key}: {e}")
+            finally:
+                self._revalidating.discard(key)
+
+        task = asyncio.create_task(refresh())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def purge_expired(self) -> int:
+        """Remove do SQLite as entradas que nem como antigas podem mais ser servidas"""
+        return await self.db.execute(
+            'DELETE FROM steam_cache WHERE kind = ? AND stale_until < ?',
+            (self.kind, time())
+        )
+
+    def stats(self) -> dict:
+        served = self.hits + self.stale_hits + self.negative_hits
+        total = served + self.misses
+        return {
+            'memory_size': len(self._memory),
+            'hits': self.hits,
+            'stale_hits': self.stale_hits,
+            'negative_hits': self.negative_hits,
+            'misses': self.misses,
+            'hit_rate': (served / total) if total else 0.0
+        }
+
+# Criar instâncias globais dos caches da Steam
+vanity_cache = SteamCache(
+    user_db, 'vanity',
+    ttl=float(os.getenv('STEAM_VANITY_CACHE_TTL', 7 * 24 * 3600)),
+    stale_ttl=30 * 24 * 3600,
+    negative_ttl=300
+)
+profile_cache = SteamCache(
+    user_db, 'profile',
+    ttl=float(os.getenv('STEAM_PROFILE_CACHE_TTL', 600)),
+    stale_ttl=24 * 3600,
+    negative_ttl=60
+)
+
+# Criar instância global do exportador
+user_exporter = UserExporter(user_db)
+
+async def shutdown_services():
+    """Encerra os serviços de longa duração ao desligar o bot"""
+    try:
+        await credit_coalescer.close()
+    except Exception as e:
+        print(f"Erro ao encerrar agrupador de créditos: {e}")
+
+    try:
+        await credit_retries.close()
+    except Exception as e:
+        print(f"Erro ao encerrar fila de créditos: {e}")
+
+    try:
+        await bank_backend.close()
+    except Exception as e:
+        print(f"Erro ao encerrar armazenamento de saldos: {e}")
+
+    try:
+        await sales_monitor.close()
+    except Exception as e:
+        print(f"Erro ao encerrar monitor de vendas: {e}")
+
+    try:
+        await bank_io.close()
+    except Exception as e:
+        print(f"Erro ao encerrar pool de I/O de saldos: {e}")
+
+    try:
+        await credit_journal.close()
+    except Exception as e:
+        print(f"Erro ao encerrar journal de créditos: {e}")
+
+    try:
+        await steam_http.close()
+        await attachment_http.close()
+    except Exception as e:
+        print(f"Erro ao encerrar cliente HTTP: {e}")
+
+    try:
+        await sales_catchup.close()
+    except Exception as e:
+        print(f"Erro ao salvar marca d'água do canal de vendas: {e}")
+
+    try:
+        await sales_ledger.close()
+    except Exception as e:
+        print(f"Erro ao encerrar ledger de vendas: {e}")
+
+    try:
+        await purchase_store.close()
+    except Exception as e:
+        print(f"Erro ao encerrar índice de compras: {e}")
+
+    try:
+        await user_db.close()
+    except Exception as e:
+        print(f"Erro ao encerrar banco de dados: {e}")
+
+class ProjetoFMBot(commands.Bot):
+    async def close(self):
+        # Esvaziar a fila de vendas enquanto a conexão com o Discord ainda está aberta
+        await sales_pipeline.close()
+        await super().close()
+        await shutdown_services()
+
+# Configuração do bot
+intents = discord.Intents.all()
+bot = ProjetoFMBot(command_prefix='!', intents=intents)
+
+# Regex para validar URL da Steam
+STEAM_PROFILE_REGEX = re.compile(
+    r'^(?:https?://)?(?:www\.)?steamcommunity\.com/(profiles|id|user)/([^/?#\s]+)',
+    re.IGNORECASE
+)
+STEAM_SHORT_LINK_REGEX = re.compile(r'^(?:https?://)?s\.team/p/([^/?#\s]+)', re.IGNORECASE)
+STEAM_ID64_REGEX = re.compile(r'^\d{17}$')
+STEAM_ID2_REGEX = re.compile(r'^STEAM_([0-5]):([01]):(\d{1,10})$', re.IGNORECASE)
+STEAM_ID3_REGEX = re.compile(r'^\[?U:1:(\d{1,10})\]?$', re.IGNORECASE)
+STEAM_VANITY_REGEX = re.compile(r'^[\w-]{2,32}$')
+STEAM_INVITE_CODE_REGEX = re.compile(r'^[bcdfghjkmnpqrtvw]{1,8}$')
+
+# SteamID64 de contas individuais = base + account ID
+STEAM_ID64_BASE = 76561197960265728
+STEAM_ACCOUNT_ID_MAX = 2 ** 32 - 1
+
+# Alfabeto dos códigos de convite (s.team/p/xxxx-xxxx): dígitos hexadecimais substituídos por letras
+STEAM_INVITE_ALPHABET = str.maketrans('bcdfghjkmnpqrtvw', '0123456789abcdef')
+
+def steam_id64_from_account_id(account_id: int) -> str:
+    if not 0 < account_id <= STEAM_ACCOUNT_ID_MAX:
+        return None
+    return str(STEAM_ID64_BASE + account_id)
+
+def steam_account_id(steam_id64) -> int:
+    """Retorna o account ID de um SteamID64 individual válido ou None"""
+    steam_id64 = str(steam_id64)
+    if not STEAM_ID64_REGEX.match(steam_id64):
+        return None
+    account_id = int(steam_id64) - STEAM_ID64_BASE
+    return account_id if 0 < account_id <= STEAM_ACCOUNT_ID_MAX else None
+
+def steam_id64_to_steam2(steam_id64) -> str:
+    account_id = steam_account_id(steam_id64)
+    if account_id is None:
+        return None
+    return f"STEAM_1:{account_id & 1}:{account_id >> 1}"
+
+def steam_id64_to_steam3(steam_id64) -> str:
+    account_id = steam_account_id(steam_id64)
+    if account_id is None:
+        return None
+    return f"[U:1:{account_id}]"
+
+def steam_id64_from_invite_code(code: str) -> str:
+    code = code.replace('-', '').lower()
+    if not STEAM_INVITE_CODE_REGEX.match(code):
+        return None
+    return steam_id64_from_account_id(int(code.translate(STEAM_INVITE_ALPHABET), 16))
+
+def parse_steam_identifier(text: str):
+    """
+    Interpreta localmente qualquer formato de identificação Steam.
+    Retorna ('steamid64', id), ('vanity', nome) ou None se o formato for inválido.
+    Só o caso 'vanity' precisa da API da Steam para ser resolvido.
+    """
+    text = text.strip()
+
+    # SteamID64 puro
+    if STEAM_ID64_REGEX.match(text):
+        return ('steamid64', text) if steam_account_id(text) is not None else None
+
+    # SteamID2 (STEAM_X:Y:Z)
+    match = STEAM_ID2_REGEX.match(text)
+    if match:
+        steam_id = steam_id64_from_account_id(int(match.group(3)) * 2 + int(match.group(2)))
+        return ('steamid64', steam_id) if steam_id else None
+
+    # SteamID3 ([U:1:Z])
+    match = STEAM_ID3_REGEX.match(text)
+    if match:
+        steam_id = steam_id64_from_account_id(int(match.group(1)))
+        return ('steamid64', steam_id) if steam_id else None
+
+    # Link curto de convite (s.team/p/xxxx-xxxx)
+    match = STEAM_SHORT_LINK_REGEX.match(text)
+    if match:
+        steam_id = steam_id64_from_invite_code(match.group(1))
+        return ('steamid64', steam_id) if steam_id else None
+
+    # Links de perfil (profiles/, id/ e user/), ignorando query string e fragmentos
+    match = STEAM_PROFILE_REGEX.match(text)
+    if match:
+        kind, value = match.group(1).lower(), match.group(2)
+        if kind == 'profiles':
+            return ('steamid64', value) if steam_account_id(value) is not None else None
+        if kind == 'user':
+            steam_id = steam_id64_from_invite_code(value)
+            return ('steamid64', steam_id) if steam_id else None
+        return ('vanity', value) if STEAM_VANITY_REGEX.match(value) else None
+
+    return None
+
+class SteamLinkModal(discord.ui.Modal, title='Vincular Conta Steam'):
+    def __init__(self, is_update=False):
+        super().__init__()
+        self.is_update = is_update
+        
+    steam_url = discord.ui.TextInput(
+        label='Link do Perfil Steam',
+        placeholder='https://steamcommunity.com/id/seunome',
+        required=True,
+        min_length=7,
+        max_length=100
+    )
+
+    async def on_submit(self, interaction: discord.Interaction):
+        await interaction.response.defer(ephemeral=True)
+        
+        # Validar formato da URL
+        if parse_steam_identifier(str(self.steam_url)) is None:
+            await interaction.followup.send(
+                "❌ Link inválido! Por favor, use um link válido do Steam.\n"
+                "Exemplos:\n"
+                "- https://steamcommunity.com/id/seunome\n"
+                "- https://steamcommunity.com/profiles/76561198xxxxxxxxx\n"
+                "- https://s.team/p/xxxx-xxxx\n"
+                "- 76561198xxxxxxxxx, STEAM_1:0:xxxxxxx ou [U:1:xxxxxxx]\n"
+                "Certifique-se de copiar o link completo do seu perfil.",
+                ephemeral=True
+            )
+            return
+
+        await interaction.followup.send("🔍 Verificando seu perfil Steam... Por favor, aguarde.", ephemeral=True)
+        steam_id = await get_steam_id64(str(self.steam_url))
+
+        if not steam_id:
+            await interaction.followup.send(
+                "❌ Não foi possível verificar seu perfil da Steam. Certifique-se de que:\n"
+                "1. O link está correto e completo\n"
+                "2. O perfil existe\n"
+                "3. Você copiou o link diretamente do seu perfil Steam\n\n"
+                "Dica: Abra seu perfil Steam no navegador e copie a URL completa.",
+                ephemeral=True
+            )
+            return
+
+        # Verificar se a conta Steam já pertence a outro usuário
+        linked_discord_id = await steam_id_cache.get_discord_id(steam_id)
+        if linked_discord_id and linked_discord_id != str(interaction.user.id):
+            await interaction.followup.send(
+                "❌ Esta conta Steam já está vinculada a outro usuário do Discord.",
+                ephemeral=True
+            )
+            return
+
+        # Buscar dados do perfil
+        profile_data = await get_steam_profile_data(steam_id)
+        if not profile_data:
+            await interaction.followup.send(
+                "❌ Não foi possível obter os dados do perfil. Erro ao acessar a API da Steam.",
+                ephemeral=True
+            )
+            return
+
+        # Criar embed com os dados do perfil
+        embed = discord.Embed(
+            title="Confirmar Perfil Steam",
+            description="Por favor, confirme se este é seu perfil Steam:",
+            color=discord.Color.blue()
+        )
+        
+        embed.add_field(name="Nome Steam", value=profile_data.get('personaname', 'N/A'), inline=True)
+        embed.add_field(name="Steam ID", value=steam_id, inline=True)
+        embed.add_field(
+            name="Outros formatos",
+            value=f"{steam_id64_to_steam2(steam_id)}\n{steam_id64_to_steam3(steam_id)}",
+            inline=True
+        )
+        
+        if profile_data.get('profileurl'):
+            embed.add_field(name="Link do Perfil", value=profile_data['profileurl'], inline=False)
+        
+        # Status do perfil
+        visibility = "Público" if profile_data.get('communityvisibilitystate', 1) == 3 else "Privado/Limitado"
+        embed.add_field(name="Visibilidade", value=visibility, inline=True)
+        
+        # Status online
+        status_map = {
+            0: "Offline",
+            1: "Online",
+            2: "Ocupado",
+            3: "Ausente",
+            4: "Dormindo",
+            5: "Trocando",
+            6: "Jogando"
+        }
+        status = status_map.get(profile_data.get('personastate', 0), "Desconhecido")
+        embed.add_field(name="Status", value=status, inline=True)
+        
+        if profile_data.get('avatarfull'):
+            embed.set_thumbnail(url=profile_data['avatarfull'])
+
+        # Criar view com botões de confirmação
+        view = ConfirmationView(steam_id, profile_data, self.is_update)
+        message = await interaction.followup.send(
+            embed=embed,
+            view=view,
+            ephemeral=True
+        )
+        view.message = message
+
+class ConfirmationView(discord.ui.View):
+    def __init__(self, steam_id: str, profile_data: dict, is_update: bool = False):
+        super().__init__(timeout=180)  # 3 minutos de timeout
+        self.steam_id = steam_id
+        self.profile_data = profile_data
+        self.is_update = is_update
+
+    @discord.ui.button(label="Confirmar", style=discord.ButtonStyle.green)
+    async def confirm(self, interaction: discord.Interaction, button: discord.ui.Button):
+        # Salvar/Atualizar no banco de dados
+        try:
+            await user_db.execute(
+                '''
+                INSERT INTO users (discord_id, discord_name, steam_id, registered_at)
+                VALUES (?, ?, ?, datetime('now'))
+                ON CONFLICT(discord_id) DO UPDATE SET
+                    discord_name = excluded.discord_name,
+                    steam_id = excluded.steam_id
+                ''',
+                (str(interaction.user.id), interaction.user.name, self.steam_id)
+            )
+        except sqlite3.IntegrityError:
+            # Índice único em steam_id: a conta já pertence a outro usuário
+            await interaction.response.edit_message(
+                content="❌ Esta conta Steam já está vinculada a outro usuário do Discord.",
+                view=None,
+                embed=None
+            )
+            return
+        steam_id_cache.set(interaction.user.id, self.steam_id)
+
+        # Adicionar cargo de registro
+        registered_role = interaction.guild.get_role(get_role_id())
+        if registered_role:
+            await interaction.user.add_roles(registered_role)
+            action = "atualizada" if self.is_update else "vinculada"
+            await interaction.response.edit_message(
+                content=f"✅ Conta Steam {action} com sucesso!\n"
+                f"Steam ID: {self.steam_id}\n"
+                f"Cargo {registered_role.mention} {'mantido' if self.is_update else 'adicionado'}!",
+                view=None,
+                embed=None
+            )
+        else:
+            await interaction.response.edit_message(
+                content="⚠️ Registro concluído, mas não foi possível gerenciar o cargo (cargo não encontrado).",
+                view=None,
+                embed=None
+            )
+
+    @discord.ui.button(label="Alterar", style=discord.ButtonStyle.primary)
+    async def change(self, interaction: discord.Interaction, button: discord.ui.Button):
+        modal = SteamLinkModal(self.is_update)
+        await interaction.response.send_modal(modal)
+
+    @discord.ui.button(label="Cancelar", style=discord.ButtonStyle.red)
+    async def cancel(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await interaction.response.edit_message(
+            content="❌ Verificação cancelada.",
+            view=None,
+            embed=None
+        )
+
+    async def on_timeout(self):
+        for child in self.children:
+            child.disabled = True
+        try:
+            await self.message.edit(
+                content="⏰ Tempo expirado. Por favor, inicie o processo novamente.",
+                view=self
+            )
+        except:
+            pass
+
+class RegistrationSelect(discord.ui.Select):
+    def __init__(self):
+        options = [
+            discord.SelectOption(
+                label="Registrar",
+                description="Vincular sua conta Steam",
+                emoji="🟢",
+                value="register"
+            ),
+            discord.SelectOption(
+                label="Consultar Cadastro",
+                description="Ver sua conta vinculada",
+                emoji="🔵",
+                value="check"
+            ),
+            discord.SelectOption(
+                label="Alterar Conta Steam",
+                description="Mudar sua conta Steam",
+                emoji="⚫",
+                value="change"
+            ),
+            discord.SelectOption(
+                label="Remover Cadastro",
+                description="Desvincular sua conta",
+                emoji="🔴",
+                value="remove"
+            )
+        ]
+        super().__init__(
+            placeholder="Selecione uma ação...",
+            min_values=1,
+            max_values=1,
+            options=options
+        )
+
+    async def callback(self, interaction: discord.Interaction):
+        try:
+            # Consultar o registro existente uma única vez para todas as opções
+            existing_user = await steam_id_cache.get_steam_id(interaction.user.id)
+
+            # Verificar registro existente para opções que requerem cadastro
+            if self.values[0] in ["check", "change", "remove"]:
+                if not existing_user:
+                    await interaction.response.send_message(
+                        "❌ Você não possui uma conta Steam vinculada. Use a opção 'Registrar' primeiro.",
+                        ephemeral=True
+                    )
+                    return
+
+            # Processar cada opção
+            if self.values[0] == "register":
+                # Verificar permissões antes de prosseguir
+                registered_role = interaction.guild.get_role(get_role_id())
+                if registered_role:
+                    has_perm, message = await check_role_permissions(interaction.guild, interaction.guild.me, registered_role)
+                    if not has_perm:
+                        await interaction.response.send_message(
+                            f"⚠️ {message}\nPor favor, contate um administrador do servidor.",
+                            ephemeral=True
+                        )
+                        return
+
+                # Verificar se já tem registro
+                if existing_user:
+                    await interaction.response.send_message(
+                        "Você já possui uma conta Steam vinculada. Use a opção 'Alterar Conta Steam' se desejar fazer alterações.",
+                        ephemeral=True
+                    )
+                    return
+
+                modal = SteamLinkModal()
+                await interaction.response.send_modal(modal)
+
+            elif self.values[0] == "check":
+                steam_id = existing_user
+                profile_data = await get_steam_profile_data(steam_id)
+
+                if not profile_data:
+                    await interaction.response.send_message(
+                        "❌ Não foi possível obter os dados atualizados do seu perfil Steam.",
+                        ephemeral=True
+                    )
+                    return
+
+                embed = discord.Embed(
+                    title="Seu Perfil Steam Vinculado",
+                    description="Estes são os dados do seu perfil Steam atual:",
+                    color=discord.Color.blue()
+                )
+                embed.add_field(name="Nome Steam", value=profile_data.get('personaname', 'N/A'), inline=True)
+                embed.add_field(name="Steam ID", value=steam_id, inline=True)
+                if profile_data.get('avatarfull'):
+                    embed.set_thumbnail(url=profile_data['avatarfull'])
+
+                await interaction.response.send_message(embed=embed, ephemeral=True)
+
+            elif self.values[0] == "change":
+                modal = SteamLinkModal(is_update=True)
+                await interaction.response.send_modal(modal)
+
+            elif self.values[0] == "remove":
+                try:
+                    # Verificar permissões antes de prosseguir
+                    registered_role = interaction.guild.get_role(get_role_id())
+                    if not registered_role:
+                        await interaction.response.send_message(
+                            "❌ Erro: Cargo de registro não encontrado. Verifique a configuração do REGISTERED_ROLE_ID.",
+                            ephemeral=True
+                        )
+                        return
+
+                    # Debug: Imprimir informações detalhadas
+                    print(f"\nInformações de Remoção de Cargo:")
+                    print(f"Usuário: {interaction.user.name} (ID: {interaction.user.id})")
+                    print(f"Cargo a remover: {registered_role.name} (ID: {registered_role.id})")
+                    print(f"Bot tem admin: {interaction.guild.me.guild_permissions.administrator}")
+                    print(f"Cargos do usuário: {[r.name for r in interaction.user.roles]}")
+                    print(f"Cargo está no usuário: {registered_role in interaction.user.roles}")
+                    
+                    # Verificar permissões do bot
+                    has_perm, perm_message = await check_role_permissions(interaction.guild, interaction.guild.me, registered_role)
+                    if not has_perm:
+                        await interaction.response.send_message(
+                            f"❌ Erro de permissões: {perm_message}\nPor favor, contate um administrador do servidor.",
+                            ephemeral=True
+                        )
+                        return
+
+                    # Remover do banco de dados primeiro
+                    await user_db.execute('DELETE FROM users WHERE discord_id = ?', (str(interaction.user.id),))
+                    steam_id_cache.remove(interaction.user.id)
+
+                    # Tentar remover o cargo usando a função segura
+                    success, message = await remove_role_safely(interaction.user, registered_role)
+                    
+                    if success:
+                        await interaction.response.send_message(
+                            f"✅ Cadastro removido com sucesso!\n{message}",
+                            ephemeral=True
+                        )
+                    else:
+                        await interaction.response.send_message(
+                            f"✅ Cadastro removido do banco de dados!\n⚠️ {message}\n" +
+                            "Recomendações:\n" +
+                            "1. Verifique se o cargo do bot está acima do cargo a ser removido\n" +
+                            "2. Certifique-se que o bot tem todas as permissões necessárias\n" +
+                            "3. O cargo não deve ser gerenciado por integração",
+                            ephemeral=True
+                        )
+
+                except Exception as e:
+                    print(f"Erro geral na função remove: {str(e)}")
+                    await interaction.response.send_message(
+                        f"❌ Erro ao remover cadastro: {str(e)}",
+                        ephemeral=True
+                    )
+
+        except Exception as e:
+            # Se algo der errado, tentar enviar uma mensagem de erro
+            try:
+                await interaction.response.send_message(
+                    f"❌ Ocorreu um erro ao processar sua solicitação: {str(e)}",
+                    ephemeral=True
+                )
+            except:
+                # Se já respondeu, usar followup
+                await interaction.followup.send(
+                    f"❌ Ocorreu um erro ao processar sua solicitação: {str(e)}",
+                    ephemeral=True
+                )
+
+class RegistrationView(discord.ui.View):
+    def __init__(self):
+        super().__init__()
+        self.add_item(RegistrationSelect())
+
+class AdminSelect(discord.ui.Select):
+    def __init__(self):
+        options = [
+            discord.SelectOption(
+                label="Estatísticas",
+                description="Ver dados gerais do sistema",
+                emoji="📊",
+                value="stats"
+            ),
+            discord.SelectOption(
+                label="Exportar Dados",
+                description="Baixar CSV dos registros (com filtros)",
+                emoji="📥",
+                value="export"
+            ),
+            discord.SelectOption(
+                label="Canal de Registro",
+                description="Configurar canal do sistema",
+                emoji="⚙️",
+                value="channel"
+            ),
+            discord.SelectOption(
+                label="Canal de Confirmação de Vendas",
+                description="Configurar canal para confirmação de vendas",
+                emoji="📡",
+                value="sales_confirmation"
+            ),
+            discord.SelectOption(
+                label="Consultar Vendas",
+                description="Buscar vendas por ID da compra ou Steam ID",
+                emoji="🧾",
+                value="sales_lookup"
+            ),
+            discord.SelectOption(
+                label="Fila de Créditos",
+                description="Créditos pendentes e falhas definitivas",
+                emoji="🔁",
+                value="credit_queue"
+            ),
+            discord.SelectOption(
+                label="Conflitos de Steam ID",
+                description="Vínculos removidos por Steam ID duplicado",
+                emoji="🔗",
+                value="steam_conflicts"
+            ),
+            discord.SelectOption(
+                label="Consultar Saldo",
+                description="Saldo atual de um jogador por Steam ID ou Discord ID",
+                emoji="💰",
+                value="balance_lookup"
+            )
+        ]
+        super().__init__(
+            placeholder="Selecione uma ação administrativa...",
+            min_values=1,
+            max_values=1,
+            options=options
+        )
+
+    async def callback(self, interaction: discord.Interaction):
+        if self.values[0] == "sales_lookup":
+            # O modal precisa ser a primeira resposta da interação
+            await interaction.response.send_modal(SalesLookupModal())
+            return
+        if self.values[0] == "balance_lookup":
+            await interaction.response.send_modal(BalanceLookupModal())
+            return
+
+        await interaction.response.defer(ephemeral=True)
+        
+        if self.values[0] == "sales_confirmation":
+            current_channel = interaction.guild.get_channel(get_sales_confirmation_channel_id() or 0)
+            current_status = f"Canal atual: {current_channel.mention if current_channel else 'Não configurado'}"
+            
+            embed = discord.Embed(
+                title="📡 Configuração do Canal de Confirmação de Vendas",
+                description=(
+                    f"{current_status}\n\n"
+                    "Selecione abaixo o novo canal de confirmação de vendas.\n"
+                    "O bot irá processar as confirmações de vendas neste canal."
+                ),
+                color=discord.Color.blue()
+            )
+            
+            # Criar view para seleção de canal
+            class SalesConfirmationChannelSelect(discord.ui.ChannelSelect):
+                def __init__(self):
+                    super().__init__(placeholder="Selecione o canal...")
+
+                async def callback(self, interaction: discord.Interaction):
+                    channel = self.values[0]
+                    config_store.update(sales_confirmation_channel_id=str(channel.id))
+                    
+                    await interaction.response.send_message(
+                        f"✅ Canal de confirmação de vendas configurado para {channel.mention}",
+                        ephemeral=True
+                    )
+
+            view = discord.ui.View()
+            view.add_item(SalesConfirmationChannelSelect())
+            await interaction.followup.send(embed=embed, view=view, ephemeral=True)
+            
+        elif self.values[0] == "stats":
+            stats = await stats_store.snapshot(days=7)
+            
+            recent_users = await user_db.fetchall('''
+                SELECT discord_name, steam_id 
+                FROM users 
+                ORDER BY registered_at DESC, ROWID DESC 
+                LIMIT 5
+            ''')
+
+            embed = discord.Embed(
+                title="📊 Estatísticas do Sistema",
+                description="Informações sobre o sistema de verificação",
+                color=discord.Color.blue(),
+                timestamp=datetime.now()
+            )
+            
+            embed.add_field(
+                name="Total de Usuários Verificados",
+                value=f"🔰 {stats['total_users']} usuários",
+                inline=False
+            )
+            
+            embed.add_field(
+                name="Vendas Creditadas",
+                value=(
+                    f"💰 {stats['total_credits']} créditos aplicados\n"
+                    f"💎 {stats['total_credited_value']} de valor total creditado"
+                ),
+                inline=False
+            )
+            
+            def trend(current, previous):
+                if current > previous:
+                    return f"📈 +{current - previous}"
+                if current < previous:
+                    return f"📉 -{previous - current}"
+                return "➖ 0"
+            
+            current, previous = stats['current'], stats['previous']
+            embed.add_field(
+                name="Últimos 7 dias (vs. 7 dias anteriores)",
+                value=(
+                    f"🟢 Registros: {current['registrations']} ({trend(current['registrations'], previous['registrations'])})\n"
+                    f"💰 Créditos: {current['credits']} ({trend(current['credits'], previous['credits'])})\n"
+                    f"💎 Valor: {current['credited_value']} ({trend(current['credited_value'], previous['credited_value'])})"
+                ),
+                inline=False
+            )
+            
+            if stats['daily']:
+                daily_list = "\n".join([
+                    f"• {datetime.strptime(day, '%Y-%m-%d').strftime('%d/%m')}: "
+                    f"{registrations} registros, {credits} créditos ({credited_value})"
+                    for day, registrations, credits, credited_value in stats['daily']
+                ])
+                embed.add_field(
+                    name="Movimento Diário",
+                    value=daily_list,
+                    inline=False
+                )
+            
+            steam_cache_lines = []
+            for label, cache in (("Vanity URLs", vanity_cache), ("Perfis", profile_cache)):
+                cache_info = cache.stats()
+                steam_cache_lines.append(
+                    f"• {label}: {cache_info['hit_rate']:.0%} de acertos "
+                    f"({cache_info['hits']} novos, {cache_info['stale_hits']} antigos, "
+                    f"{cache_info['negative_hits']} negativos, {cache_info['misses']} falhas)"
+                )
+            embed.add_field(
+                name="Cache da API Steam",
+                value="\n".join(steam_cache_lines),
+                inline=False
+            )
+            
+            limiter_stats = steam_rate_limiter.stats()
+            lanes = limiter_stats['lanes']
+            embed.add_field(
+                name="Fila da API Steam",
+                value=(
+                    f"⚡ Interativa: {lanes['interactive']['queue_depth']} na fila, "
+                    f"espera média {lanes['interactive']['avg_wait']:.2f}s (máx. {lanes['interactive']['max_wait']:.2f}s)\n"
+                    f"🐢 Segundo plano: {lanes['background']['queue_depth']} na fila, "
+                    f"espera média {lanes['background']['avg_wait']:.2f}s (máx. {lanes['background']['max_wait']:.2f}s)\n"
+                    f"⛔ Bloqueios por 429: {limiter_stats['penalties']}\n"
+                    f"♻️ Consultas duplicadas evitadas: "
+                    f"{vanity_lookups.duplicates + profile_lookups.duplicates}"
+                ),
+                inline=False
+            )
+            
+            bank_checked = (
+                sales_monitor.bank_checked_at.strftime('%d/%m %H:%M:%S')
+                if sales_monitor.bank_checked_at else "nunca"
+            )
+            bank_icon = "✅" if sales_monitor.bank_status == BANK_STATUS_OK else "⚠️"
+            bank_io_stats = bank_io.stats()
+            journal_stats = credit_journal.stats()
+            coalescer_stats = credit_coalescer.stats()
+            lock_stats = bank_file_locks.stats()
+            busiest_files = bank_file_locks.busiest()
+            embed.add_field(
+                name="Diretório de Saldos (BANK_FILE)",
+                value=(
+                    f"{bank_icon} {sales_monitor.bank_status_message} (verificado: {bank_checked})\n"
+                    f"💾 I/O: {bank_io_stats['pending']} arquivos em uso, {bank_io_stats['completed']} operações, "
+                    f"{bank_io_stats['timeouts']} tempos esgotados (mais lenta: {bank_io_stats['max_duration']:.2f}s)\n"
+                    f"📒 Journal: {journal_stats['in_flight']} créditos em andamento, "
+                    f"{journal_stats['records_per_fsync']:.1f} registros por fsync, "
+                    f"{journal_stats['compactions']} compactações\n"
+                    f"🧺 Agrupamento: {coalescer_stats['credits']} compras em {coalescer_stats['batches']} gravações "
+                    f"(maior lote: {coalescer_stats['largest_batch']})\n"
+                    f"🔒 Locks: {lock_stats['size']} ativos, {lock_stats['waiting']} aguardando, "
+                    f"{lock_stats['contended']} disputas (espera máx. {lock_stats['max_wait']:.2f}s, "
+                    f"fila máx. {lock_stats['max_queue']})"
+                    + (
+                        "\n🔥 " + ", ".join(f"{os.path.basename(path)} ({waiting})" for path, waiting in busiest_files)
+                        if busiest_files else ""
+                    )
+                ),
+                inline=False
+            )
+            
+            backend_stats = bank_backend.stats()
+            if backend_stats['backend'] == 'sqlite':
+                ledger_summary = await bank_backend.summary()
+                balance_check = (
+                    "✅ Partidas balanceadas" if ledger_summary['imbalance'] == 0
+                    else f"⚠️ Diferença nas partidas: {ledger_summary['imbalance']}"
+                )
+                embed.add_field(
+                    name="Armazenamento de Saldos (ledger SQLite)",
+                    value=(
+                        f"📚 {ledger_summary['accounts']} contas, {ledger_summary['credits']} créditos "
+                        f"(total {ledger_summary['credited_total']})\n"
+                        f"⏳ {backend_stats['pending']} saldos aguardando gravação nos arquivos "
+                        f"({backend_stats['failing']} com falha), {backend_stats['projections']} gravados\n"
+                        f"🚨 Desistidos após {bank_backend.max_attempts} tentativas (verificar manualmente): "
+                        f"{backend_stats['stalled']}\n"
+                        f"🎮 Ajustes do servidor incorporados: {backend_stats['syncs']}\n"
+                        f"{balance_check}"
+                    ),
+                    inline=False
+                )
+            
+            balance_stats = balance_cache.stats()
+            last_scan = (
+                f"{balance_stats['last_scan_at'].strftime('%d/%m %H:%M:%S')} em {balance_stats['last_scan_duration']:.1f}s"
+                if balance_stats['last_scan_at'] else "nunca"
+            )
+            embed.add_field(
+                name="Cache de Saldos",
+                value=(
+                    f"💰 {balance_stats['size']} jogadores em memória, {balance_stats['cursor']} alterações registradas\n"
+                    f"🎯 Leituras evitadas: {balance_stats['hits']} / relidas: {balance_stats['misses']} "
+                    f"({balance_stats['hit_rate']:.0%})\n"
+                    f"🔎 Última varredura: {last_scan} ({balance_stats['scan_errors']} arquivos ilegíveis)"
+                ),
+                inline=False
+            )
+            
+            ledger_stats = sales_ledger.stats()
+            embed.add_field(
+                name="Ledger de Vendas",
+                value=(
+                    f"🧾 {ledger_stats['entries_written']} vendas gravadas em {ledger_stats['flushes']} lotes "
+                    f"({ledger_stats['buffered']} no buffer)\n"
+                    f"📁 Segmento atual: {ledger_stats['segment'] or 'nenhum'}"
+                ),
+                inline=False
+            )
+            
+            purchase_counts = await purchase_store.count_by_status()
+            purchase_stats = purchase_store.stats()
+            embed.add_field(
+                name="Índice de Compras",
+                value=(
+                    f"✅ {purchase_counts.get(PURCHASE_CREDITED, 0)} creditadas / "
+                    f"❌ {purchase_counts.get(PURCHASE_FAILED, 0)} com falha / "
+                    f"⏳ {purchase_counts.get(PURCHASE_RECEIVED, 0)} em andamento / "
+                    f"🔁 {purchase_counts.get(PURCHASE_RETRYING, 0)} na fila de créditos / "
+                    f"❔ {purchase_counts.get(PURCHASE_UNCERTAIN, 0)} aguardando conferência\n"
+                    f"🔎 Consultas ao disco: {purchase_stats['disk_lookups']} "
+                    f"(evitadas pelo filtro: {purchase_stats['bloom_skips']})"
+                ),
+                inline=False
+            )
+            
+            cache_stats = steam_id_cache.stats()
+            embed.add_field(
+                name="Cache de Steam IDs",
+                value=(
+                    f"📦 {cache_stats['size']} registros em memória\n"
+                    f"🎯 {cache_stats['hits']} acertos / {cache_stats['misses']} falhas "
+                    f"({cache_stats['hit_rate']:.0%})"
+                ),
+                inline=False
+            )
+            
+            if recent_users:
+                recent_list = "\n".join([f"• {name} (Steam: {steam_id})" for name, steam_id in recent_users])
+                embed.add_field(
+                    name="Últimos Registros",
+                    value=recent_list,
+                    inline=False
+                )
+            
+            await interaction.followup.send(embed=embed, ephemeral=True)
+
+        elif self.values[0] == "steam_conflicts":
+            total = (await user_db.fetchone('SELECT COUNT(*) FROM steam_id_conflicts'))[0]
+            conflicts = await user_db.fetchall(
+                '''
+                SELECT discord_id, discord_name, steam_id, kept_discord_id, detected_at
+                FROM steam_id_conflicts ORDER BY detected_at DESC, id DESC LIMIT 20
+                '''
+            )
+            embed = discord.Embed(
+                title="🔗 Conflitos de Steam ID",
+                description=(
+                    f"{total} registros perderam o vínculo Steam porque a mesma conta estava em outro registro "
+                    f"mais recente. Esses usuários precisam se registrar de novo para receber créditos."
+                    if total else "Nenhum vínculo Steam foi removido por duplicidade."
+                ),
+                color=discord.Color.orange() if total else discord.Color.green()
+            )
+            for discord_id, discord_name, steam_id, kept_discord_id, detected_at in conflicts:
+                embed.add_field(
+                    name=f"{discord_name or 'Sem nome'} ({discord_id})",
+                    value=(
+                        f"Steam antigo: {steam_id}\n"
+                        f"Mantido com: <@{kept_discord_id}> ({kept_discord_id})\n"
+                        f"{datetime.fromtimestamp(detected_at).strftime('%d/%m/%Y %H:%M:%S')}"
+                    ),
+                    inline=False
+                )
+            if total > len(conflicts):
+                embed.set_footer(text=f"Mostrando os {len(conflicts)} mais recentes de {total}")
+            await interaction.followup.send(embed=embed, ephemeral=True)
+
+        elif self.values[0] == "credit_queue":
+            counts = await credit_retries.counts()
+            dead_letters = await credit_retries.dead_letters()
+            next_attempt = (
+                datetime.fromtimestamp(counts['next_attempt_at']).strftime('%d/%m %H:%M:%S')
+                if counts['next_attempt_at'] else "nenhuma"
+            )
+            embed = discord.Embed(
+                title="🔁 Fila de Créditos",
+                description=(
+                    f"⏳ Aguardando arquivo de saldo: {counts['retries'].get(RETRY_MISSING_FILE, 0)}\n"
+                    f"🌐 Aguardando nova tentativa: {counts['retries'].get(RETRY_TRANSIENT, 0)}\n"
+                    f"❔ Aguardando conferência do journal: {counts['retries'].get(RETRY_UNCERTAIN, 0)}\n"
+                    f"🕒 Próxima tentativa: {next_attempt}\n"
+                    f"☠️ Falhas definitivas: {counts['dead_letters']}"
+                ),
+                color=discord.Color.blue()
+            )
+            for dead_id, steam_id, valor, purchase_ids, attempts, last_error, failed_at in dead_letters[:10]:
+                embed.add_field(
+                    name=f"#{dead_id} • Steam {steam_id} • {valor}",
+                    value=(
+                        f"Compras: {', '.join(str(purchase_id) for purchase_id in purchase_ids)}\n"
+                        f"{attempts} tentativas • {last_error}\n"
+                        f"{datetime.fromtimestamp(failed_at).strftime('%d/%m/%Y %H:%M:%S')}"
+                    ),
+                    inline=False
+                )
+            if dead_letters:
+                view = discord.ui.View()
+                view.add_item(DeadLetterReplaySelect(dead_letters))
+                await interaction.followup.send(embed=embed, view=view, ephemeral=True)
+            else:
+                await interaction.followup.send(embed=embed, ephemeral=True)
+
+        elif self.values[0] == "export":
+            embed = discord.Embed(
+                title="📥 Exportar Dados",
+                description="Selecione quais registros devem ser exportados.",
+                color=discord.Color.blue()
+            )
+            view = discord.ui.View()
+            view.add_item(ExportFilterSelect())
+            await interaction.followup.send(embed=embed, view=view, ephemeral=True)
+
+        elif self.values[0] == "channel":
+            current_channel = interaction.guild.get_channel(get_channel_id())
+            current_status = f"Canal atual: {current_channel.mention if current_channel else 'Não configurado'}"
+            
+            embed = discord.Embed(
+                title="⚙️ Configuração do Canal de Registro",
+                description=(
+                    f"{current_status}\n\n"
+                    "Selecione abaixo o novo canal de registro.\n"
+                    "Os menus de registro serão automaticamente movidos para o novo canal."
+                ),
+                color=discord.Color.blue()
+            )
+            
+            view = ConfigView('channel')
+            await interaction.followup.send(embed=embed, view=view, ephemeral=True)
+
+async def send_user_export(interaction: discord.Interaction, **filters):
+    """Gera a exportação e envia as partes como anexos (a interação já deve estar respondida)"""
+    paths = []
+    try:
+        paths, total_rows = await user_exporter.export(**filters)
+        if not total_rows:
+            await interaction.followup.send("❌ Não há dados para exportar.", ephemeral=True)
+            return
+
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        for index, path in enumerate(paths, start=1):
+            suffix = f"_parte{index}" if len(paths) > 1 else ""
+            await interaction.followup.send(
+                f"✅ Dados exportados com sucesso! ({total_rows} registros)" if index == 1 else f"📎 Parte {index}/{len(paths)}",
+                file=discord.File(path, filename=f"users_export_{timestamp}{suffix}.csv.gz"),
+                ephemeral=True
+            )
+    except Exception as e:
+        print(f"Erro ao exportar dados: {e}")
+        traceback.print_exc()
+        await interaction.followup.send(f"❌ Erro ao exportar dados: {str(e)}", ephemeral=True)
+    finally:
+        user_exporter.cleanup(paths)
+
+class ExportDateRangeModal(discord.ui.Modal, title='Exportar por Período'):
+    start_date = discord.ui.TextInput(
+        label='Data inicial (DD/MM/AAAA)',
+        placeholder='01/01/2025',
+        required=True,
+        min_length=10,
+        max_length=10
+    )
+    end_date = discord.ui.TextInput(
+        label='Data final (DD/MM/AAAA)',
+        placeholder='31/01/2025',
+        required=False,
+        max_length=10
+    )
+
+    async def on_submit(self, interaction: discord.Interaction):
+        try:
+            since = datetime.strptime(str(self.start_date), '%d/%m/%Y')
+            until = datetime.strptime(str(self.end_date), '%d/%m/%Y') if str(self.end_date) else None
+        except ValueError:
+            await interaction.response.send_message("❌ Data inválida! Use o formato DD/MM/AAAA.", ephemeral=True)
+            return
+
+        await interaction.response.defer(ephemeral=True)
+        await send_user_export(
+            interaction,
+            since=since.strftime('%Y-%m-%d'),
+            # A data final é inclusiva
+            until=(until + timedelta(days=1)).strftime('%Y-%m-%d') if until else None
+        )
+
+class ExportFilterSelect(discord.ui.Select):
+    def __init__(self):
+        options = [
+            discord.SelectOption(label="Todos os registros", emoji="📋", value="all"),
+            discord.SelectOption(label="Últimos 7 dias", emoji="🗓️", value="7d"),
+            discord.SelectOption(label="Últimos 30 dias", emoji="📆", value="30d"),
+            discord.SelectOption(label="Período personalizado", emoji="🔎", value="range"),
+            discord.SelectOption(label="Sem Steam ID", description="Usuários sem conta Steam vinculada", emoji="⚪", value="no_steam")
+        ]
+        super().__init__(
+            placeholder="Selecione o filtro da exportação...",
+            min_values=1,
+            max_values=1,
+            options=options
+        )
+
+    async def callback(self, interaction: discord.Interaction):
+        choice = self.values[0]
+        if choice == "range":
+            await interaction.response.send_modal(ExportDateRangeModal())
+            return
+
+        await interaction.response.defer(ephemeral=True)
+        filters = {}
+        if choice in ("7d", "30d"):
+            days = 7 if choice == "7d" else 30
+            filters['since'] = (datetime.utcnow() - timedelta(days=days)).strftime('%Y-%m-%d %H:%M:%S')
+        elif choice == "no_steam":
+            filters['only_without_steam'] = True
+        await send_user_export(interaction, **filters)
+
+class SalesLookupModal(discord.ui.Modal, title='Consultar Vendas'):
+    purchase_id = discord.ui.TextInput(
+        label='ID da Compra',
+        placeholder='Ex: 123456',
+        required=False,
+        max_length=64
+    )
+    steam_id = discord.ui.TextInput(
+        label='Steam ID',
+        placeholder='Ex: 76561198000000000',
+        required=False,
+        max_length=17
+    )
+
+    async def on_submit(self, interaction: discord.Interaction):
+        purchase_id = str(self.purchase_id).strip()
+        steam_id = str(self.steam_id).strip()
+        if not purchase_id and not steam_id:
+            await interaction.response.send_message("❌ Informe o ID da compra ou o Steam ID.", ephemeral=True)
+            return
+
+        await interaction.response.defer(ephemeral=True)
+        rows = await sales_ledger.find(purchase_id=purchase_id or None, steam_id=steam_id or None, limit=10)
+        if not rows:
+            await interaction.followup.send("❌ Nenhuma venda encontrada no ledger.", ephemeral=True)
+            return
+
+        embed = discord.Embed(
+            title="🧾 Vendas Encontradas",
+            description=f"{len(rows)} registro(s) mais recente(s)",
+            color=discord.Color.blue()
+        )
+        for row_purchase_id, row_steam_id, user_id, valor, credited, balance_info, recorded_at, _, _ in rows:
+            embed.add_field(
+                name=f"{'✅' if credited else '❌'} Compra {row_purchase_id} • {valor}",
+                value=(
+                    f"Steam: {row_steam_id} • Usuário: {user_id}\n"
+                    f"{balance_info}\n"
+                    f"{datetime.fromtimestamp(recorded_at).strftime('%d/%m/%Y %H:%M:%S')}"
+                ),
+                inline=False
+            )
+        await interaction.followup.send(embed=embed, ephemeral=True)
+
+class BalanceLookupModal(discord.ui.Modal, title='Consultar Saldo'):
+    player = discord.ui.TextInput(
+        label='Steam ID ou Discord ID',
+        placeholder='Ex: 76561198000000000',
+        required=True,
+        max_length=20
+    )
+
+    async def on_submit(self, interaction: discord.Interaction):
+        player = str(self.player).strip()
+        if not player.isdigit():
+            await interaction.response.send_message("❌ Informe um Steam ID ou Discord ID numérico.", ephemeral=True)
+            return
+
+        await interaction.response.defer(ephemeral=True)
+        steam_id = player if steam_account_id(player) is not None else await steam_id_cache.get_steam_id(player)
+        if not steam_id:
+            await interaction.followup.send("❌ Nenhum Steam ID registrado para esse Discord ID.", ephemeral=True)
+            return
+
+        # Servido da memória; só vai ao disco se o jogador ainda não foi visto pela varredura
+        entry = balance_cache.get(steam_id)
+        source = "memória"
+        if entry is None:
+            if not sales_monitor.bank_file_path or not sales_monitor.bank_available:
+                await interaction.followup.send(
+                    f"❌ Saldo de {steam_id} não está em memória e o diretório de saldos está indisponível.",
+                    ephemeral=True
+                )
+                return
+            try:
+                success, message, _, _ = await balance_cache.read(
+                    steam_id, sales_monitor.bank_file_for(steam_id), os.getenv('BALANCE_KEY', 'Balance')
+                )
+            except asyncio.TimeoutError:
+                success, message = False, "Tempo esgotado ao acessar arquivo de saldo"
+            if not success:
+                await interaction.followup.send(f"❌ {message} (Steam ID {steam_id}).", ephemeral=True)
+                return
+            entry = balance_cache.get(steam_id)
+            source = "arquivo"
+
+        embed = discord.Embed(
+            title="💰 Saldo do Jogador",
+            description=f"Steam ID: {steam_id}",
+            color=discord.Color.green()
+        )
+        embed.add_field(name="Saldo", value=str(entry.balance), inline=True)
+        embed.add_field(
+            name="Atualizado",
+            value=f"{datetime.fromtimestamp(entry.updated_at).strftime('%d/%m %H:%M:%S')} ({source})",
+            inline=True
+        )
+        await interaction.followup.send(embed=embed, ephemeral=True)
+
+class DeadLetterReplaySelect(discord.ui.Select):
+    def __init__(self, dead_letters: list[tuple]):
+        options = [
+            discord.SelectOption(
+                label=f"#{dead_id} • Steam {steam_id} • {valor}",
+                description=(last_error or "")[:100],
+                value=str(dead_id)
+            )
+            for dead_id, steam_id, valor, _, _, last_error, _ in dead_letters[:25]
+        ]
+        super().__init__(
+            placeholder="Reenviar créditos da fila de falhas...",
+            min_values=1,
+            max_values=len(options),
+            options=options
+        )
+
+    async def callback(self, interaction: discord.Interaction):
+        await interaction.response.defer(ephemeral=True)
+        replayed = 0
+        for value in self.values:
+            if await credit_retries.replay(int(value)):
+                replayed += 1
+        await interaction.followup.send(
+            f"✅ {replayed} crédito(s) devolvido(s) para a fila de novas tentativas.",
+            ephemeral=True
+        )
+
+class AdminView(discord.ui.View):
+    def __init__(self):
+        super().__init__(timeout=None)
+        self.add_item(AdminSelect())
+
+class ConfigView(discord.ui.View):
+    def __init__(self, config_type: str):
+        super().__init__()
+        self.config_type = config_type
+        
+        # Adicionar seletor de canal
+        channel_select = discord.ui.ChannelSelect(
+            placeholder="Selecione o canal...",
+            channel_types=[discord.ChannelType.text]
+        )
+        channel_select.callback = self.channel_callback
+        self.add_item(channel_select)
+    
+    async def channel_callback(self, interaction: discord.Interaction):
+        try:
+            channel = interaction.data['values'][0]
+            
+            if self.config_type == 'channel':
+                # Salvar antes de reconfigurar para que o novo canal já seja usado
+                config_store.update(registration_channel_id=channel)
+                await interaction.response.send_message(
+                    f"✅ Canal de registro configurado para <#{channel}>",
+                    ephemeral=True
+                )
+                # Configurar o novo canal
+                new_channel = interaction.guild.get_channel(int(channel))
+                if new_channel:
+                    await setup_registration_channel(interaction.client)
+            
+        except Exception as e:
+            await interaction.response.send_message(
+                f"❌ Erro ao configurar canal: {str(e)}",
+                ephemeral=True
+            )
+
+# Vínculos removidos pela política de Steam ID único, guardados para revisão no painel de administração
+STEAM_ID_CONFLICTS_TABLE = '''
+    CREATE TABLE IF NOT EXISTS steam_id_conflicts (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        discord_id TEXT NOT NULL,
+        discord_name TEXT,
+        steam_id TEXT NOT NULL,
+        kept_discord_id TEXT,
+        detected_at REAL NOT NULL
+    )
+'''
+
+async def _deduplicate_steam_ids(db):
+    """Política de unicidade: cada conta Steam fica vinculada apenas ao registro mais recente"""
+    # Steam ID vazio equivale a "sem Steam ID" (como na exportação) e não pode conflitar
+    await (await db.execute("UPDATE users SET steam_id = NULL WHERE steam_id = ''")).close()
+    await (await db.execute(STEAM_ID_CONFLICTS_TABLE)).close()
+    # Registra cada vínculo antes de removê-lo: o jogador precisa ser avisado para se registrar de novo
+    await (await db.execute(
+        '''
+        INSERT INTO steam_id_conflicts (discord_id, discord_name, steam_id, kept_discord_id, detected_at)
+        SELECT users.discord_id, users.discord_name, users.steam_id, kept.discord_id, ?
+        FROM users
+        JOIN (
+            SELECT steam_id, MAX(rowid) AS kept_rowid FROM users
+            WHERE steam_id IS NOT NULL
+            GROUP BY steam_id
+        ) AS latest ON latest.steam_id = users.steam_id
+        JOIN users AS kept ON kept.rowid = latest.kept_rowid
+        WHERE users.rowid != latest.kept_rowid
+        ''',
+        (time(),)
+    )).close()
+    cursor = await db.execute('''
+        UPDATE users SET steam_id = NULL
+        WHERE steam_id IS NOT NULL
+          AND rowid NOT IN (
+              SELECT MAX(rowid) FROM users
+              WHERE steam_id IS NOT NULL
+              GROUP BY steam_id
+          )
+    ''')
+    if cursor.rowcount:
+        print(
+            f"⚠️ {cursor.rowcount} registros com Steam ID duplicado foram desvinculados "
+            f"(lista em Painel de Administração → Conflitos de Steam ID)"
+        )
+    await cursor.close()
+
+# Migrações do users.db, aplicadas em ordem (a versão atual fica em PRAGMA user_version)
+MIGRATIONS = [
+    (1, "Tabela de usuários", [
+        '''
+        CREATE TABLE IF NOT EXISTS users (
+            discord_id TEXT PRIMARY KEY,
+            discord_name TEXT,
+            steam_id TEXT
+        )
+        '''
+    ]),
+    (2, "Data de registro, índices e Steam ID único", [
+        'ALTER TABLE users ADD COLUMN registered_at TEXT',
+        'CREATE INDEX IF NOT EXISTS idx_users_discord_name ON users(discord_name)',
+        'CREATE INDEX IF NOT EXISTS idx_users_registered_at ON users(registered_at)',
+        _deduplicate_steam_ids,
+        '''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_users_steam_id ON users(steam_id)
+        WHERE steam_id IS NOT NULL AND steam_id <> ''
+        '''
+    ]),
+    (3, "Estatísticas materializadas", [
+        '''
+        CREATE TABLE IF NOT EXISTS stats_totals (
+            name TEXT PRIMARY KEY,
+            value INTEGER NOT NULL DEFAULT 0
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS stats_daily (
+            day TEXT PRIMARY KEY,
+            registrations INTEGER NOT NULL DEFAULT 0,
+            credits INTEGER NOT NULL DEFAULT 0,
+            credited_value INTEGER NOT NULL DEFAULT 0
+        )
+        ''',
+        '''
+        INSERT OR REPLACE INTO stats_totals (name, value) VALUES
+            ('total_users', (SELECT COUNT(*) FROM users)),
+            ('total_credits', 0),
+            ('total_credited_value', 0)
+        ''',
+        '''
+        INSERT OR REPLACE INTO stats_daily (day, registrations)
+        SELECT date(registered_at), COUNT(*) FROM users
+        WHERE registered_at IS NOT NULL
+        GROUP BY date(registered_at)
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_users_stats_insert AFTER INSERT ON users
+        BEGIN
+            UPDATE stats_totals SET value = value + 1 WHERE name = 'total_users';
+            INSERT INTO stats_daily (day, registrations)
+            VALUES (date(COALESCE(NEW.registered_at, 'now')), 1)
+            ON CONFLICT(day) DO UPDATE SET registrations = registrations + 1;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_users_stats_delete AFTER DELETE ON users
+        BEGIN
+            UPDATE stats_totals SET value = value - 1 WHERE name = 'total_users';
+        END
+        '''
+    ]),
+    (4, "Cache persistente de consultas à Steam", [
+        '''
+        CREATE TABLE IF NOT EXISTS steam_cache (
+            kind TEXT NOT NULL,
+            cache_key TEXT NOT NULL,
+            value TEXT,
+            expires_at REAL NOT NULL,
+            stale_until REAL NOT NULL,
+            PRIMARY KEY (kind, cache_key)
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_steam_cache_stale_until ON steam_cache(stale_until)'
+    ]),
+    (5, "Índice persistente de compras processadas", [
+        '''
+        CREATE TABLE IF NOT EXISTS purchases (
+            purchase_id TEXT PRIMARY KEY,
+            status TEXT NOT NULL,
+            user_id TEXT,
+            steam_id TEXT,
+            valor INTEGER,
+            detail TEXT,
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_purchases_updated_at ON purchases(updated_at)',
+        'CREATE INDEX IF NOT EXISTS idx_purchases_status ON purchases(status)'
+    ]),
+    (6, "Índice do ledger de vendas", [
+        '''
+        CREATE TABLE IF NOT EXISTS sales_ledger (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            purchase_id TEXT,
+            steam_id TEXT,
+            user_id TEXT,
+            valor INTEGER NOT NULL,
+            credited INTEGER NOT NULL,
+            balance_info TEXT,
+            recorded_at REAL NOT NULL,
+            segment TEXT NOT NULL,
+            position INTEGER NOT NULL
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_sales_ledger_purchase_id ON sales_ledger(purchase_id)',
+        'CREATE INDEX IF NOT EXISTS idx_sales_ledger_steam_id ON sales_ledger(steam_id, recorded_at)',
+        'CREATE INDEX IF NOT EXISTS idx_sales_ledger_recorded_at ON sales_ledger(recorded_at)'
+    ]),
+    (7, "Fila de novas tentativas e fila de falhas de créditos", [
+        '''
+        CREATE TABLE IF NOT EXISTS credit_retries (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            source_credit_id TEXT UNIQUE,
+            steam_id TEXT NOT NULL,
+            valor INTEGER NOT NULL,
+            log_entries TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at REAL NOT NULL,
+            last_error TEXT,
+            created_at REAL NOT NULL
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_credit_retries_next_attempt ON credit_retries(next_attempt_at)',
+        'CREATE INDEX IF NOT EXISTS idx_credit_retries_kind ON credit_retries(kind, steam_id)',
+        '''
+        CREATE TABLE IF NOT EXISTS credit_dead_letters (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            steam_id TEXT NOT NULL,
+            valor INTEGER NOT NULL,
+            log_entries TEXT NOT NULL,
+            attempts INTEGER NOT NULL,
+            last_error TEXT,
+            created_at REAL NOT NULL,
+            failed_at REAL NOT NULL
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_credit_dead_letters_failed_at ON credit_dead_letters(failed_at)'
+    ]),
+    (8, "Estado persistente do bot (marca d'água do canal de vendas)", [
+        '''
+        CREATE TABLE IF NOT EXISTS bot_state (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL,
+            updated_at REAL NOT NULL
+        )
+        '''
+    ]),
+    (9, "Ledger de saldos em partidas dobradas (BANK_BACKEND=sqlite)", [
+        '''
+        CREATE TABLE IF NOT EXISTS bank_accounts (
+            account TEXT PRIMARY KEY,
+            balance INTEGER NOT NULL DEFAULT 0,
+            projected_balance INTEGER,
+            pending_projection INTEGER,
+            updated_at REAL NOT NULL
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS bank_transfers (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            credit_id TEXT UNIQUE,
+            steam_id TEXT,
+            amount INTEGER NOT NULL,
+            created_at REAL NOT NULL
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS bank_entries (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            transfer_id INTEGER NOT NULL REFERENCES bank_transfers(id),
+            account TEXT NOT NULL,
+            amount INTEGER NOT NULL
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_bank_entries_account ON bank_entries(account)',
+        'CREATE INDEX IF NOT EXISTS idx_bank_transfers_steam_id ON bank_transfers(steam_id, created_at)'
+    ]),
+    (10, "Posição única no índice do ledger de vendas (reindexação idempotente)", [
+        'CREATE UNIQUE INDEX IF NOT EXISTS idx_sales_ledger_position ON sales_ledger(segment, position)'
+    ]),
+    (11, "Registro de conflitos de Steam ID e Steam ID vazio fora do índice único", [
+        STEAM_ID_CONFLICTS_TABLE,
+        "UPDATE users SET steam_id = NULL WHERE steam_id = ''",
+        'DROP INDEX IF EXISTS idx_users_steam_id',
+        '''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_users_steam_id ON users(steam_id)
+        WHERE steam_id IS NOT NULL AND steam_id <> ''
+        '''
+    ]),
+]
+
+async def run_migrations(database: UserDatabase):
+    """Aplica as migrações pendentes, cada uma em sua própria transação"""
+    current_version = (await database.fetchone('PRAGMA user_version'))[0]
+    for version, description, steps in MIGRATIONS:
+        if version <= current_version:
+            continue
+
+        print(f"Aplicando migração {version}: {description}")
+        async with database.transaction() as db:
+            for step in steps:
+                if callable(step):
+                    await step(db)
+                else:
+                    await db.execute(step)
+            await db.execute(f'PRAGMA user_version = {int(version)}')
+        current_version = version
+
+    print(f"Esquema do banco de dados na versão {current_version}")
+
+async def setup_database():
+    await user_db.start()
+    await run_migrations(user_db)
+    conflicts = (await user_db.fetchone('SELECT COUNT(*) FROM steam_id_conflicts'))[0]
+    if conflicts:
+        print(f"⚠️ {conflicts} vínculos Steam removidos por duplicidade aguardam revisão no painel de administração")
+    await steam_id_cache.warm()
+    for cache in (vanity_cache, profile_cache):
+        removed = await cache.purge_expired()
+        if removed:
+            print(f"Cache Steam ({cache.kind}): {removed} entradas expiradas removidas")
+
+async def get_steam_id64(profile_url: str) -> str:
+    try:
+        # Links numéricos, SteamID2/3, SteamID64 e links curtos são resolvidos sem rede
+        parsed = parse_steam_identifier(profile_url)
+        if parsed is None:
+            return None
+        
+        kind, value = parsed
+        if kind == 'steamid64':
+            return value
+        
+        # Apenas vanity URLs de verdade precisam da API
+        vanity_key = value.lower()
+        return await vanity_lookups.do(
+            vanity_key,
+            lambda: vanity_cache.get_or_fetch(
+                vanity_key,
+                lambda priority: resolve_vanity_url(value, priority)
+            )
+        )
+    
+    except Exception as e:
+        print(f"Erro ao obter Steam ID: {e}")
+    
+    return None
+
+async def resolve_vanity_url(vanity_url: str, priority: int = PRIORITY_INTERACTIVE) -> str:
+    """Resolve uma vanity URL pela API da Steam (sem cache). None apenas quando a Steam não encontra o perfil"""
+    try:
+        data = await steam_api_get('ISteamUser/ResolveVanityURL/v0001/', priority, vanityurl=vanity_url)
+        if data and data.get('response', {}).get('success') == 1:
+            return data['response']['steamid']
+    
+    except SteamUnavailable:
+        raise
+    except Exception as e:
+        print(f"Erro ao obter Steam ID: {e}")
+    
+    return None
+
+def build_profile_data(player: dict) -> dict:
+    """Converte um jogador retornado por GetPlayerSummaries no formato usado pelo bot"""
+    # Criar dicionário com dados básicos (sempre disponíveis)
+    profile_data = {
+        'steamid': player.get('steamid'),
+        'personaname': player.get('personaname', 'Nome não disponível'),
+        'avatarfull': player.get('avatarfull'),
+        'profileurl': player.get('profileurl'),
+        'personastate': player.get('personastate', 0),
+    }
+    
+    # Adicionar dados extras se o perfil for público
+    if player.get('communityvisibilitystate', 1) == 3:  # 3 = Público
+        profile_data.update({
+            'realname': player.get('realname'),
+            'timecreated': player.get('timecreated'),
+            'loccountrycode': player.get('loccountrycode'),
+            'gameextrainfo': player.get('gameextrainfo'),
+        })
+    
+    return profile_data
+
+async def fetch_player_summaries(steam_ids: list, priority: int = PRIORITY_INTERACTIVE) -> dict:
+    """Consulta GetPlayerSummaries para até 100 Steam IDs e retorna {steam_id: profile_data}"""
+    data = await steam_api_get('ISteamUser/GetPlayerSummaries/v0002/', priority, steamids=','.join(steam_ids))
+    if not data:
+        return {}
+    
+    players = data.get('response', {}).get('players') or []
+    return {
+        str(player.get('steamid')): build_profile_data(player)
+        for player in players
+    }
+
+class SteamProfileBatcher:
+    """Agrupa pedidos concorrentes de perfis em uma única chamada a GetPlayerSummaries"""
+    MAX_BATCH = 100  # Limite de steamids por chamada da API
+
+    def __init__(self, window: float = 0.05):
+        self.window = window
+        self._pending = {}  # steam_id -> [Future, ...]
+        self._priority = {}  # steam_id -> prioridade mais alta pedida
+        self._timer = None
+        self._tasks = set()
+        self.api_calls = 0
+        self.profiles_requested = 0
+
+    async def get(self, steam_id: str, priority: int = PRIORITY_INTERACTIVE) -> dict:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        steam_id = str(steam_id)
+        self._pending.setdefault(steam_id, []).append(future)
+        self._priority[steam_id] = min(priority, self._priority.get(steam_id, priority))
+        self.profiles_requested += 1
+
+        if len(self._pending) >= self.MAX_BATCH:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        while self._pending:
+            batch_ids = list(self._pending)[:self.MAX_BATCH]
+            batch = {steam_id: self._pending.pop(steam_id) for steam_id in batch_ids}
+            # O lote usa a fila interativa se algum pedido dele for interativo
+            priority = min(self._priority.pop(steam_id) for steam_id in batch_ids)
+            task = asyncio.create_task(self._send(batch, priority))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _send(self, batch: dict, priority: int):
+        self.api_calls += 1
+        try:
+            results = await fetch_player_summaries(list(batch), priority)
+        except Exception as e:
+            print(f"Erro ao obter dados do perfil Steam: {e}")
+            # A falha chega a cada pedido: um perfil ausente viraria entrada negativa no cache
+            error = e if isinstance(e, SteamUnavailable) else SteamUnavailable(str(e))
+            for futures in batch.values():
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(error)
+            return
+
+        for steam_id, futures in batch.items():
+            for future in futures:
+                if not future.done():
+                    future.set_result(results.get(steam_id))
+
+    def stats(self) -> dict:
+        return {
+            'api_calls': self.api_calls,
+            'profiles_requested': self.profiles_requested,
+            'profiles_per_call': (self.profiles_requested / self.api_calls) if self.api_calls else 0.0
+        }
+
+# Criar instância global do agrupador de perfis Steam
+steam_profile_batcher = SteamProfileBatcher(window=float(os.getenv('STEAM_BATCH_WINDOW', 0.05)))
+
+async def get_steam_profile_data(steam_id: str, priority: int = PRIORITY_INTERACTIVE) -> dict:
+    steam_id = str(steam_id)
+    try:
+        return await profile_lookups.do(
+            steam_id,
+            lambda: profile_cache.get_or_fetch(
+                steam_id,
+                lambda fetch_priority: steam_profile_batcher.get(steam_id, fetch_priority),
+                priority
+            )
+        )
+    except SteamUnavailable as e:
+        print(f"Perfil Steam {steam_id} indisponível: {e}")
+        return None
+
+async def setup_registration_channel(bot):
+    try:
+        channel = bot.get_channel(get_channel_id())
+        if channel:
+            await channel.purge()
+            
+            embed = discord.Embed(
+                title="Sistema de Registro Steam",
+                description=(
+                    "Bem-vindo ao sistema de registro Steam!\n\n"
+                    "Use o menu abaixo para:\n"
+                    "🟢 **Registrar**: Vincular sua conta Steam\n"
+                    "🔵 **Consultar Cadastro**: Ver sua conta vinculada\n"
+                    "⚫ **Alterar Conta Steam**: Mudar sua conta Steam\n"
+                    "🔴 **Remover Cadastro**: Desvincular sua conta"
+                ),
+                color=discord.Color.blue()
+            )
+            await channel.send(embed=embed, view=RegistrationView())
+            print("Menu de registro configurado com sucesso!")
+    except Exception as e:
+        print(f"Erro ao configurar canal de registro: {e}")
+
+@bot.event
+async def on_disconnect():
+    # Eventos podem se perder até a sessão ser retomada ou o próximo catch-up terminar
+    sales_catchup.hold()
+
+@bot.event
+async def on_resumed():
+    # Sessão retomada: o Discord reenvia os eventos perdidos
+    sales_catchup.release()
+
+@bot.event
+async def on_ready():
+    print(f'Bot está online como {bot.user.name}')
+    
+    # Configurar presença do bot
+    await bot.change_presence(
+        activity=discord.Activity(
+            type=discord.ActivityType.watching,
+            name="registros Steam"
+        ),
+        status=discord.Status.online
+    )
+    
+    await setup_database()
+    await purchase_store.start()
+    await sales_ledger.start()
+    await steam_http.start()
+    await attachment_http.start()
+    await sales_monitor.start()
+    await bank_backend.start()
+    await sales_monitor.recover_credits()
+    await credit_retries.start()
+    sales_pipeline.start()
+    # Vendas recebidas enquanto o bot estava desconectado (em segundo plano)
+    sales_catchup.start(bot)
+    
+    # Verificar permissões do bot
+    for guild in bot.guilds:
+        registered_role = guild.get_role(get_role_id())
+        if registered_role:
+            has_perm, message = await check_role_permissions(guild, guild.me, registered_role)
+            if not has_perm:
+                print(f"⚠️ Aviso de permissões no servidor {guild.name}: {message}")
+    
+    # Registrar comandos de aplicação
+    try:
+        synced = await bot.tree.sync()
+        print(f"Sincronizados {len(synced)} comandos")
+    except Exception as e:
+        print(f"Erro ao sincronizar comandos: {e}")
+    
+    # Configurar canal de registro
+    await setup_registration_channel(bot)
+    
+    # Configurar canal administrativo
+    try:
+        admin_channel = bot.get_channel(int(os.getenv('ADMIN_CHANNEL_ID')))
+        if admin_channel:
+            await admin_channel.purge()
+            
+            # Verificar permissões antes de configurar
+            registered_role = admin_channel.guild.get_role(get_role_id())
+            if registered_role:
+                has_perm, message = await check_role_permissions(admin_channel.guild, admin_channel.guild.me, registered_role)
+                if not has_perm:
+                    embed = discord.Embed(
+                        title="⚠️ Aviso de Permissões",
+                        description=message,
+                        color=discord.Color.yellow()
+                    )
+                    await admin_channel.send(embed=embed)
+            
+            embed = discord.Embed(
+                title="🔐 Painel Administrativo",
+                description=(
+                    "Bem-vindo ao painel administrativo!\n\n"
+                    "Use o menu abaixo para acessar as funções:\n"
+                    "📊 **Estatísticas**: Ver dados gerais do sistema\n"
+                    "📥 **Exportar Dados**: Baixar CSV com todos os registros\n"
+                    "⚙️ **Canal de Registro**: Configurar canal do sistema\n"
+                    "📡 **Canal de Confirmação de Vendas**: Configurar canal de vendas"
+                ),
+                color=discord.Color.dark_gold()
+            )
+            await admin_channel.send(embed=embed, view=AdminView())
+            print("Painel administrativo configurado com sucesso!")
+    except Exception as e:
+        print(f"Erro ao configurar painel administrativo: {e}")
+
+async def get_user_info(db, discord_id=None, discord_name=None):
+    try:
+        if discord_id:
+            result = await db.fetchone(
+                'SELECT * FROM users WHERE discord_id = ?',
+                (str(discord_id),)
+            )
+            if result:
+                return {
+                    'discord_id': result[0],
+                    'discord_name': result[1],
+                    'steam_id': result[2]
+                }
+
+        if discord_name:
+            result = await db.fetchone(
+                'SELECT * FROM users WHERE discord_name = ?',
+                (discord_name,)
+            )
+            if result:
+                return {
+                    'discord_id': result[0],
+                    'discord_name': result[1],
+                    'steam_id': result[2]
+                }
+
+        return None
+    except Exception as e:
+        return None
+
+async def process_sale_embed(message: discord.Message):
+    try:
+        if not message.embeds:
+            return
+
+        embed = message.embeds[0]
+        if not embed.fields:
+            return
+
+        # Extrair informações do embed
+        pedido_id = None
+        discord_info = None
+        valor = None
+
+        for field in embed.fields:
+            if 'Pedido' in field.name:
+                pedido_id = field.value
+            elif 'Discord' in field.name:
+                discord_info = field.value
+            elif 'Valor' in field.name:
+                valor = field.value
+
+        if not all([pedido_id, discord_info]):
+            return
+
+        # Extrair Discord ID
+        discord_id = None
+        if '<@' in discord_info:
+            discord_id = extract_discord_id(discord_info)
+        else:
+            # Tentar encontrar o ID no texto
+            discord_id = extract_discord_id(discord_info)
+
+        if not discord_id:
+            return
+
+        # Buscar usuário no Discord
+        user = message.guild.get_member(int(discord_id))
+        if not user:
+            return
+
+        if user:
+            user_info = await get_user_info(user_db, discord_id=user.id)
+            if user_info:
+                return user_info
+
+        # Se não encontrou por ID, tentar por nome
+        if not user_info:
+            user_info = await get_user_info(user_db, discord_name=user.name)
+            if user_info:
+                return user_info
+
+        return {
+            'discord_id': str(user.id),
+            'discord_name': user.name,
+            'steam_id': None
+        }
+
+    except Exception as error:
+        return None
+
+class BankFileExecutor:
+    """Pool de threads dedicado ao diretório de saldos, com ordem por arquivo e tempo limite"""
+    def __init__(self, workers: int = 8, timeout: float = 15):
+        self.workers = max(1, workers)
+        self.timeout = timeout
+        self._executor = None
+        self._tails = {}  # caminho -> Task da última operação agendada para o arquivo
+        self.completed = 0
+        self.timeouts = 0
+        self.max_duration = 0.0
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='bank-io')
+        return self._executor
+
+    async def _run_after(self, previous, func, args):
+        if previous is not None:
+            # Espera a operação anterior terminar na thread, mesmo que quem a pediu já tenha desistido
+            await asyncio.gather(previous, return_exceptions=True)
+        started = monotonic()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(
+                self._get_executor(), functools.partial(func, *args)
+            )
+        finally:
+            self.max_duration = max(self.max_duration, monotonic() - started)
+
+    def _forget(self, path: str, task: asyncio.Task):
+        if self._tails.get(path) is task:
+            del self._tails[path]
+        if not task.cancelled():
+            task.exception()  # Evita aviso de exceção não recuperada após tempo esgotado
+
+    async def run(self, path: str, func, *args, timeout: float = None):
+        """Executa func(*args) em uma thread, depois das operações já agendadas para o mesmo caminho"""
+        task = asyncio.ensure_future(self._run_after(self._tails.get(path), func, args))
+        self._tails[path] = task
+        task.add_done_callback(functools.partial(self._forget, path))
+        try:
+            result = await asyncio.wait_for(asyncio.shield(task), timeout or self.timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise
+        self.completed += 1
+        return result
+
+    def pending(self) -> int:
+        return len(self._tails)
+
+    async def close(self):
+        """Aguarda as operações em andamento (até o tempo limite) e libera as threads"""
+        if self._tails:
+            await asyncio.wait(list(self._tails.values()), timeout=self.timeout)
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def stats(self) -> dict:
+        return {
+            'workers': self.workers,
+            'pending': self.pending(),
+            'completed': self.completed,
+            'timeouts': self.timeouts,
+            'max_duration': self.max_duration
+        }
+
+# Criar instância global do pool de I/O do diretório de saldos
+bank_io = BankFileExecutor(
+    workers=int(os.getenv('BANK_IO_WORKERS', 8)),
+    timeout=float(os.getenv('BANK_IO_TIMEOUT', 15))
+)
+
+CREDIT_INTENT = 'intent'        # Crédito registrado, saldo ainda não lido
+CREDIT_PREPARED = 'prepared'    # Saldo anterior e novo calculados, arquivo ainda não gravado
+CREDIT_COMMITTED = 'committed'  # Arquivo de saldo gravado
+CREDIT_ABORTED = 'aborted'      # Crédito não aplicado
+CREDIT_DONE = 'done'            # Log da venda gravado: nada mais a fazer
+
+class CreditJournal:
+    """Journal de créditos (write-ahead) em JSON Lines, com fsync agrupado entre créditos simultâneos"""
+    def __init__(self, path: str = 'creditos.journal', compact_bytes: int = 8 * 1024 * 1024):
+        self.path = path
+        self.compact_bytes = compact_bytes
+        self._compact_at = compact_bytes  # Tamanho do arquivo que dispara a próxima compactação
+        self._file = None
+        self._pending = []  # (linha, Future) aguardando o próximo fsync
+        self._flush_task = None
+        self._states = {}  # credit_id -> último estado dos créditos em andamento
+        self.records = 0
+        self.fsyncs = 0
+        self.compactions = 0
+
+    def _write_batch(self, lines: list[str]) -> int:
+        """Executado em thread: grava as linhas e faz um único fsync para o lote. Retorna o tamanho do arquivo"""
+        if self._file is None:
+            self._file = open(self.path, 'a+', encoding='utf-8')
+            if self._file.tell() > 0:
+                # Uma queda pode ter deixado a última linha sem quebra: começa em uma linha nova
+                self._file.seek(self._file.tell() - 1)
+                if self._file.read(1) != '\n':
+                    self._file.write('\n')
+        self._file.write(''.join(lines))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        return self._file.tell()
+
+    async def _flush(self):
+        while self._pending:
+            # Tudo o que chegou durante o fsync anterior vai no mesmo lote
+            batch, self._pending = self._pending, []
+            try:
+                size = await asyncio.to_thread(self._write_batch, [line for line, _ in batch])
+                self.fsyncs += 1
+                self.records += len(batch)
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for _, future in batch:
+                if not future.done():
+                    future.set_result(None)
+            if self.compact_bytes and size >= self._compact_at:
+                # Dentro da tarefa de gravação: nenhum registro é gravado durante a compactação
+                try:
+                    kept = await asyncio.to_thread(self._compact_file)
+                    print(f"Journal de créditos compactado: {kept} créditos em andamento mantidos")
+                except Exception as e:
+                    print(f"Erro ao compactar journal de créditos: {e}")
+                    self._compact_at = size + self.compact_bytes
+
+    async def append(self, credit_id: str, state: str, **fields):
+        """Retorna somente depois que o registro estiver gravado em disco"""
+        record = {'id': credit_id, 'state': state, 'at': time(), **fields}
+        if state == CREDIT_DONE:
+            self._states.pop(credit_id, None)
+        else:
+            self._states[credit_id] = state
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((json.dumps(record, ensure_ascii=False) + '\n', future))
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush())
+        await future
+
+    async def begin(self, steam_id: str, valor: int, log_entries: list[dict] = None, retry_id: int = None) -> str:
+        credit_id = uuid.uuid4().hex
+        await self.append(credit_id, CREDIT_INTENT, steam_id=steam_id, valor=valor,
+                          log_entries=log_entries or [], retry_id=retry_id)
+        return credit_id
+
+    def state_of(self, credit_id: str) -> str:
+        return self._states.get(credit_id)
+
+    def _read_entries(self) -> OrderedDict:
+        """Executado em thread: junta os registros de cada crédito, na ordem de criação"""
+        entries = OrderedDict()
+        if not os.path.exists(self.path):
+            return entries
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line_number, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # Normalmente a última linha, cortada por uma queda durante a gravação
+                    print(f"⚠️ Linha {line_number} do journal de créditos ignorada (incompleta)")
+                    continue
+                entries.setdefault(record['id'], {}).update(record)
+        return entries
+
+    async def unfinished(self) -> list[dict]:
+        entries = await asyncio.to_thread(self._read_entries)
+        return [entry for entry in entries.values() if entry['state'] != CREDIT_DONE]
+
+    def _compact(self, keep: list[dict]):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, temp_path = tempfile.mkstemp(prefix='.journal.', suffix='.tmp', dir=directory)
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            for entry in keep:
+                f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.path)
+
+    def _compact_file(self) -> int:
+        """Executado em thread: compacta o journal e ajusta o tamanho da próxima compactação"""
+        keep = [entry for entry in self._read_entries().values() if entry['state'] != CREDIT_DONE]
+        self._compact(keep)
+        self.compactions += 1
+        # Se muitos créditos continuam em andamento, espera o arquivo crescer antes de compactar de novo
+        self._compact_at = max(self.compact_bytes, 2 * os.path.getsize(self.path))
+        return len(keep)
+
+    async def compact(self):
+        """Reescreve o journal mantendo apenas os créditos não concluídos"""
+        if self._flush_task is not None:
+            await asyncio.gather(self._flush_task, return_exceptions=True)
+        return await asyncio.to_thread(self._compact_file)
+
+    async def close(self):
+        if self._flush_task is not None:
+            await asyncio.gather(self._flush_task, return_exceptions=True)
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def stats(self) -> dict:
+        return {
+            'records': self.records,
+            'fsyncs': self.fsyncs,
+            'records_per_fsync': self.records / self.fsyncs if self.fsyncs else 0.0,
+            'in_flight': len(self._states),
+            'compactions': self.compactions
+        }
+
+# Criar instância global do journal de créditos
+credit_journal = CreditJournal(
+    os.getenv('CREDIT_JOURNAL_FILE', 'creditos.journal'),
+    compact_bytes=int(os.getenv('CREDIT_JOURNAL_COMPACT_BYTES', 8 * 1024 * 1024))
+)
+
+class BalanceEntry:
+    """Saldo de um jogador em memória e a assinatura (mtime, tamanho) do arquivo de onde veio"""
+    __slots__ = ('balance', 'data', 'signature', 'updated_at')
+
+    def __init__(self, balance: int, data: dict, signature: tuple):
+        self.balance = balance
+        self.data = data
+        self.signature = signature  # None: arquivo alterado há pouco, sempre relido
+        self.updated_at = time()
+
+class BalanceCache:
+    """Saldos em memória, revalidados pelo mtime/tamanho do arquivo e por varredura periódica do BANK_FILE"""
+    # Um arquivo alterado há menos que isso pode mudar de novo sem mudar mtime nem tamanho
+    RACY_WINDOW = 2.0
+
+    def __init__(self, scan_interval: float = 30, scan_timeout: float = 120, scan_chunk: int = 500):
+        self.scan_interval = scan_interval
+        self.scan_timeout = scan_timeout  # Por lote de arquivos da varredura
+        self.scan_chunk = max(1, scan_chunk)
+        self.directory = None
+        self.balance_key = None
+        self._available = None
+        self._entries = {}             # steam_id -> BalanceEntry
+        self._changes = OrderedDict()  # steam_id -> cursor da última alteração (mais recente no fim)
+        self.cursor = 0
+        self._task = None
+        self.hits = 0
+        self.misses = 0
+        self.scans = 0
+        self.scan_errors = 0
+        self.last_scan_at = None
+        self.last_scan_duration = 0.0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def start(self, directory: str, balance_key: str, available):
+        """Inicia a varredura periódica do diretório; `available()` indica se ele está acessível"""
+        self.directory = directory
+        self.balance_key = balance_key
+        self._available = available
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def get(self, steam_id: str) -> BalanceEntry:
+        """Consulta apenas a memória (None se o jogador ainda não foi visto)"""
+        return self._entries.get(steam_id)
+
+    def _store(self, steam_id: str, user_data: dict, balance: int, signature: tuple):
+        previous = self._entries.get(steam_id)
+        self._entries[steam_id] = BalanceEntry(balance, user_data, signature)
+        if previous is None or previous.balance != balance:
+            self._record_change(steam_id)
+
+    def _forget(self, steam_id: str):
+        if self._entries.pop(steam_id, None) is not None:
+            self._record_change(steam_id)
+
+    def _record_change(self, steam_id: str):
+        self.cursor += 1
+        self._changes[steam_id] = self.cursor
+        self._changes.move_to_end(steam_id)
+
+    def changes_since(self, cursor: int, limit: int = None) -> tuple[int, list[tuple[str, int]]]:
+        """Jogadores cujo saldo mudou depois de `cursor`, do mais antigo ao mais recente.
+
+        Retorna (novo cursor, [(steam_id, saldo)]); saldo None indica que o arquivo deixou de existir.
+        """
+        changed = []
+        for steam_id, position in reversed(self._changes.items()):
+            if position <= cursor:
+                break
+            changed.append((steam_id, position))
+        changed.reverse()
+        if limit is not None and len(changed) > limit:
+            changed = changed[:limit]
+        new_cursor = changed[-1][1] if changed else max(cursor, self.cursor)
+        result = []
+        for steam_id, _ in changed:
+            entry = self._entries.get(steam_id)
+            result.append((steam_id, entry.balance if entry else None))
+        return new_cursor, result
+
+    @classmethod
+    def _signature(cls, st: os.stat_result) -> tuple:
+        if time() - st.st_mtime < cls.RACY_WINDOW:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
+    @staticmethod
+    def _balance_of(user_data: dict, balance_key: str, verbose: bool = False) -> int:
+        # Saldo sempre inteiro e nunca negativo
+        try:
+            balance = int(user_data.get(balance_key, 0))
+        except (ValueError, TypeError) as e:
+            if verbose:
+                print(f"❌ Erro ao converter saldo atual: {e}")
+                print(f"Valor problemático: {user_data.get(balance_key)}")
+                print("Resetando saldo para 0")
+            return 0
+        if balance < 0:
+            if verbose:
+                print("⚠️ Saldo atual é negativo, ajustando para 0")
+            return 0
+        return balance
+
+    @classmethod
+    def _read_file(cls, path: str, balance_key: str, known_signature: tuple) -> tuple[bool, str, dict, int, tuple]:
+        """Executado em thread: relê o arquivo apenas se mtime ou tamanho mudaram.
+
+        Retorna (sucesso, mensagem, dados, saldo, assinatura); dados None com sucesso indica arquivo inalterado.
+        """
+        try:
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                print(f"❌ Arquivo de saldo não encontrado: {path}")
+                return False, "Arquivo de saldo não encontrado", None, 0, None
             
-            with open("users_export.csv", "w", encoding="utf-8") as f:
-                f.write(csv_content)
+            # A assinatura é lida antes do conteúdo: uma alteração no meio do caminho força nova leitura depois
+            signature = cls._signature(st)
+            if signature is not None and signature == known_signature:
+                return True, "Saldo em memória", None, 0, signature
             
-            await interaction.followup.send(
-                "✅ Dados exportados com sucesso!",
-                file=discord.File("users_export.csv"),
-                ephemeral=True
+            with open(path, 'r', encoding='utf-8') as f:
+                raw_content = f.read()
+            try:
+                user_data = json.loads(raw_content)
+            except json.JSONDecodeError as e:
+                print(f"❌ Erro ao ler arquivo JSON: {e}")
+                print(f"Conteúdo do arquivo problemático: {raw_content[:200]}")
+                return False, "Erro ao ler arquivo de saldo", None, 0, None
+            
+            current_balance = cls._balance_of(user_data, balance_key, verbose=True)
+            print(f"Saldo atual lido: {current_balance}")
+            return True, "Saldo lido", user_data, current_balance, signature
+            
+        except PermissionError as e:
+            print(f"❌ Erro de permissão ao acessar arquivo: {e}")
+            return False, "Erro de permissão ao acessar arquivo de saldo", None, 0, None
+        except Exception as e:
+            print(f"❌ Erro ao acessar arquivo: {e}")
+            traceback.print_exc()
+            return False, f"Erro ao acessar arquivo: {str(e)}", None, 0, None
+
+    async def read(self, steam_id: str, path: str, balance_key: str) -> tuple[bool, str, dict, int]:
+        """Leitura com cache: (sucesso, mensagem, cópia dos dados, saldo). Pode levantar asyncio.TimeoutError"""
+        entry = self._entries.get(steam_id)
+        success, message, user_data, balance, signature = await bank_io.run(
+            path, self._read_file, path, balance_key, entry.signature if entry else None
+        )
+        if not success:
+            if message == "Arquivo de saldo não encontrado":
+                self._forget(steam_id)
+            return False, message, None, balance
+        if user_data is None:
+            self.hits += 1
+            return True, message, dict(entry.data), entry.balance
+        self.misses += 1
+        self._store(steam_id, user_data, balance, signature)
+        return True, message, dict(user_data), balance
+
+    @classmethod
+    def _write_file(cls, path: str, user_data: dict) -> tuple:
+        """Executado em thread: gravação atômica; retorna a assinatura do arquivo novo"""
+        write_json_atomic(path, user_data, '.bank.')
+        return cls._signature(os.stat(path))
+
+    async def write(self, steam_id: str, path: str, user_data: dict, balance: int):
+        """Grava o arquivo de saldo e atualiza a memória. Pode levantar asyncio.TimeoutError"""
+        signature = await bank_io.run(path, self._write_file, path, user_data)
+        self._store(steam_id, user_data, balance, signature)
+
+    @classmethod
+    def _scan_entry(cls, entry: os.DirEntry, steam_id: str, balance_key: str, known: dict):
+        """Executado em thread: (steam_id, dados, saldo, assinatura) se o arquivo mudou, None se não, False em erro"""
+        try:
+            if not entry.is_file():
+                return None
+            signature = cls._signature(entry.stat())
+            if signature is not None and known.get(steam_id) == signature:
+                return None
+            with open(entry.path, 'r', encoding='utf-8') as f:
+                user_data = json.load(f)
+        except (OSError, ValueError):
+            # Arquivo sendo gravado pelo servidor: fica para a próxima varredura
+            return False
+        if not isinstance(user_data, dict):
+            return False
+        return steam_id, user_data, cls._balance_of(user_data, balance_key), signature
+
+    @classmethod
+    def _scan_chunk(cls, entries, balance_key: str, known: dict, limit: int) -> tuple[list, list, int, bool]:
+        """Executado em thread: avança até `limit` arquivos na listagem e relê apenas os novos ou alterados.
+
+        Retorna (presentes, alterados, erros, listagem concluída).
+        """
+        present = []
+        changed = []
+        errors = 0
+        for entry in entries:
+            name = entry.name
+            if name.startswith('.') or not name.endswith('.json'):
+                continue
+            steam_id = name[:-len('.json')]
+            present.append(steam_id)
+            result = cls._scan_entry(entry, steam_id, balance_key, known)
+            if result is False:
+                errors += 1
+            elif result is not None:
+                changed.append(result)
+            if len(present) >= limit:
+                return present, changed, errors, False
+        return present, changed, errors, True
+
+    async def scan(self) -> int:
+        """Varre o diretório e atualiza os saldos alterados fora do bot. Retorna quantos mudaram"""
+        snapshot = dict(self._entries)
+        known = {steam_id: entry.signature for steam_id, entry in snapshot.items()}
+        started = monotonic()
+        before = self.cursor
+        present = set()
+        errors = 0
+        entries = await bank_io.run(self.directory, os.scandir, self.directory, timeout=self.scan_timeout)
+        try:
+            # Cada lote entra na memória assim que termina: um tempo esgotado perde só o lote em andamento,
+            # e a próxima varredura não relê o que já foi carregado
+            finished = False
+            while not finished:
+                chunk_present, changed, chunk_errors, finished = await bank_io.run(
+                    self.directory, self._scan_chunk, entries, self.balance_key, known, self.scan_chunk,
+                    timeout=self.scan_timeout
+                )
+                present.update(chunk_present)
+                errors += chunk_errors
+                for steam_id, user_data, balance, signature in changed:
+                    # Um crédito gravado durante a varredura é mais recente do que o que foi lido
+                    if self._entries.get(steam_id) is snapshot.get(steam_id):
+                        self._store(steam_id, user_data, balance, signature)
+        finally:
+            # Na fila do diretório, a listagem só é fechada depois do lote que ainda estiver na thread
+            closing = asyncio.ensure_future(bank_io.run(self.directory, entries.close, timeout=self.scan_timeout))
+            closing.add_done_callback(lambda task: task.cancelled() or task.exception())
+        
+        # Arquivos removidos só são conhecidos com a listagem completa
+        for steam_id in snapshot.keys() - present:
+            if self._entries.get(steam_id) is snapshot[steam_id]:
+                self._forget(steam_id)
+        
+        self.scans += 1
+        self.scan_errors = errors
+        self.last_scan_at = datetime.now()
+        self.last_scan_duration = monotonic() - started
+        return self.cursor - before
+
+    async def _run(self):
+        while True:
+            if self._available():
+                try:
+                    changed = await self.scan()
+                    if self.scans == 1:
+                        print(f"💰 Saldos carregados em memória: {len(self._entries)} jogadores ({self.last_scan_duration:.1f}s)")
+                    elif changed:
+                        print(f"💰 {changed} saldos alterados no diretório desde a última varredura")
+                except asyncio.TimeoutError:
+                    print(
+                        f"⚠️ Tempo esgotado em um lote da varredura do diretório de saldos ({self.scan_timeout:.0f}s): "
+                        f"{len(self._entries)} saldos em memória, a próxima varredura continua a partir deles"
+                    )
+                except Exception as e:
+                    print(f"Erro ao varrer o diretório de saldos: {e}")
+            await asyncio.sleep(self.scan_interval)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'cursor': self.cursor,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': (self.hits / total) if total else 0.0,
+            'scans': self.scans,
+            'scan_errors': self.scan_errors,
+            'last_scan_at': self.last_scan_at,
+            'last_scan_duration': self.last_scan_duration
+        }
+
+# Criar instância global do cache de saldos
+balance_cache = BalanceCache(
+    scan_interval=float(os.getenv('BALANCE_SCAN_INTERVAL', 30)),
+    scan_timeout=float(os.getenv('BALANCE_SCAN_TIMEOUT', 120)),
+    scan_chunk=int(os.getenv('BALANCE_SCAN_CHUNK', 500))
+)
+
+BANK_STATUS_NOT_CONFIGURED = 'not_configured'
+BANK_STATUS_UNKNOWN = 'unknown'
+BANK_STATUS_OK = 'ok'
+BANK_STATUS_UNAVAILABLE = 'unavailable'
+
+class SalesConfirmationChannel:
+    """Serviço de confirmação de vendas, criado uma única vez na inicialização"""
+    def __init__(self, check_interval: float = 60, check_timeout: float = 10):
+        self.check_interval = check_interval
+        self.check_timeout = check_timeout
+        self.bank_status = BANK_STATUS_UNKNOWN
+        self.bank_status_message = "Ainda não verificado"
+        self.bank_checked_at = None
+        self._monitor_task = None
+        self._credits_recovered = False
+        
+        # Carregar o caminho do BANK_FILE (apenas tratamento de texto, sem acessar o disco)
+        bank_file = os.getenv('BANK_FILE')
+        if not bank_file:
+            print("⚠️ BANK_FILE não configurado no arquivo .env")
+            self.bank_file_path = None
+            self.bank_status = BANK_STATUS_NOT_CONFIGURED
+            self.bank_status_message = "BANK_FILE não configurado no arquivo .env"
+            return
+            
+        # Tratar caminho de rede (UNC path)
+        if bank_file.startswith('\\\\'):
+            # Preservar o formato UNC e garantir barras duplas
+            self.bank_file_path = bank_file
+            if not self.bank_file_path.endswith('\\'):
+                self.bank_file_path += '\\'
+            print(f"Caminho de rede detectado: {self.bank_file_path}")
+        else:
+            # Para caminhos locais, usar normalização padrão
+            self.bank_file_path = os.path.normpath(bank_file)
+            print(f"Caminho local detectado: {self.bank_file_path}")
+
+    @property
+    def channel_id(self) -> int:
+        return get_sales_confirmation_channel_id()
+
+    @property
+    def bank_available(self) -> bool:
+        return self.bank_status in (BANK_STATUS_OK, BANK_STATUS_UNKNOWN)
+
+    def bank_file_for(self, steam_id: str) -> str:
+        """Monta o caminho do arquivo de saldo de um jogador (sem acessar o disco)"""
+        if self.bank_file_path.startswith('\\\\'):
+            # Para caminhos de rede, usar concatenação direta
+            return f"{self.bank_file_path}{steam_id}.json"
+        # Para caminhos locais, usar os.path.join
+        return os.path.join(self.bank_file_path, f"{steam_id}.json")
+
+    async def start(self):
+        """Inicia a verificação periódica do BANK_FILE em segundo plano"""
+        if self._monitor_task is not None and not self._monitor_task.done():
+            return
+        if self.bank_file_path:
+            self._monitor_task = asyncio.create_task(self._monitor_bank_path())
+            balance_cache.start(self.bank_file_path, os.getenv('BALANCE_KEY', 'Balance'), lambda: self.bank_available)
+
+    async def close(self):
+        if self._monitor_task is not None:
+            self._monitor_task.cancel()
+            await asyncio.gather(self._monitor_task, return_exceptions=True)
+            self._monitor_task = None
+        await balance_cache.close()
+
+    def _set_bank_status(self, status: str, message: str):
+        changed = status != self.bank_status
+        self.bank_status = status
+        self.bank_status_message = message
+        self.bank_checked_at = datetime.now()
+        if not changed:
+            return
+        if status == BANK_STATUS_OK:
+            print(f"✅ BANK_FILE configurado e com acesso: {self.bank_file_path}")
+        else:
+            print(f"⚠️ {message}")
+            print("Verifique se:")
+            print("1. O caminho está correto")
+            print("2. O computador tem acesso à rede")
+            print("3. As permissões de acesso estão corretas")
+
+    async def check_bank_path(self):
+        """Verifica o acesso ao diretório em uma thread, com tempo limite"""
+        try:
+            exists = await bank_io.run(self.bank_file_path, os.path.isdir, self.bank_file_path, timeout=self.check_timeout)
+        except asyncio.TimeoutError:
+            self._set_bank_status(
+                BANK_STATUS_UNAVAILABLE,
+                f"Tempo esgotado ao acessar BANK_FILE ({self.check_timeout:.0f}s): {self.bank_file_path}"
+            )
+            return
+        except Exception as e:
+            self._set_bank_status(BANK_STATUS_UNAVAILABLE, f"Erro ao acessar BANK_FILE: {str(e)}")
+            return
+
+        if exists:
+            self._set_bank_status(BANK_STATUS_OK, "Diretório acessível")
+        else:
+            self._set_bank_status(
+                BANK_STATUS_UNAVAILABLE,
+                f"Caminho do BANK_FILE não encontrado ou sem acesso: {self.bank_file_path}"
             )
+
+    async def _monitor_bank_path(self):
+        while True:
+            await self.check_bank_path()
+            await asyncio.sleep(self.check_interval)
+
+    async def get_steam_id(self, user_id: str) -> str:
+        try:
+            steam_id = await steam_id_cache.get_steam_id(user_id)
+            if steam_id:
+                return steam_id
+            return "Usuário não registrado"
+        except Exception as e:
+            print(f"Erro ao buscar Steam ID: {e}")
+            return "Erro ao buscar registro"
             
-            os.remove("users_export.csv")
+    async def process_json_file(self, attachment: discord.Attachment) -> bool:
+        purchase = await self.load_purchase(attachment)
+        if purchase is None:
+            return False
+        steam_id = await self.get_steam_id(purchase.user_id)
+        return await self.settle_purchase(purchase, steam_id)
 
-        elif self.values[0] == "channel":
-            current_channel = interaction.guild.get_channel(get_channel_id())
-            current_status = f"Canal atual: {current_channel.mention if current_channel else 'Não configurado'}"
+    async def load_purchase(self, attachment: discord.Attachment) -> Purchase:
+        """Baixa, valida e interpreta o anexo. Retorna a compra ou None"""
+        claimed_purchase_id = None
+        try:
+            print(f"\nIniciando processamento do arquivo: {attachment.filename}")
+            print(f"Tamanho do arquivo: {attachment.size} bytes")
+                
+            # Verifica se é um arquivo JSON
+            if not attachment.filename.endswith('.json'):
+                print(f"❌ Arquivo ignorado: {attachment.filename} (não é JSON)")
+                return None
+                
+            # Baixa o conteúdo do arquivo, respeitando o limite de tamanho durante o download
+            try:
+                json_content = await read_attachment_limited(attachment, PURCHASE_MAX_BYTES)
+            except AttachmentTooLarge as e:
+                print(f"❌ Arquivo muito grande: {e}")
+                return None
             
-            embed = discord.Embed(
-                title="⚙️ Configuração do Canal de Registro",
-                description=(
-                    f"{current_status}\n\n"
-                    "Selecione abaixo o novo canal de registro.\n"
-                    "Os menus de registro serão automaticamente movidos para o novo canal."
-                ),
-                color=discord.Color.blue()
+            try:
+                purchase = parse_purchase(json_content)
+            except PurchaseFormatError as e:
+                print(f"❌ Anexo de venda inválido: {e}")
+                print(f"Conteúdo problemático: {json_content[:200].decode('utf-8', 'replace')}...")  # Mostra primeiros 200 bytes
+                return None
+            
+            purchase_id = purchase.purchase_id
+            
+            # Se não for um arquivo de teste (purchase ID != 0), verifica duplicidade
+            if str(purchase_id) != '0':
+                if await purchase_store.is_duplicate(purchase_id) or not await purchase_store.claim(purchase_id, purchase.user_id):
+                    print(f"⚠️ Arquivo já processado anteriormente: Purchase ID {purchase_id}")
+                    return None
+                claimed_purchase_id = purchase_id
+                
+            print(f"✅ Arquivo JSON válido: {attachment.filename}")
+            print(
+                f"Produtos entregues: {purchase.product_count} | Valores somados: {len(purchase.valores_processados)} "
+                f"| Códigos: {len(purchase.codigos)}"
             )
+            if purchase.ignored:
+                print(f"⚠️ {purchase.ignored} valores ignorados (valor <= 0, inválido ou já processado)")
+            return purchase
             
-            view = ConfigView('channel')
-            await interaction.followup.send(embed=embed, view=view, ephemeral=True)
+        except Exception as e:
+            print(f"❌ Erro ao processar arquivo JSON:")
+            traceback.print_exc()
+            if claimed_purchase_id is not None:
+                await mark_purchase_safely(claimed_purchase_id, PURCHASE_FAILED, detail=f"Erro ao processar: {e}")
+            return None
 
-class AdminView(discord.ui.View):
-    def __init__(self):
-        super().__init__(timeout=None)
-        self.add_item(AdminSelect())
+    async def settle_purchase(self, purchase: Purchase, steam_id: str, on_queued=None) -> bool:
+        """Credita o saldo, grava o log e marca a compra como processada"""
+        try:
+            purchase_id = purchase.purchase_id
+            
+            print(f"\nResumo do processamento:")
+            print(f"Purchase ID: {purchase_id}")
+            print(f"User ID: {purchase.user_id}")
+            print(f"Steam ID: {steam_id}")
+            print(f"Valor Total: {purchase.valor_total}")
+            print(f"Quantidade de Códigos: {len(purchase.codigos)}")
+            
+            # Cria o registro de log
+            log_entry = {
+                'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                'purchase_id': purchase_id,
+                'user_id': purchase.user_id,
+                'steam_id': steam_id,
+                'valor_total': purchase.valor_total,
+                'codigos': purchase.codigos,
+                'valores_processados': purchase.valores_processados  # Adiciona lista de valores processados ao log
+            }
+            
+            # Salva no arquivo de log
+            status, balance_info = await self._save_log(log_entry, on_queued)
+            
+            # Registra o resultado apenas se não for teste (purchase ID != 0)
+            if str(purchase_id) != '0':
+                await purchase_store.mark(
+                    purchase_id,
+                    status,
+                    steam_id=steam_id if is_registered_steam_id(steam_id) else None,
+                    valor=purchase.valor_total,
+                    detail=balance_info
+                )
+            
+            print(f"✅ Venda registrada com sucesso para Purchase ID: {purchase_id}")
+            return True
+            
+        except Exception as e:
+            print(f"❌ Erro ao processar arquivo JSON:")
+            traceback.print_exc()
+            if str(purchase.purchase_id) != '0':
+                await mark_purchase_safely(purchase.purchase_id, PURCHASE_FAILED, detail=f"Erro ao processar: {e}")
+            return False
 
-class ConfigView(discord.ui.View):
-    def __init__(self, config_type: str):
-        super().__init__()
-        self.config_type = config_type
+    async def _save_log(self, log_entry: dict, on_queued=None) -> tuple[str, str]:
+        """Atualiza o saldo e grava o log. Retorna (status da compra, descrição do resultado)"""
+        status = PURCHASE_FAILED
+        balance_info = "Saldo não atualizado"
+        try:
+            # Atualizar o saldo antes de salvar o log
+            if is_registered_steam_id(log_entry['steam_id']):
+                print("\nIniciando atualização de saldo...")
+                # Compras do mesmo jogador recebidas em sequência viram uma única gravação
+                pending_credit = credit_coalescer.submit(log_entry['steam_id'], log_entry)
+                if on_queued is not None:
+                    on_queued()
+                status, balance_info = await pending_credit
+                print(f"Resultado da atualização: {balance_info}")
+            else:
+                balance_info = "Saldo não atualizado: Usuário não registrado"
+                print(f"Saldo não atualizado: {log_entry['steam_id']}")
+                await self._record_sales([log_entry], False, balance_info)
+        except Exception as e:
+            print(f"Erro ao salvar log: {e}")
+            import traceback
+            traceback.print_exc()
+        return status, balance_info
+
+    async def credit_batch(self, steam_id: str, log_entries: list[dict]) -> tuple[str, str]:
+        """Aplica as compras agrupadas de um jogador em uma gravação e registra cada uma no log"""
+        credit_id, success, message, new_balance = await self.apply_credit(steam_id, log_entries)
+        balance_info = describe_credit(log_entries, success, message, new_balance)
         
-        # Adicionar seletor de canal
-        channel_select = discord.ui.ChannelSelect(
-            placeholder="Selecione o canal...",
-            channel_types=[discord.ChannelType.text]
-        )
-        channel_select.callback = self.channel_callback
-        self.add_item(channel_select)
-    
-    async def channel_callback(self, interaction: discord.Interaction):
+        status = PURCHASE_CREDITED
+        if not success and credit_journal.state_of(credit_id) == CREDIT_PREPARED:
+            # O saldo pode ter sido gravado: a compra fica reservada até o journal ser conferido
+            status = PURCHASE_UNCERTAIN
+            balance_info += " - aguardando conferência do journal"
+        elif not success:
+            status = await credit_retries.handle_failure(steam_id, log_entries, message, credit_id)
+            if status == PURCHASE_RETRYING:
+                balance_info += " - nova tentativa agendada"
+        
+        await self.finish_credit(credit_id, log_entries, success, balance_info)
+        return status, balance_info
+
+    async def apply_credit(self, steam_id: str, log_entries: list[dict], retry_id: int = None) -> tuple[str, bool, str, int]:
+        """Registra o crédito no journal e atualiza o saldo. Retorna (credit_id, sucesso, mensagem, saldo)"""
+        valor_total = sum(entry['valor_total'] for entry in log_entries)
+        # O crédito vai para o journal antes de qualquer acesso ao arquivo de saldo
+        credit_id = await credit_journal.begin(steam_id, valor_total, log_entries, retry_id=retry_id)
+        success, message, new_balance = await self.update_user_balance(steam_id, valor_total, credit_id=credit_id)
+        return credit_id, success, message, new_balance
+
+    async def finish_credit(self, credit_id: str, log_entries: list[dict], success: bool, balance_info: str):
+        """Atualiza estatísticas e ledger e encerra o crédito no journal"""
+        if success:
+            try:
+                for entry in log_entries:
+                    await stats_store.record_credit(entry['valor_total'])
+            except Exception as e:
+                print(f"Erro ao atualizar estatísticas de vendas: {e}")
+        
+        await self._record_sales(log_entries, success, balance_info)
+        
+        # Créditos com gravação incerta continuam no journal para a recuperação
+        if credit_journal.state_of(credit_id) != CREDIT_PREPARED:
+            await credit_journal.append(credit_id, CREDIT_DONE)
+
+    async def _record_sales(self, log_entries: list[dict], credited: bool, balance_info: str):
+        """Grava as vendas no ledger e aguarda a confirmação da gravação"""
+        recorded_at = time()
         try:
-            channel = interaction.data['values'][0]
-            config = load_config()
+            await sales_ledger.write([
+                dict(log_entry, credited=credited, balance_info=balance_info, recorded_at=recorded_at)
+                for log_entry in log_entries
+            ])
+        except Exception as e:
+            # O status da compra vem do crédito: uma falha do ledger não desfaz um saldo já atualizado
+            print(f"⚠️ Vendas não confirmadas no ledger ({', '.join(str(entry['purchase_id']) for entry in log_entries)}): {e}")
+            return
+        print(f"Vendas registradas no ledger: {', '.join(str(entry['purchase_id']) for entry in log_entries)}")
+
+    async def update_user_balance(self, steam_id: str, valor: int, credit_id: str = None) -> tuple[bool, str, int]:
+        try:
+            print(f"\nProcessando valor para Steam ID {steam_id}:")
+            print(f"Valor a adicionar: {valor}")
             
-            if self.config_type == 'channel':
-                config['registration_channel_id'] = channel
-                await interaction.response.send_message(
-                    f"✅ Canal de registro configurado para <#{channel}>",
-                    ephemeral=True
-                )
-                # Configurar o novo canal
-                new_channel = interaction.guild.get_channel(int(channel))
-                if new_channel:
-                    await setup_registration_channel(interaction.client)
+            if credit_id is None:
+                credit_id = await credit_journal.begin(steam_id, valor)
             
-            save_config(config)
+            # Validar valor a adicionar
+            if valor < 0:
+                print(f"❌ Valor negativo detectado: {valor}")
+                return await abort_credit(credit_id, "Valor negativo não permitido", 0)
             
+            # Arquivos JSON ou ledger SQLite, conforme BANK_BACKEND
+            return await bank_backend.credit(steam_id, valor, credit_id)
+                    
         except Exception as e:
-            await interaction.response.send_message(
-                f"❌ Erro ao configurar canal: {str(e)}",
-                ephemeral=True
-            )
+            print(f"❌ Erro inesperado ao atualizar saldo: {e}")
+            traceback.print_exc()
+            return False, f"Erro ao atualizar saldo: {str(e)}", 0
 
-async def setup_database():
-    async with aiosqlite.connect('users.db') as db:
-        await db.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                discord_id TEXT PRIMARY KEY,
-                discord_name TEXT,
-                steam_id TEXT
-            )
-        ''')
-        await db.commit()
+    async def recover_credits(self):
+        """Conclui os créditos que ficaram pela metade na última execução (uma vez por processo)"""
+        if self._credits_recovered:
+            return
+        self._credits_recovered = True
+        
+        entries = await credit_journal.unfinished()
+        if entries:
+            print(f"🔁 Recuperando {len(entries)} créditos pendentes do journal...")
+            if self.bank_file_path:
+                await self.check_bank_path()
+            for entry in entries:
+                try:
+                    await self._recover_credit(entry)
+                except Exception as e:
+                    print(f"❌ Erro ao recuperar crédito {entry['id']}: {e}")
+                    traceback.print_exc()
+        
+        remaining = await credit_journal.compact()
+        if remaining:
+            print(f"⚠️ {remaining} créditos continuam pendentes no journal ({credit_journal.path})")
 
-async def get_steam_id64(profile_url: str) -> str:
-    # Limpar a URL
-    profile_url = profile_url.strip().rstrip('/')
-    
-    try:
-        # Tentar extrair steamid64 diretamente da URL de perfil numérico
-        if 'profiles/' in profile_url:
-            steam_id = profile_url.split('profiles/')[-1].split('/')[0]
-            if steam_id.isdigit() and len(steam_id) == 17:
-                return steam_id
+    async def _hold_uncertain(self, entry: dict, message: str):
+        """Crédito que continua PREPARED no journal: compras reservadas e tentativa da fila parada"""
+        if entry.get('retry_id') is not None:
+            await credit_retries.park(entry['retry_id'], message)
+        await mark_purchases(entry.get('log_entries', []), PURCHASE_UNCERTAIN, entry['steam_id'], message)
+
+    async def _recover_credit(self, entry: dict):
+        state = entry['state']
+        if state in (CREDIT_INTENT, CREDIT_PREPARED) and not self.bank_available:
+            print(f"⚠️ Crédito {entry['id']} mantido no journal: diretório de saldos indisponível")
+            if state == CREDIT_PREPARED:
+                await self._hold_uncertain(entry, "Diretório de saldos indisponível na recuperação do journal")
+            return
         
-        # Tentar extrair vanity URL
-        if 'id/' in profile_url:
-            vanity_url = profile_url.split('id/')[-1].split('/')[0]
+        if state == CREDIT_INTENT:
+            # Nada foi gravado no arquivo de saldo: aplica o crédito normalmente
+            success, message, new_balance = await self.update_user_balance(
+                entry['steam_id'], entry['valor'], credit_id=entry['id']
+            )
+            if credit_journal.state_of(entry['id']) == CREDIT_PREPARED:
+                await self._hold_uncertain(entry, message)
+                return
+        elif state == CREDIT_PREPARED:
+            resolved, success, message, new_balance = await bank_backend.resolve_prepared(entry)
+            if not resolved:
+                await self._hold_uncertain(entry, message)
+                return
+        elif state == CREDIT_COMMITTED:
+            success, message, new_balance = True, "Saldo atualizado", entry['after']
         else:
-            # Se não encontrou "id/", usa a última parte da URL
-            vanity_url = profile_url.split('/')[-1]
+            success, message, new_balance = False, entry.get('reason', "Crédito não aplicado"), 0
         
-        # Aguardar rate limit antes de fazer a requisição
-        await steam_rate_limiter.acquire()
+        log_entries = entry.get('log_entries', [])
+        balance_info = describe_credit(log_entries, success, message, new_balance)
+        print(f"Crédito {entry['id']} ({entry['steam_id']}, {entry['valor']}) recuperado: {balance_info}")
         
-        # Tentar resolver vanity URL via API
-        async with aiohttp.ClientSession() as session:
-            api_url = f'http://api.steampowered.com/ISteamUser/ResolveVanityURL/v0001/?key={os.getenv("STEAM_API_KEY")}&vanityurl={vanity_url}'
-            async with session.get(api_url) as response:
-                if response.status == 429:  # Too Many Requests
-                    print("Rate limit atingido. Aguardando 2 segundos...")
-                    await asyncio.sleep(2)  # Espera 2 segundos
-                    return await get_steam_id64(profile_url)  # Tenta novamente
-                    
-                if response.status == 200:
-                    data = await response.json()
-                    if data['response'].get('success') == 1:
-                        return data['response']['steamid']
-                    
-        # Se chegou aqui, tentar uma última vez com a URL completa
-        await steam_rate_limiter.acquire()
+        retry_id = entry.get('retry_id')
+        if success:
+            status = PURCHASE_CREDITED
+            if retry_id is not None:
+                await credit_retries.remove(retry_id)
+        elif retry_id is not None:
+            # A tentativa veio da fila de créditos, que continua responsável por ela
+            status = await credit_retries.resume(retry_id, message)
+        else:
+            status = await credit_retries.handle_failure(entry['steam_id'], log_entries, message, entry['id'])
         
-        async with aiohttp.ClientSession() as session:
-            api_url = f'http://api.steampowered.com/ISteamUser/ResolveVanityURL/v0001/?key={os.getenv("STEAM_API_KEY")}&vanityurl={profile_url}'
-            async with session.get(api_url) as response:
-                if response.status == 429:  # Too Many Requests
-                    print("Rate limit atingido. Aguardando 2 segundos...")
-                    await asyncio.sleep(2)  # Espera 2 segundos
-                    return await get_steam_id64(profile_url)  # Tenta novamente
-                    
-                if response.status == 200:
-                    data = await response.json()
-                    if data['response'].get('success') == 1:
-                        return data['response']['steamid']
-    
-    except Exception as e:
-        print(f"Erro ao obter Steam ID: {e}")
-    
-    return None
+        balance_info += " (recuperado do journal)"
+        if success:
+            try:
+                for log_entry in log_entries:
+                    await stats_store.record_credit(log_entry['valor_total'])
+            except Exception as e:
+                print(f"Erro ao atualizar estatísticas de vendas: {e}")
+        if log_entries:
+            await self._record_sales(log_entries, success, balance_info)
+        await mark_purchases(log_entries, status, entry['steam_id'], balance_info)
+        await credit_journal.append(entry['id'], CREDIT_DONE)
 
-async def get_steam_profile_data(steam_id: str) -> dict:
-    try:
-        # Aguardar rate limit antes de fazer a requisição
-        await steam_rate_limiter.acquire()
-        
-        async with aiohttp.ClientSession() as session:
-            api_url = f'http://api.steampowered.com/ISteamUser/GetPlayerSummaries/v0002/?key={os.getenv("STEAM_API_KEY")}&steamids={steam_id}'
-            async with session.get(api_url) as response:
-                if response.status == 429:  # Too Many Requests
-                    print("Rate limit atingido. Aguardando 2 segundos...")
-                    await asyncio.sleep(2)  # Espera 2 segundos
-                    return await get_steam_profile_data(steam_id)  # Tenta novamente
-                    
-                if response.status != 200:
-                    print(f"Erro na API Steam: Status {response.status}")
-                    return None
-                
-                data = await response.json()
-                if not data.get('response', {}).get('players'):
-                    return None
-                
-                player = data['response']['players'][0]
-                
-                # Criar dicionário com dados básicos (sempre disponíveis)
-                profile_data = {
-                    'steamid': player.get('steamid'),
-                    'personaname': player.get('personaname', 'Nome não disponível'),
-                    'avatarfull': player.get('avatarfull'),
-                    'profileurl': player.get('profileurl'),
-                    'personastate': player.get('personastate', 0),
-                }
-                
-                # Adicionar dados extras se o perfil for público
-                if player.get('communityvisibilitystate', 1) == 3:  # 3 = Público
-                    profile_data.update({
-                        'realname': player.get('realname'),
-                        'timecreated': player.get('timecreated'),
-                        'loccountrycode': player.get('loccountrycode'),
-                        'gameextrainfo': player.get('gameextrainfo'),
-                    })
-                
-                return profile_data
-                
-    except Exception as e:
-        print(f"Erro ao obter dados do perfil Steam: {e}")
-        return None
+class SalesPipeline:
+    """Fila limitada de anexos de vendas processados por um conjunto fixo de workers"""
+    def __init__(self, workers: int = 4, max_queue: int = 100, drain_timeout: float = 60):
+        self.worker_count = max(1, workers)
+        self.max_queue = max_queue
+        self.drain_timeout = drain_timeout
+        self._queue = None
+        self._workers = []
+        self._closing = False
+        self._turn = None
+        self._next_ticket = 0  # Ordem de retirada da fila
+        self._next_turn = 0    # Próximo ticket autorizado a reservar sua vez de crédito
+        self._tails = {}       # chave (steam_id) -> Future do último crédito reservado
+        self.processed = 0
+        self.failed = 0
 
-async def setup_registration_channel(bot):
-    try:
-        channel = bot.get_channel(get_channel_id())
-        if channel:
-            await channel.purge()
-            
-            embed = discord.Embed(
-                title="Sistema de Registro Steam",
-                description=(
-                    "Bem-vindo ao sistema de registro Steam!\n\n"
-                    "Use o menu abaixo para:\n"
-                    "🟢 **Registrar**: Vincular sua conta Steam\n"
-                    "🔵 **Consultar Cadastro**: Ver sua conta vinculada\n"
-                    "⚫ **Alterar Conta Steam**: Mudar sua conta Steam\n"
-                    "🔴 **Remover Cadastro**: Desvincular sua conta"
-                ),
-                color=discord.Color.blue()
+    @property
+    def is_running(self) -> bool:
+        return bool(self._workers) and not self._closing
+
+    def start(self):
+        """Cria a fila e os workers uma única vez (chamadas repetidas são ignoradas)"""
+        if self._workers:
+            return
+        self._closing = False
+        self._queue = asyncio.Queue(maxsize=self.max_queue)
+        self._turn = asyncio.Condition()
+        self._workers = [
+            asyncio.create_task(self._worker(index), name=f'sales-worker-{index}')
+            for index in range(self.worker_count)
+        ]
+        print(f"Pipeline de vendas iniciado com {self.worker_count} workers (fila: {self.max_queue})")
+
+    async def submit(self, monitor, attachment, on_done=None) -> bool:
+        """Enfileira um anexo; aguarda espaço na fila quando ela está cheia (backpressure)"""
+        if not self.is_running:
+            print(f"⚠️ Pipeline de vendas parado, anexo não enfileirado: {attachment.filename}")
+            return False
+        await self._queue.put((monitor, attachment, on_done))
+        return True
+
+    def queue_depth(self) -> int:
+        return self._queue.qsize() if self._queue else 0
+
+    async def _worker(self, index: int):
+        while True:
+            monitor, attachment, on_done = await self._queue.get()
+            # O ticket é atribuído na retirada, então segue a ordem da fila
+            ticket = self._next_ticket
+            self._next_ticket += 1
+            try:
+                await self._process(ticket, monitor, attachment)
+            except Exception as e:
+                self.failed += 1
+                print(f"Erro no worker de vendas {index}: {e}")
+                traceback.print_exc()
+            finally:
+                self._queue.task_done()
+                if on_done is not None:
+                    on_done()
+
+    async def _claim_slot(self, ticket: int, key):
+        """Reserva, na ordem dos tickets, a vez deste crédito na fila do seu steam_id"""
+        async with self._turn:
+            await self._turn.wait_for(lambda: self._next_turn == ticket)
+            previous = done = None
+            if key is not None:
+                previous = self._tails.get(key)
+                done = asyncio.get_running_loop().create_future()
+                self._tails[key] = done
+            self._next_turn += 1
+            self._turn.notify_all()
+        return previous, done
+
+    async def _resolve(self, monitor, attachment):
+        """Etapa paralela: download, validação e resolução do Steam ID"""
+        print(f"Processando anexo: {attachment.filename}")
+        purchase = await monitor.load_purchase(attachment)
+        if purchase is None:
+            return None, None, None
+
+        # A reserva no índice de compras (load_purchase) já impede duplicatas em processamento
+        steam_id = await monitor.get_steam_id(purchase.user_id)
+        key = steam_id if is_registered_steam_id(steam_id) else f"user:{purchase.user_id}"
+        return purchase, steam_id, key
+
+    async def _process(self, ticket: int, monitor, attachment):
+        purchase = steam_id = key = None
+        try:
+            purchase, steam_id, key = await self._resolve(monitor, attachment)
+        except Exception as e:
+            print(f"Erro ao preparar anexo {attachment.filename}: {e}")
+            traceback.print_exc()
+        finally:
+            # Mesmo em caso de erro o ticket precisa passar a vez
+            previous, done = await self._claim_slot(ticket, key)
+
+        if key is None:
+            return
+
+        try:
+            # Créditos do mesmo steam_id entram na fila de crédito em ordem; o próximo é
+            # liberado assim que este for enfileirado, para que possam ser agrupados
+            if previous is not None:
+                await previous
+            if await monitor.settle_purchase(purchase, steam_id, on_queued=functools.partial(self._release, key, done)):
+                self.processed += 1
+            else:
+                self.failed += 1
+        finally:
+            self._release(key, done)
+
+    def _release(self, key, done: asyncio.Future):
+        if not done.done():
+            done.set_result(None)
+        if self._tails.get(key) is done:
+            del self._tails[key]
+
+    async def close(self):
+        """Para de aceitar anexos, esvazia a fila e encerra os workers"""
+        if not self._workers or self._closing:
+            return
+        self._closing = True
+        print(f"Encerrando pipeline de vendas ({self.queue_depth()} anexos na fila)...")
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout=self.drain_timeout)
+        except asyncio.TimeoutError:
+            print("⚠️ Tempo esgotado ao esvaziar a fila de vendas")
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        print("Pipeline de vendas encerrado")
+
+def is_registered_steam_id(steam_id: str) -> bool:
+    """Indica se get_steam_id retornou um Steam ID de verdade (e não uma mensagem de erro)"""
+    return bool(steam_id) and steam_id not in ("Usuário não registrado", "Erro ao buscar registro")
+
+def describe_credit(log_entries: list[dict], success: bool, message: str, new_balance: int) -> str:
+    """Texto do resultado de um crédito, usado no ledger e no índice de compras"""
+    balance_info = f"Novo saldo: {new_balance}" if success else f"Erro no saldo: {message}"
+    if len(log_entries) > 1:
+        valor_total = sum(entry['valor_total'] for entry in log_entries)
+        balance_info += f" (lote de {len(log_entries)} compras, total {valor_total})"
+    return balance_info
+
+async def mark_purchases(log_entries: list[dict], status: str, steam_id: str, detail: str):
+    """Atualiza no índice de compras todas as compras de um crédito (exceto as de teste)"""
+    for log_entry in log_entries:
+        if str(log_entry['purchase_id']) != '0':
+            await mark_purchase_safely(
+                log_entry['purchase_id'], status, steam_id=steam_id, valor=log_entry['valor_total'], detail=detail
             )
-            await channel.send(embed=embed, view=RegistrationView())
-            print("Menu de registro configurado com sucesso!")
-    except Exception as e:
-        print(f"Erro ao configurar canal de registro: {e}")
 
-@bot.event
-async def on_ready():
-    print(f'Bot está online como {bot.user.name}')
-    
-    # Configurar presença do bot
-    await bot.change_presence(
-        activity=discord.Activity(
-            type=discord.ActivityType.watching,
-            name="registros Steam"
-        ),
-        status=discord.Status.online
-    )
-    
-    await setup_database()
-    
-    # Verificar permissões do bot
-    for guild in bot.guilds:
-        registered_role = guild.get_role(get_role_id())
-        if registered_role:
-            has_perm, message = await check_role_permissions(guild, guild.me, registered_role)
-            if not has_perm:
-                print(f"⚠️ Aviso de permissões no servidor {guild.name}: {message}")
-    
-    # Registrar comandos de aplicação
+async def mark_purchase_safely(purchase_id, status: str, **fields):
+    """Atualiza o índice de compras sem deixar um erro de banco interromper o fluxo"""
     try:
-        synced = await bot.tree.sync()
-        print(f"Sincronizados {len(synced)} comandos")
+        await purchase_store.mark(purchase_id, status, **fields)
     except Exception as e:
-        print(f"Erro ao sincronizar comandos: {e}")
-    
-    # Configurar canal de registro
-    await setup_registration_channel(bot)
-    
-    # Configurar canal administrativo
-    try:
-        admin_channel = bot.get_channel(int(os.getenv('ADMIN_CHANNEL_ID')))
-        if admin_channel:
-            await admin_channel.purge()
+        print(f"Erro ao atualizar índice de compras ({purchase_id}): {e}")
+
+# Criar instância global do serviço de confirmação de vendas
+sales_monitor = SalesConfirmationChannel(
+    check_interval=float(os.getenv('BANK_CHECK_INTERVAL', 60)),
+    check_timeout=float(os.getenv('BANK_CHECK_TIMEOUT', 10))
+)
+
+async def abort_credit(credit_id: str, message: str, balance: int) -> tuple[bool, str, int]:
+    """Registra no journal que o crédito não foi aplicado"""
+    await credit_journal.append(credit_id, CREDIT_ABORTED, reason=message)
+    return False, message, balance
+
+class BankBackend(ABC):
+    """Armazenamento dos saldos por trás de update_user_balance"""
+    name = None
+
+    def __init__(self, monitor: SalesConfirmationChannel):
+        self.monitor = monitor
+
+    async def start(self):
+        pass
+
+    async def close(self):
+        pass
+
+    @abstractmethod
+    async def credit(self, steam_id: str, valor: int, credit_id: str) -> tuple[bool, str, int]:
+        """Aplica o crédito já registrado no journal. Retorna (sucesso, mensagem, novo saldo)"""
+
+    @abstractmethod
+    async def resolve_prepared(self, entry: dict) -> tuple[bool, bool, str, int]:
+        """Retorna (resolvido, creditado, mensagem, saldo) para um crédito no estado 'prepared'"""
+
+    async def summary(self) -> dict:
+        return {}
+
+    def stats(self) -> dict:
+        return {'backend': self.name}
+
+class JsonFileBankBackend(BankBackend):
+    """Um arquivo <steamid>.json por jogador, reescrito a cada crédito (formato lido pelo servidor)"""
+    name = 'json'
+
+    async def _open_file(self, steam_id: str, credit_id: str):
+        """Confere o diretório e lê o arquivo do jogador (com o lock dele já obtido pelo chamador).
+
+        Retorna (dados, saldo) ou o resultado do crédito abortado.
+        """
+        try:
+            success, message, user_data, current_balance = await balance_cache.read(
+                steam_id, self.monitor.bank_file_for(steam_id), os.getenv('BALANCE_KEY', 'Balance')
+            )
+        except asyncio.TimeoutError:
+            print(f"❌ Tempo esgotado ao ler arquivo de saldo ({bank_io.timeout:.0f}s): {self.monitor.bank_file_for(steam_id)}")
+            return None, await abort_credit(credit_id, "Tempo esgotado ao acessar arquivo de saldo", 0)
+        if not success:
+            return None, await abort_credit(credit_id, message, current_balance)
+        return (user_data, current_balance), None
+
+    async def _check_directory(self, credit_id: str):
+        """Resultado do crédito abortado se o diretório de saldos não pode ser usado, senão None"""
+        # Verificar se o caminho base está configurado
+        if not self.monitor.bank_file_path:
+            print("❌ BANK_FILE não está configurado ou acessível")
+            return await abort_credit(credit_id, "Erro de configuração do caminho de arquivos", 0)
+        
+        # Falhar imediatamente se a última verificação encontrou o diretório indisponível
+        if not self.monitor.bank_available:
+            print(f"❌ Diretório de saldos indisponível: {self.monitor.bank_status_message}")
+            return await abort_credit(credit_id, "Diretório de saldos indisponível", 0)
+        return None
+
+    async def credit(self, steam_id: str, valor: int, credit_id: str) -> tuple[bool, str, int]:
+        failure = await self._check_directory(credit_id)
+        if failure is not None:
+            return failure
+        
+        # Construir o caminho completo do arquivo do usuário
+        user_bank_file = self.monitor.bank_file_for(steam_id)
+        print(f"Tentando acessar arquivo: {user_bank_file}")
+        
+        # Obter a chave de saldo do .env ou usar "Balance" como padrão
+        balance_key = os.getenv('BALANCE_KEY', 'Balance')
+        
+        # Obter lock para o arquivo
+        async with bank_file_locks.hold(user_bank_file):  # Usar lock para evitar concorrência
+            # Todo o acesso ao arquivo acontece no pool de I/O; se mtime e tamanho não mudaram, o
+            # conteúdo vem da memória
+            opened, failure = await self._open_file(steam_id, credit_id)
+            if failure is not None:
+                return failure
+            user_data, current_balance = opened
             
-            # Verificar permissões antes de configurar
-            registered_role = admin_channel.guild.get_role(get_role_id())
-            if registered_role:
-                has_perm, message = await check_role_permissions(admin_channel.guild, admin_channel.guild.me, registered_role)
-                if not has_perm:
-                    embed = discord.Embed(
-                        title="⚠️ Aviso de Permissões",
-                        description=message,
-                        color=discord.Color.yellow()
-                    )
-                    await admin_channel.send(embed=embed)
+            # Calcular novo saldo
+            new_balance = current_balance + valor
+            print(f"Novo saldo calculado: {new_balance}")
             
-            embed = discord.Embed(
-                title="🔐 Painel Administrativo",
-                description=(
-                    "Bem-vindo ao painel administrativo!\n\n"
-                    "Use o menu abaixo para acessar as funções:\n"
-                    "📊 **Estatísticas**: Ver dados gerais do sistema\n"
-                    "📥 **Exportar Dados**: Baixar CSV com todos os registros\n"
-                    "⚙️ **Canal de Registro**: Configurar canal do sistema\n"
-                    "📡 **Canal de Confirmação de Vendas**: Configurar canal de vendas"
-                ),
-                color=discord.Color.dark_gold()
-            )
-            await admin_channel.send(embed=embed, view=AdminView())
-            print("Painel administrativo configurado com sucesso!")
-    except Exception as e:
-        print(f"Erro ao configurar painel administrativo: {e}")
+            # Registrar saldo anterior e novo antes de gravar: permite conferir o arquivo após uma queda
+            await credit_journal.append(credit_id, CREDIT_PREPARED, before=current_balance, after=new_balance)
+            user_data[balance_key] = new_balance
+            
+            # Salvar as alterações (arquivo temporário + fsync + rename)
+            try:
+                await balance_cache.write(steam_id, user_bank_file, user_data, new_balance)
+            except asyncio.TimeoutError:
+                # A gravação pode terminar depois: o crédito fica no journal para conferência
+                print(f"❌ Tempo esgotado ao gravar arquivo de saldo ({bank_io.timeout:.0f}s): {user_bank_file}")
+                return False, "Tempo esgotado ao gravar saldo (será conferido na próxima inicialização)", current_balance
+            except PermissionError as e:
+                print(f"❌ Erro de permissão ao acessar arquivo: {e}")
+                return await abort_credit(credit_id, "Erro de permissão ao acessar arquivo de saldo", current_balance)
+            except Exception as e:
+                print(f"❌ Erro ao salvar arquivo: {e}")
+                return await abort_credit(credit_id, "Erro ao salvar alterações", current_balance)
+            
+            await credit_journal.append(credit_id, CREDIT_COMMITTED)
+        
+        print(f"✅ Saldo atualizado com sucesso para Steam ID {steam_id}:")
+        print(f"   Saldo anterior: {current_balance}")
+        print(f"   Valor adicionado: {valor}")
+        print(f"   Novo saldo: {new_balance}")
+        return True, "Saldo atualizado com sucesso", new_balance
 
-async def get_user_info(db, discord_id=None, discord_name=None):
-    try:
-        if discord_id:
-            cursor = await db.execute(
-                'SELECT * FROM users WHERE discord_id = ?',
-                (str(discord_id),)
-            )
-            result = await cursor.fetchone()
-            if result:
-                return {
-                    'discord_id': result[0],
-                    'discord_name': result[1],
-                    'steam_id': result[2]
-                }
+    @staticmethod
+    def _reapply_prepared(user_bank_file: str, balance_key: str, before: int, after: int) -> str:
+        """Executado em thread: conclui um crédito interrompido entre o journal e a gravação do arquivo"""
+        with open(user_bank_file, 'r', encoding='utf-8') as f:
+            user_data = json.load(f)
+        current_balance = int(user_data.get(balance_key, 0))
+        if current_balance == after:
+            return 'already_applied'
+        if current_balance != before:
+            return 'mismatch'
+        user_data[balance_key] = after
+        write_json_atomic(user_bank_file, user_data, '.bank.')
+        return 'applied'
 
-        if discord_name:
-            cursor = await db.execute(
-                'SELECT * FROM users WHERE discord_name = ?',
-                (discord_name,)
+    async def resolve_prepared(self, entry: dict) -> tuple[bool, bool, str, int]:
+        user_bank_file = self.monitor.bank_file_for(entry['steam_id'])
+        balance_key = os.getenv('BALANCE_KEY', 'Balance')
+        async with bank_file_locks.hold(user_bank_file):
+            try:
+                outcome = await bank_io.run(
+                    user_bank_file, self._reapply_prepared, user_bank_file, balance_key, entry['before'], entry['after']
+                )
+            except Exception as e:
+                print(f"❌ Não foi possível conferir {user_bank_file}: {e}")
+                return False, False, str(e), 0
+
+        if outcome == 'mismatch':
+            message = (
+                f"Saldo alterado por outro processo (esperado {entry['before']} ou {entry['after']}): "
+                f"verificar manualmente"
             )
-            result = await cursor.fetchone()
-            if result:
-                return {
-                    'discord_id': result[0],
-                    'discord_name': result[1],
-                    'steam_id': result[2]
-                }
+            await credit_journal.append(entry['id'], CREDIT_ABORTED, reason=message)
+            return True, False, message, 0
+        await credit_journal.append(entry['id'], CREDIT_COMMITTED)
+        return True, True, "Saldo atualizado na recuperação" if outcome == 'applied' else "Saldo já estava aplicado", entry['after']
+
+LEDGER_STORE_ACCOUNT = 'store'  # Origem dos créditos de compras
+LEDGER_GAME_ACCOUNT = 'game'    # Saldos de abertura e movimentações feitas pelo servidor do jogo
+
+TRANSFER_OPENING = 'opening'
+TRANSFER_CREDIT = 'credit'
+TRANSFER_SYNC = 'sync'
+
+class SqliteLedgerBankBackend(JsonFileBankBackend):
+    """Ledger de partidas dobradas no SQLite; os saldos são projetados em lote para os arquivos <steamid>.json"""
+    name = 'sqlite'
+
+    def __init__(self, monitor: SalesConfirmationChannel, db: UserDatabase, flush_interval: float = 1.0,
+                 batch_size: int = 50, retry_delay: float = 30, max_retry_delay: float = 3600,
+                 max_attempts: int = 10):
+        super().__init__(monitor)
+        self.db = db
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.max_attempts = max_attempts
+        self._dirty = set()   # steam_ids com saldo do ledger ainda não gravado no arquivo
+        self._failing = {}    # steam_id -> (erro, próxima tentativa, tentativas)
+        self._stalled = {}    # steam_id -> erro: sem novas tentativas até um novo crédito ou a próxima inicialização
+        self._wakeup = None
+        self._task = None
+        self.credits = 0
+        self.projections = 0
+        self.syncs = 0
+
+    @staticmethod
+    def _account(steam_id: str) -> str:
+        return f"player:{steam_id}"
+
+    async def start(self):
+        if self._task is not None and not self._task.done():
+            return
+        rows = await self.db.fetchall(
+            '''
+            SELECT account FROM bank_accounts
+            WHERE account LIKE 'player:%' AND (balance != projected_balance OR pending_projection IS NOT NULL)
+            '''
+        )
+        self._dirty.update(account[len('player:'):] for (account,) in rows)
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+        print(f"Ledger de saldos (SQLite) ativo: {len(self._dirty)} saldos aguardando gravação nos arquivos")
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        # Última projeção antes de encerrar; o que sobrar é retomado na próxima inicialização
+        if self._dirty and self.monitor.bank_available:
+            await self.flush(retry_failing=True)
+
+    @staticmethod
+    async def _transfer(db, kind: str, source: str, target: str, amount: int, steam_id: str, credit_id: str = None):
+        """Lança uma transferência (duas partidas de soma zero) dentro da transação do chamador"""
+        now = time()
+        cursor = await db.execute(
+            'INSERT INTO bank_transfers (kind, credit_id, steam_id, amount, created_at) VALUES (?, ?, ?, ?, ?)',
+            (kind, credit_id, steam_id, amount, now)
+        )
+        transfer_id = cursor.lastrowid
+        await cursor.close()
+        await db.executemany(
+            'INSERT INTO bank_entries (transfer_id, account, amount) VALUES (?, ?, ?)',
+            [(transfer_id, source, -amount), (transfer_id, target, amount)]
+        )
+        await db.executemany(
+            '''
+            INSERT INTO bank_accounts (account, balance, updated_at) VALUES (?, ?, ?)
+            ON CONFLICT(account) DO UPDATE SET balance = balance + excluded.balance, updated_at = excluded.updated_at
+            ''',
+            [(source, -amount, now), (target, amount, now)]
+        )
+
+    async def credit(self, steam_id: str, valor: int, credit_id: str) -> tuple[bool, str, int]:
+        account = self._account(steam_id)
+        
+        # Recuperação do journal: o crédito pode ter chegado ao ledger antes da queda
+        if await self.db.fetchone('SELECT 1 FROM bank_transfers WHERE credit_id = ?', (credit_id,)):
+            row = await self.db.fetchone('SELECT balance FROM bank_accounts WHERE account = ?', (account,))
+            await credit_journal.append(credit_id, CREDIT_COMMITTED)
+            return True, "Crédito já registrado no ledger", row[0]
+        
+        opening = None
+        if await self.db.fetchone('SELECT 1 FROM bank_accounts WHERE account = ?', (account,)) is None:
+            # Primeiro crédito do jogador: o saldo atual do arquivo abre a conta no ledger
+            failure = await self._check_directory(credit_id)
+            if failure is not None:
+                return failure
+            async with bank_file_locks.hold(self.monitor.bank_file_for(steam_id)):
+                opened, failure = await self._open_file(steam_id, credit_id)
+            if failure is not None:
+                return failure
+            opening = opened[1]
+        
+        async with self.db.transaction() as db:
+            if opening is not None:
+                cursor = await db.execute(
+                    '''
+                    INSERT OR IGNORE INTO bank_accounts (account, balance, projected_balance, updated_at)
+                    VALUES (?, 0, ?, ?)
+                    ''',
+                    (account, opening, time())
+                )
+                created = cursor.rowcount
+                await cursor.close()
+                if created:
+                    await self._transfer(db, TRANSFER_OPENING, LEDGER_GAME_ACCOUNT, account, opening, steam_id)
+            await self._transfer(db, TRANSFER_CREDIT, LEDGER_STORE_ACCOUNT, account, valor, steam_id, credit_id)
+            async with db.execute('SELECT balance FROM bank_accounts WHERE account = ?', (account,)) as cursor:
+                (new_balance,) = await cursor.fetchone()
+        await credit_journal.append(credit_id, CREDIT_COMMITTED)
+        
+        self.credits += 1
+        if self._stalled.pop(steam_id, None) is not None:
+            print(f"🔁 Novo crédito para {steam_id}: retomando a gravação do saldo no arquivo")
+        self._dirty.add(steam_id)
+        if len(self._dirty) >= self.batch_size and self._wakeup is not None:
+            self._wakeup.set()
+        print(f"✅ Crédito de {valor} registrado no ledger para Steam ID {steam_id}: novo saldo {new_balance}")
+        return True, "Saldo atualizado com sucesso", new_balance
 
-        return None
-    except Exception as e:
+    async def _project(self, steam_id: str) -> str:
+        """Grava no arquivo o saldo do ledger, incorporando antes o que o jogo alterou. Retorna o erro ou None"""
+        account = self._account(steam_id)
+        user_bank_file = self.monitor.bank_file_for(steam_id)
+        balance_key = os.getenv('BALANCE_KEY', 'Balance')
+        async with bank_file_locks.hold(user_bank_file):
+            success, message, user_data, file_balance = await balance_cache.read(steam_id, user_bank_file, balance_key)
+            if not success:
+                return message
+            
+            async with self.db.transaction() as db:
+                async with db.execute(
+                    'SELECT balance, projected_balance, pending_projection FROM bank_accounts WHERE account = ?',
+                    (account,)
+                ) as cursor:
+                    balance, projected, pending = await cursor.fetchone()
+                if pending is not None and file_balance == pending:
+                    # A última gravação chegou ao arquivo, mas a execução parou antes de registrá-la
+                    projected = pending
+                external = file_balance - projected
+                if external:
+                    # Gastos (ou ajustes) feitos pelo servidor do jogo desde a última gravação
+                    await self._transfer(db, TRANSFER_SYNC, LEDGER_GAME_ACCOUNT, account, external, steam_id)
+                    balance += external
+                    self.syncs += 1
+                # O saldo a gravar fica registrado antes da gravação, para a conferência após uma queda
+                await db.execute(
+                    'UPDATE bank_accounts SET projected_balance = ?, pending_projection = ? WHERE account = ?',
+                    (file_balance, balance if balance != file_balance else None, account)
+                )
+            
+            if balance != file_balance:
+                user_data[balance_key] = balance
+                await balance_cache.write(steam_id, user_bank_file, user_data, balance)
+                await self.db.execute(
+                    'UPDATE bank_accounts SET projected_balance = ?, pending_projection = NULL WHERE account = ?',
+                    (balance, account)
+                )
+                self.projections += 1
         return None
 
-async def process_sale_embed(message: discord.Message):
-    try:
-        if not message.embeds:
-            return
+    async def _project_safely(self, steam_id: str) -> bool:
+        try:
+            error = await self._project(steam_id)
+        except asyncio.TimeoutError:
+            error = "Tempo esgotado ao acessar arquivo de saldo"
+        except Exception as e:
+            error = f"Erro ao gravar saldo: {e}"
+        if error is None:
+            self._failing.pop(steam_id, None)
+            return True
+        attempts = self._failing[steam_id][2] + 1 if steam_id in self._failing else 1
+        if attempts == 1:
+            print(f"⚠️ Saldo de {steam_id} registrado no ledger, mas não gravado no arquivo: {error}")
+        if attempts >= self.max_attempts:
+            # O crédito já está no ledger: reenviá-lo pela fila de créditos o aplicaria duas vezes
+            self._failing.pop(steam_id, None)
+            self._stalled[steam_id] = error
+            print(
+                f"🚨 Saldo de {steam_id} não gravado no arquivo após {attempts} tentativas ({error}): "
+                f"verificar manualmente; nova tentativa no próximo crédito ou na próxima inicialização"
+            )
+            return False
+        delay = min(self.max_retry_delay, self.retry_delay * (2 ** (attempts - 1)))
+        self._failing[steam_id] = (error, monotonic() + delay, attempts)
+        return False
 
-        embed = message.embeds[0]
-        if not embed.fields:
-            return
+    async def flush(self, retry_failing: bool = False) -> int:
+        """Grava nos arquivos, em lotes, os saldos alterados no ledger. Retorna quantos foram gravados"""
+        now = monotonic()
+        pending = [
+            steam_id for steam_id in self._dirty
+            if retry_failing or steam_id not in self._failing or self._failing[steam_id][1] <= now
+        ]
+        self._dirty.difference_update(pending)
+        written = 0
+        for start in range(0, len(pending), self.batch_size):
+            batch = pending[start:start + self.batch_size]
+            results = await asyncio.gather(*(self._project_safely(steam_id) for steam_id in batch))
+            for steam_id, ok in zip(batch, results):
+                if ok:
+                    written += 1
+                elif steam_id not in self._stalled:
+                    self._dirty.add(steam_id)
+        return written
 
-        # Extrair informações do embed
-        pedido_id = None
-        discord_info = None
-        valor = None
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            if not self._dirty or not self.monitor.bank_available:
+                continue
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"Erro ao gravar saldos do ledger nos arquivos: {e}")
+                traceback.print_exc()
 
-        for field in embed.fields:
-            if 'Pedido' in field.name:
-                pedido_id = field.value
-            elif 'Discord' in field.name:
-                discord_info = field.value
-            elif 'Valor' in field.name:
-                valor = field.value
+    async def summary(self) -> dict:
+        """Totais do ledger para auditoria: a soma de todas as partidas deve ser zero"""
+        accounts = await self.db.fetchone("SELECT COUNT(*) FROM bank_accounts WHERE account LIKE 'player:%'")
+        transfers = await self.db.fetchone('SELECT COUNT(*), COALESCE(SUM(amount), 0) FROM bank_transfers WHERE kind = ?', (TRANSFER_CREDIT,))
+        imbalance = await self.db.fetchone('SELECT COALESCE(SUM(amount), 0) FROM bank_entries')
+        return {
+            'accounts': accounts[0],
+            'credits': transfers[0],
+            'credited_total': transfers[1],
+            'imbalance': imbalance[0]
+        }
 
-        if not all([pedido_id, discord_info]):
-            return
+    def stats(self) -> dict:
+        return {
+            'backend': self.name,
+            'credits': self.credits,
+            'projections': self.projections,
+            'syncs': self.syncs,
+            'pending': len(self._dirty),
+            'failing': len(self._failing),
+            'stalled': len(self._stalled)
+        }
 
-        # Extrair Discord ID
-        discord_id = None
-        if '<@' in discord_info:
-            discord_id = extract_discord_id(discord_info)
-        else:
-            # Tentar encontrar o ID no texto
-            discord_id = extract_discord_id(discord_info)
+# Criar instância global do armazenamento de saldos (BANK_BACKEND=json ou sqlite)
+if os.getenv('BANK_BACKEND', 'json').lower() == 'sqlite':
+    bank_backend = SqliteLedgerBankBackend(
+        sales_monitor,
+        user_db,
+        flush_interval=float(os.getenv('BANK_PROJECTION_INTERVAL', 1.0)),
+        batch_size=int(os.getenv('BANK_PROJECTION_BATCH', 50)),
+        max_attempts=int(os.getenv('BANK_PROJECTION_MAX_ATTEMPTS', 10))
+    )
+else:
+    bank_backend = JsonFileBankBackend(sales_monitor)
 
-        if not discord_id:
-            return
+class CreditCoalescer:
+    """Agrupa créditos do mesmo steam_id recebidos em uma janela curta em uma única gravação"""
+    def __init__(self, apply_batch, window: float = 0.25, max_batch: int = 50):
+        self.apply_batch = apply_batch  # async (steam_id, log_entries) -> resultado compartilhado pelo lote
+        self.window = window
+        self.max_batch = max(1, max_batch)
+        self._pending = {}  # steam_id -> [(log_entry, Future)]
+        self._timers = {}   # steam_id -> TimerHandle do fim da janela
+        self._tails = {}    # steam_id -> Task do último lote, para manter a ordem entre lotes
+        self.batches = 0
+        self.credits = 0
+        self.largest_batch = 0
 
-        # Buscar usuário no Discord
-        user = message.guild.get_member(int(discord_id))
-        if not user:
+    def submit(self, steam_id: str, log_entry: dict) -> asyncio.Future:
+        """Enfileira o crédito imediatamente e retorna um Future com o resultado do lote"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        batch = self._pending.setdefault(steam_id, [])
+        batch.append((log_entry, future))
+        if len(batch) >= self.max_batch:
+            self._flush(steam_id)
+        elif steam_id not in self._timers:
+            self._timers[steam_id] = loop.call_later(self.window, self._flush, steam_id)
+        return future
+
+    def _flush(self, steam_id: str):
+        timer = self._timers.pop(steam_id, None)
+        if timer is not None:
+            timer.cancel()
+        batch = self._pending.pop(steam_id, None)
+        if not batch:
             return
+        task = asyncio.create_task(self._apply(self._tails.get(steam_id), steam_id, batch))
+        self._tails[steam_id] = task
+        task.add_done_callback(functools.partial(self._forget, steam_id))
 
-        total_users = 0
-        async with aiosqlite.connect('users.db') as db:
-            cursor = await db.execute('SELECT COUNT(*) FROM users')
-            result = await cursor.fetchone()
-            total_users = result[0] if result else 0
+    def _forget(self, steam_id: str, task: asyncio.Task):
+        if self._tails.get(steam_id) is task:
+            del self._tails[steam_id]
 
-            if user:
-                user_info = await get_user_info(db, discord_id=user.id)
-                if user_info:
-                    return user_info
+    async def _apply(self, previous, steam_id: str, batch: list):
+        if previous is not None:
+            await asyncio.gather(previous, return_exceptions=True)
+        self.batches += 1
+        self.credits += len(batch)
+        self.largest_batch = max(self.largest_batch, len(batch))
+        try:
+            result = await self.apply_batch(steam_id, [log_entry for log_entry, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+        else:
+            for _, future in batch:
+                if not future.done():
+                    future.set_result(result)
 
-            # Se não encontrou por ID, tentar por nome
-            if not user_info:
-                user_info = await get_user_info(db, discord_name=user.name)
-                if user_info:
-                    return user_info
+    async def close(self):
+        """Grava imediatamente os créditos que ainda aguardam a janela"""
+        for steam_id in list(self._pending):
+            self._flush(steam_id)
+        if self._tails:
+            await asyncio.gather(*self._tails.values(), return_exceptions=True)
 
+    def stats(self) -> dict:
         return {
-            'discord_id': str(user.id),
-            'discord_name': user.name,
-            'steam_id': None
+            'batches': self.batches,
+            'credits': self.credits,
+            'writes_saved': self.credits - self.batches,
+            'largest_batch': self.largest_batch,
+            'pending': sum(len(batch) for batch in self._pending.values())
         }
 
-    except Exception as error:
+# Criar instância global do agrupador de créditos
+credit_coalescer = CreditCoalescer(
+    sales_monitor.credit_batch,
+    window=float(os.getenv('CREDIT_COALESCE_WINDOW', 0.25)),
+    max_batch=int(os.getenv('CREDIT_COALESCE_MAX_BATCH', 50))
+)
+
+RETRY_MISSING_FILE = 'missing_file'  # Jogador ainda sem arquivo de saldo: tenta assim que o arquivo aparecer
+RETRY_TRANSIENT = 'transient'        # Falha de acesso ao diretório ou ao arquivo: tenta com backoff
+RETRY_UNCERTAIN = 'uncertain'        # Gravação incerta: parada até a recuperação do journal conferir o arquivo
+
+def credit_failure_kind(message: str) -> str:
+    """Classifica a falha de um crédito. None indica que não adianta tentar de novo automaticamente"""
+    if message.startswith("Arquivo de saldo não encontrado"):
+        return RETRY_MISSING_FILE
+    if message.startswith(("Tempo esgotado ao gravar saldo", "Valor negativo")) or "verificar manualmente" in message:
+        # Gravação incerta (conferida pela recuperação do journal) ou erro que exige intervenção
         return None
+    return RETRY_TRANSIENT
 
-class SalesConfirmationChannel:
-    def __init__(self, channel_id: int):
-        self.channel_id = channel_id
-        self.log_file = 'vendas_confirmacao.log'
-        
-        # Carregar e validar o caminho do BANK_FILE
-        bank_file = os.getenv('BANK_FILE')
-        if not bank_file:
-            print("⚠️ BANK_FILE não configurado no arquivo .env")
-            self.bank_file_path = None
+class CreditRetryQueue:
+    """Fila persistente de créditos com falha: novas tentativas com backoff e fila de falhas definitivas"""
+    def __init__(self, db: UserDatabase, base_delay: float = 60, max_delay: float = 3600,
+                 max_attempts: int = 12, watch_interval: float = 15):
+        self.db = db
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_attempts = max_attempts
+        self.watch_interval = watch_interval
+        self._wakeup = None
+        self._task = None
+        self._feed_cursor = 0  # Posição no feed de alterações do cache de saldos
+        self.succeeded = 0
+        self.dead_lettered = 0
+
+    async def start(self):
+        if self._task is not None and not self._task.done():
             return
-            
-        # Tratar caminho de rede (UNC path)
-        if bank_file.startswith('\\\\'):
-            # Preservar o formato UNC e garantir barras duplas
-            self.bank_file_path = bank_file
-            if not self.bank_file_path.endswith('\\'):
-                self.bank_file_path += '\\'
-            print(f"Caminho de rede detectado: {self.bank_file_path}")
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+        pending = (await self.db.fetchone('SELECT COUNT(*) FROM credit_retries'))[0]
+        if pending:
+            print(f"Fila de créditos: {pending} créditos aguardando nova tentativa")
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def _wake(self):
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def _next_delay(self, attempts: int) -> float:
+        delay = min(self.max_delay, self.base_delay * (2 ** max(0, attempts - 1)))
+        return delay * random.uniform(0.8, 1.2)
+
+    async def handle_failure(self, steam_id: str, log_entries: list[dict], message: str, credit_id: str) -> str:
+        """Agenda uma nova tentativa quando a falha é recuperável. Retorna o status das compras"""
+        kind = credit_failure_kind(message)
+        if kind is None or not log_entries:
+            return PURCHASE_FAILED
+        now = time()
+        # source_credit_id evita agendar duas vezes o mesmo crédito (ex.: recuperação após queda)
+        await self.db.execute(
+            '''
+            INSERT OR IGNORE INTO credit_retries
+                (source_credit_id, steam_id, valor, log_entries, kind, attempts, next_attempt_at, last_error, created_at)
+            VALUES (?, ?, ?, ?, ?, 0, ?, ?, ?)
+            ''',
+            (credit_id, steam_id, sum(entry['valor_total'] for entry in log_entries),
+             json.dumps(log_entries, ensure_ascii=False), kind, now + self._next_delay(1), message, now)
+        )
+        print(f"🔁 Crédito de {steam_id} agendado para nova tentativa ({message})")
+        self._wake()
+        return PURCHASE_RETRYING
+
+    async def remove(self, retry_id: int):
+        await self.db.execute('DELETE FROM credit_retries WHERE id = ?', (retry_id,))
+
+    async def _run(self):
+        while True:
+            try:
+                await self._watch_missing_files()
+                await self._process_due()
+            except Exception as e:
+                print(f"Erro na fila de créditos: {e}")
+                traceback.print_exc()
+            row = await self.db.fetchone(
+                'SELECT MIN(next_attempt_at) FROM credit_retries WHERE kind != ?', (RETRY_UNCERTAIN,)
+            )
+            delay = self.watch_interval
+            if row[0] is not None:
+                delay = min(delay, max(0.0, row[0] - time()))
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    async def _watch_missing_files(self):
+        """Antecipa as tentativas de jogadores cujo arquivo de saldo acabou de ser criado pelo servidor"""
+        # Arquivos novos aparecem no feed de alterações do cache de saldos (varredura do diretório)
+        self._feed_cursor, changes = balance_cache.changes_since(self._feed_cursor)
+        created = {steam_id for steam_id, balance in changes if balance is not None}
+        if not created:
+            return
+        rows = await self.db.fetchall(
+            'SELECT DISTINCT steam_id FROM credit_retries WHERE kind = ? AND next_attempt_at > ?',
+            (RETRY_MISSING_FILE, time())
+        )
+        for (steam_id,) in rows:
+            if steam_id in created:
+                print(f"📄 Arquivo de saldo criado para {steam_id}: aplicando créditos pendentes")
+                await self.db.execute(
+                    'UPDATE credit_retries SET next_attempt_at = ? WHERE kind = ? AND steam_id = ?',
+                    (time(), RETRY_MISSING_FILE, steam_id)
+                )
+
+    async def _process_due(self):
+        if not sales_monitor.bank_available:
+            # Diretório fora do ar: não gasta tentativas, apenas espera a próxima verificação
+            return
+        rows = await self.db.fetchall(
+            '''
+            SELECT id, steam_id, log_entries, attempts FROM credit_retries
+            WHERE next_attempt_at <= ? AND kind != ? ORDER BY next_attempt_at LIMIT 50
+            ''',
+            (time(), RETRY_UNCERTAIN)
+        )
+        for retry_id, steam_id, log_entries_json, attempts in rows:
+            await self._attempt(retry_id, steam_id, json.loads(log_entries_json), attempts + 1)
+
+    async def _attempt(self, retry_id: int, steam_id: str, log_entries: list[dict], attempt: int):
+        credit_id, success, message, new_balance = await sales_monitor.apply_credit(steam_id, log_entries, retry_id=retry_id)
+        balance_info = describe_credit(log_entries, success, message, new_balance) + f" (tentativa {attempt})"
+        
+        if success:
+            await self.remove(retry_id)
+            self.succeeded += 1
+            status = PURCHASE_CREDITED
+            print(f"✅ Crédito pendente aplicado para {steam_id} na tentativa {attempt}")
+        elif credit_journal.state_of(credit_id) == CREDIT_PREPARED:
+            # O saldo pode ter sido gravado: nem nova tentativa nem fila de falhas até o journal ser conferido
+            await self.park(retry_id, message, attempts=attempt)
+            status = PURCHASE_UNCERTAIN
+            balance_info += " - aguardando conferência do journal"
         else:
-            # Para caminhos locais, usar normalização padrão
-            self.bank_file_path = os.path.normpath(bank_file)
-            print(f"Caminho local detectado: {self.bank_file_path}")
+            kind = credit_failure_kind(message)
+            if kind is None or attempt >= self.max_attempts:
+                await self._dead_letter(retry_id, attempt, message)
+                status = PURCHASE_FAILED
+                balance_info += " - enviado para a fila de falhas"
+            else:
+                await self.db.execute(
+                    '''
+                    UPDATE credit_retries SET attempts = ?, kind = ?, next_attempt_at = ?, last_error = ?
+                    WHERE id = ?
+                    ''',
+                    (attempt, kind, time() + self._next_delay(attempt + 1), message, retry_id)
+                )
+                status = PURCHASE_RETRYING
         
-        try:
-            # Tentar acessar o diretório
-            print(f"Tentando acessar diretório: {self.bank_file_path}")
-            if not os.path.exists(self.bank_file_path):
-                print(f"⚠️ Caminho do BANK_FILE não encontrado ou sem acesso: {self.bank_file_path}")
-                print("Verifique se:")
-                print("1. O caminho está correto")
-                print("2. O computador tem acesso à rede")
-                print("3. As permissões de acesso estão corretas")
-                self.bank_file_path = None
-                return
-                
-            print(f"✅ BANK_FILE configurado e com acesso: {self.bank_file_path}")
-                
-        except Exception as e:
-            print(f"⚠️ Erro ao acessar BANK_FILE: {str(e)}")
-            self.bank_file_path = None
-            return
-            
-        # Garantir que o arquivo de log existe
-        self._create_log_file()
+        await sales_monitor.finish_credit(credit_id, log_entries, success, balance_info)
+        await mark_purchases(log_entries, status, steam_id, balance_info)
 
-    def _create_log_file(self):
-        try:
-            # Verifica se o arquivo existe, se não, cria
-            if not os.path.exists(self.log_file):
-                with open(self.log_file, 'w', encoding='utf-8') as f:
-                    f.write("=== Arquivo de Log de Vendas ===\n")
-                print(f"Arquivo de log criado: {self.log_file}")
-        except Exception as e:
-            print(f"Erro ao criar arquivo de log: {e}")
+    async def park(self, retry_id: int, message: str, attempts: int = None):
+        """Para a tentativa enquanto a gravação incerta aguarda a recuperação do journal"""
+        await self.db.execute(
+            'UPDATE credit_retries SET attempts = COALESCE(?, attempts), kind = ?, last_error = ? WHERE id = ?',
+            (attempts, RETRY_UNCERTAIN, message, retry_id)
+        )
 
-    async def get_steam_id(self, user_id: str) -> str:
-        try:
-            async with aiosqlite.connect('users.db') as db:
-                cursor = await db.execute('SELECT steam_id FROM users WHERE discord_id = ?', (user_id,))
-                result = await cursor.fetchone()
-                if result and result[0]:
-                    return result[0]
-                return "Usuário não registrado"
-        except Exception as e:
-            print(f"Erro ao buscar Steam ID: {e}")
-            return "Erro ao buscar registro"
-            
-    async def process_json_file(self, attachment: discord.Attachment) -> bool:
-        try:
-            print(f"\nIniciando processamento do arquivo: {attachment.filename}")
-            print(f"Tamanho do arquivo: {attachment.size} bytes")
-            
-            # Validar tamanho máximo (1MB)
-            if attachment.size > 1024 * 1024:
-                print("❌ Arquivo muito grande (limite: 1MB)")
-                return False
-                
-            # Verifica se é um arquivo JSON
-            if not attachment.filename.endswith('.json'):
-                print(f"❌ Arquivo ignorado: {attachment.filename} (não é JSON)")
-                return False
-                
-            # Baixa o conteúdo do arquivo
-            json_content = await attachment.read()
-            json_text = json_content.decode('utf-8')  # Converte bytes para string
-            
-            try:
-                data = json.loads(json_text)
-            except json.JSONDecodeError as e:
-                print(f"❌ Erro ao decodificar JSON: {e}")
-                print(f"Conteúdo problemático: {json_text[:200]}...")  # Mostra primeiros 200 caracteres
-                return False
-            
-            # Valida estrutura do JSON
-            if not validate_json_structure(data):
-                print("❌ Estrutura JSON inválida")
+    async def resume(self, retry_id: int, message: str) -> str:
+        """Devolve à fila uma tentativa cujo crédito, conferido pelo journal, não chegou ao saldo"""
+        row = await self.db.fetchone('SELECT attempts FROM credit_retries WHERE id = ?', (retry_id,))
+        if row is None:
+            return PURCHASE_FAILED
+        kind = credit_failure_kind(message)
+        if kind is None:
+            await self._dead_letter(retry_id, row[0], message)
+            return PURCHASE_FAILED
+        await self.db.execute(
+            'UPDATE credit_retries SET kind = ?, next_attempt_at = ?, last_error = ? WHERE id = ?',
+            (kind, time(), message, retry_id)
+        )
+        self._wake()
+        return PURCHASE_RETRYING
+
+    async def _dead_letter(self, retry_id: int, attempts: int, message: str):
+        async with self.db.transaction() as db:
+            await db.execute(
+                '''
+                INSERT INTO credit_dead_letters (steam_id, valor, log_entries, attempts, last_error, created_at, failed_at)
+                SELECT steam_id, valor, log_entries, ?, ?, created_at, ? FROM credit_retries WHERE id = ?
+                ''',
+                (attempts, message, time(), retry_id)
+            )
+            await db.execute('DELETE FROM credit_retries WHERE id = ?', (retry_id,))
+        self.dead_lettered += 1
+        print(f"☠️ Crédito enviado para a fila de falhas após {attempts} tentativas: {message}")
+
+    async def dead_letters(self, limit: int = 25) -> list[tuple]:
+        """(id, steam_id, valor, compras, tentativas, último erro, data da falha)"""
+        rows = await self.db.fetchall(
+            '''
+            SELECT id, steam_id, valor, log_entries, attempts, last_error, failed_at
+            FROM credit_dead_letters ORDER BY failed_at DESC LIMIT ?
+            ''',
+            (limit,)
+        )
+        return [
+            (dead_id, steam_id, valor, [entry['purchase_id'] for entry in json.loads(log_entries)],
+             attempts, last_error, failed_at)
+            for dead_id, steam_id, valor, log_entries, attempts, last_error, failed_at in rows
+        ]
+
+    async def replay(self, dead_id: int) -> bool:
+        """Devolve um crédito da fila de falhas para a fila de novas tentativas"""
+        row = await self.db.fetchone(
+            'SELECT steam_id, valor, log_entries, last_error FROM credit_dead_letters WHERE id = ?', (dead_id,)
+        )
+        if row is None:
+            return False
+        steam_id, valor, log_entries_json, last_error = row
+        log_entries = json.loads(log_entries_json)
+        for entry in log_entries:
+            if await purchase_store.get_status(entry['purchase_id']) == PURCHASE_UNCERTAIN:
+                # O crédito ainda está em aberto no journal: reenviar agora poderia creditar duas vezes
+                print(f"⚠️ Crédito #{dead_id} não reenviado: compra {entry['purchase_id']} aguarda conferência do journal")
                 return False
-            
-            # Extrai o ID da compra e verifica se já foi processado
-            purchase_id = data.get('purchase', {}).get('id', 'N/A')
-            user_id = data.get('user', {}).get('id', 'N/A')
-            
-            # Se não for um arquivo de teste (purchase ID != 0), verifica duplicidade
-            if purchase_id != '0' and is_file_processed(purchase_id):
-                print(f"⚠️ Arquivo já processado anteriormente: Purchase ID {purchase_id}")
+        # Marca antes de reagendar, para não sobrescrever o resultado de uma tentativa já em andamento
+        await mark_purchases(log_entries, PURCHASE_RETRYING, steam_id, "Reenviado da fila de falhas")
+        async with self.db.transaction() as db:
+            cursor = await db.execute('DELETE FROM credit_dead_letters WHERE id = ?', (dead_id,))
+            if cursor.rowcount == 0:
+                # Outro administrador reenviou o mesmo crédito ao mesmo tempo
                 return False
-                
-            print(f"✅ Arquivo JSON válido: {attachment.filename}")
-            
-            # Processa o conteúdo do novo formato
-            valor_total = 0
-            codigos = []
-            valores_processados = set()  # Para evitar duplicação
-            
-            # Processa delivered_products
-            delivered_products = data.get('delivered_products', [])
-            print("\nProcessando produtos entregues:")
-            
-            for product in delivered_products:
-                print(f"\nProduto ID: {product.get('id')}")
-                content = product.get('content', [])
-                
-                for item in content:
-                    if item.get('type') == 'number':
-                        try:
-                            valor = int(item.get('value', 0))
-                            item_id = f"{product.get('id')}_{item.get('id')}"
-                            
-                            if valor > 0 and item_id not in valores_processados:
-                                print(f"✅ Valor válido encontrado: {valor}")
-                                valor_total += valor
-                                valores_processados.add(item_id)
-                            else:
-                                print(f"⚠️ Valor ignorado: {valor} (valor <= 0 ou já processado)")
-                        except (ValueError, TypeError) as e:
-                            print(f"❌ Valor inválido ignorado: {item.get('value')} - Erro: {e}")
-                
-                content_raw = product.get('content_raw')
-                if content_raw:
-                    codigos.append(content_raw)
-                    print(f"Código adicionado: {content_raw[:10]}...")
-            
-            # Busca o Steam ID do usuário
-            steam_id = await self.get_steam_id(user_id)
-            
-            print(f"\nResumo do processamento:")
-            print(f"Purchase ID: {purchase_id}")
-            print(f"User ID: {user_id}")
-            print(f"Steam ID: {steam_id}")
-            print(f"Valor Total: {valor_total}")
-            print(f"Quantidade de Códigos: {len(codigos)}")
-            
-            # Cria o registro de log
-            log_entry = {
-                'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                'purchase_id': purchase_id,
-                'user_id': user_id,
-                'steam_id': steam_id,
-                'valor_total': valor_total,
-                'codigos': codigos,
-                'valores_processados': list(valores_processados)  # Adiciona lista de valores processados ao log
-            }
-            
-            # Salva no arquivo de log
-            await self._save_log(log_entry)
-            
-            # Marca o arquivo como processado apenas se não for teste (purchase ID != 0)
-            if purchase_id != '0':
-                mark_file_processed(purchase_id)
-            
-            print(f"✅ Log salvo com sucesso para Purchase ID: {purchase_id}")
-            return True
-            
-        except Exception as e:
-            print(f"❌ Erro ao processar arquivo JSON:")
-            traceback.print_exc()
+            await db.execute(
+                '''
+                INSERT INTO credit_retries
+                    (steam_id, valor, log_entries, kind, attempts, next_attempt_at, last_error, created_at)
+                VALUES (?, ?, ?, ?, 0, ?, ?, ?)
+                ''',
+                (steam_id, valor, log_entries_json, credit_failure_kind(last_error or '') or RETRY_TRANSIENT,
+                 time(), last_error, time())
+            )
+        self._wake()
+        return True
+
+    async def counts(self) -> dict:
+        retries = await self.db.fetchall('SELECT kind, COUNT(*), MIN(next_attempt_at) FROM credit_retries GROUP BY kind')
+        dead = (await self.db.fetchone('SELECT COUNT(*) FROM credit_dead_letters'))[0]
+        return {
+            'retries': {kind: count for kind, count, _ in retries},
+            'next_attempt_at': min(
+                (next_at for kind, _, next_at in retries if kind != RETRY_UNCERTAIN), default=None
+            ),
+            'dead_letters': dead
+        }
+
+# Criar instância global da fila de créditos
+credit_retries = CreditRetryQueue(
+    user_db,
+    base_delay=float(os.getenv('CREDIT_RETRY_BASE_DELAY', 60)),
+    max_delay=float(os.getenv('CREDIT_RETRY_MAX_DELAY', 3600)),
+    max_attempts=int(os.getenv('CREDIT_RETRY_MAX_ATTEMPTS', 12))
+)
+
+# Criar instância global do pipeline de vendas
+sales_pipeline = SalesPipeline(
+    workers=int(os.getenv('SALES_WORKERS', 4)),
+    max_queue=int(os.getenv('SALES_QUEUE_SIZE', 100))
+)
+
+class SalesChannelCatchUp:
+    """Marca d'água do canal de vendas e reprocessamento das mensagens perdidas com o bot fora do ar"""
+    def __init__(self, db: UserDatabase, max_age_hours: float = 72, save_delay: float = 2.0):
+        self.db = db
+        self.max_age_hours = max_age_hours
+        self.save_delay = save_delay
+        self.channel_id = None
+        self.watermark = None  # Todas as mensagens com ID <= watermark já foram processadas
+        self._pending = {}     # message_id -> anexos ainda no pipeline
+        self._done = set()     # Mensagens concluídas acima da marca d'água
+        self._highest_seen = None
+        # Até o catch-up terminar, a marca d'água não passa da última mensagem do histórico já percorrida
+        self._ceiling = 0
+        self._skipped = None   # Mensagem mais antiga com anexos que não entraram no pipeline
+        self._save_task = None
+        self._task = None
+        self._running = False
+        self._caught_up = False
+        self.last_run = None
+
+    @staticmethod
+    def _state_key(channel_id: int) -> str:
+        return f"sales_watermark:{channel_id}"
+
+    async def use_channel(self, channel_id: int):
+        """Carrega a marca d'água do canal (uma vez, ou quando o canal configurado muda)"""
+        if channel_id == self.channel_id:
+            return
+        await self.save()
+        row = await self.db.fetchone('SELECT value FROM bot_state WHERE key = ?', (self._state_key(channel_id),))
+        self.channel_id = channel_id
+        self.watermark = int(row[0]) if row else None
+        self._pending.clear()
+        self._done.clear()
+        self._skipped = None
+        self._highest_seen = self.watermark
+
+    def track(self, message_id: int, attachment_count: int) -> bool:
+        """Registra uma mensagem do canal. Retorna False se ela já foi (ou está sendo) processada"""
+        if self.watermark is not None and message_id <= self.watermark:
             return False
+        if message_id in self._pending or message_id in self._done:
+            return False
+        if self._highest_seen is None or message_id > self._highest_seen:
+            self._highest_seen = message_id
+        if attachment_count:
+            self._pending[message_id] = attachment_count
+        else:
+            self._done.add(message_id)
+        self._advance()
+        return True
 
-    async def _save_log(self, log_entry: dict):
-        try:
-            # Atualizar o saldo antes de salvar o log
-            if log_entry['steam_id'] != "Usuário não registrado" and log_entry['steam_id'] != "Erro ao buscar registro":
-                print("\nIniciando atualização de saldo...")
-                success, message, new_balance = await self.update_user_balance(
-                    log_entry['steam_id'],
-                    log_entry['valor_total']
-                )
-                balance_info = f"Novo saldo: {new_balance}" if success else f"Erro no saldo: {message}"
-                print(f"Resultado da atualização: {balance_info}")
-            else:
-                balance_info = "Saldo não atualizado: Usuário não registrado"
-                print(f"Saldo não atualizado: {log_entry['steam_id']}")
+    def done(self, message_id: int):
+        """Chamado pelo pipeline ao terminar cada anexo da mensagem"""
+        remaining = self._pending.get(message_id)
+        if remaining is None:
+            return
+        if remaining > 1:
+            self._pending[message_id] = remaining - 1
+            return
+        del self._pending[message_id]
+        self._done.add(message_id)
+        self._advance()
 
-            with open(self.log_file, 'a', encoding='utf-8') as f:
-                f.write('\n' + '='*50 + '\n')
-                f.write(f"Data/Hora: {log_entry['timestamp']}\n")
-                f.write(f"ID da Compra: {log_entry['purchase_id']}\n")
-                f.write(f"ID do Usuário: {log_entry['user_id']}\n")
-                f.write(f"Steam ID: {log_entry['steam_id']}\n")
-                f.write(f"Valor Total: {log_entry['valor_total']}\n")
-                if log_entry['codigos']:
-                    f.write("Códigos:\n")
-                    for codigo in log_entry['codigos']:
-                        f.write(f"- {codigo}\n")
-                f.write(f"Status do Saldo: {balance_info}\n")
-                f.write('='*50 + '\n')
-            print(f"Log salvo em: {os.path.abspath(self.log_file)}")
-        except Exception as e:
-            print(f"Erro ao salvar log: {e}")
-            import traceback
-            traceback.print_exc()
+    def skip(self, message_id: int, missing: int):
+        """Anexos que não entraram no pipeline: a marca d'água fica antes da mensagem até o próximo catch-up"""
+        if self._skipped is None or message_id < self._skipped:
+            self._skipped = message_id
+        remaining = self._pending.get(message_id)
+        if remaining is None:
+            return
+        if remaining > missing:
+            self._pending[message_id] = remaining - missing
+            return
+        del self._pending[message_id]
+        self._advance()
+
+    def _advance(self):
+        # A marca d'água só passa de uma mensagem quando todas as anteriores terminaram
+        target = min(self._pending) - 1 if self._pending else self._highest_seen
+        if target is not None and self._ceiling is not None:
+            # Mensagens ao vivo não podem levar a marca além do trecho do histórico ainda não lido
+            target = min(target, self._ceiling)
+        if target is not None and self._skipped is not None:
+            target = min(target, self._skipped - 1)
+        if target is None or (self.watermark is not None and target <= self.watermark):
+            return
+        self.watermark = target
+        self._done = {message_id for message_id in self._done if message_id > target}
+        if self._save_task is None or self._save_task.done():
+            self._save_task = asyncio.create_task(self._save_later())
+
+    async def _save_later(self):
+        await asyncio.sleep(self.save_delay)
+        await self.save()
+
+    async def save(self):
+        if self.channel_id is None or self.watermark is None:
+            return
+        await self.db.execute(
+            '''
+            INSERT INTO bot_state (key, value, updated_at) VALUES (?, ?, ?)
+            ON CONFLICT(key) DO UPDATE SET value = excluded.value, updated_at = excluded.updated_at
+            ''',
+            (self._state_key(self.channel_id), str(self.watermark), time())
+        )
+
+    def hold(self):
+        """Segura a marca d'água: sem sessão com o Discord, mensagens podem ser perdidas até o próximo catch-up"""
+        self._ceiling = 0
+
+    def release(self):
+        """Libera a marca d'água quando a sessão foi retomada sem perda de eventos"""
+        if self._running or not self._caught_up:
+            return
+        self._ceiling = None
+        self._advance()
+
+    def start(self, client: commands.Bot):
+        """Executa o catch-up em segundo plano (a cada nova sessão com o Discord)"""
+        if self._task is not None and not self._task.done():
+            return
+        self.hold()
+        self._task = asyncio.create_task(self.run(client))
 
-    async def update_user_balance(self, steam_id: str, valor: int) -> tuple[bool, str, int]:
+    async def run(self, client: commands.Bot):
+        """Percorre o histórico do canal desde a marca d'água e envia as mensagens perdidas ao pipeline"""
+        if self._running:
+            return
+        self._running = True
+        self._ceiling = 0
+        # O histórico é percorrido a partir da marca d'água, que ficou antes das mensagens puladas
+        self._skipped = None
+        completed = False
         try:
-            print(f"\nProcessando valor para Steam ID {steam_id}:")
-            print(f"Valor a adicionar: {valor}")
-            
-            # Verificar se o caminho base está configurado
-            if not self.bank_file_path:
-                print("❌ BANK_FILE não está configurado ou acessível")
-                return False, "Erro de configuração do caminho de arquivos", 0
+            channel_id = get_sales_confirmation_channel_id()
+            channel = client.get_channel(channel_id) if channel_id else None
+            if channel is None:
+                completed = True
+                return
+            await self.use_channel(channel_id)
             
-            # Construir o caminho completo do arquivo do usuário
-            if self.bank_file_path.startswith('\\\\'):
-                # Para caminhos de rede, usar concatenação direta
-                user_bank_file = f"{self.bank_file_path}{steam_id}.json"
-            else:
-                # Para caminhos locais, usar os.path.join
-                user_bank_file = os.path.join(self.bank_file_path, f"{steam_id}.json")
-                
-            print(f"Tentando acessar arquivo: {user_bank_file}")
+            upper = channel.last_message_id
+            if self.watermark is None:
+                # Primeira execução neste canal: o histórico antigo não é reprocessado
+                self.watermark = self._highest_seen = upper or discord.utils.time_snowflake(datetime.now(timezone.utc))
+                await self.save()
+                print(f"Marca d'água do canal de vendas iniciada em {self.watermark}")
+                completed = True
+                return
+            if upper is None or upper <= self.watermark:
+                completed = True
+                return
             
-            # Obter lock para o arquivo
-            file_lock = await get_file_lock(user_bank_file)
+            floor = discord.utils.time_snowflake(datetime.now(timezone.utc) - timedelta(hours=self.max_age_hours))
+            after = self.watermark
+            if after < floor:
+                print(f"⚠️ Bot ficou fora do ar por mais de {self.max_age_hours:.0f}h: mensagens mais antigas não serão reprocessadas")
+                after = floor
             
-            async with file_lock:  # Usar lock para evitar concorrência
-                try:
-                    # Verificar se o arquivo existe
-                    if not os.path.exists(user_bank_file):
-                        print(f"❌ Arquivo de saldo não encontrado: {user_bank_file}")
-                        return False, "Arquivo de saldo não encontrado", 0
-                    
-                    # Ler o arquivo atual
-                    with open(user_bank_file, 'r', encoding='utf-8') as f:
-                        user_data = json.load(f)
-                    
-                    # Obter a chave de saldo do .env ou usar "Balance" como padrão
-                    balance_key = os.getenv('BALANCE_KEY', 'Balance')
-                    
-                    # Obter saldo atual (garantindo que seja inteiro)
-                    try:
-                        current_balance = int(user_data.get(balance_key, 0))
-                        if current_balance < 0:
-                            print("⚠️ Saldo atual é negativo, ajustando para 0")
-                            current_balance = 0
-                    except (ValueError, TypeError) as e:
-                        print(f"❌ Erro ao converter saldo atual: {e}")
-                        print(f"Valor problemático: {user_data.get(balance_key)}")
-                        print("Resetando saldo para 0")
-                        current_balance = 0
-                    
-                    print(f"Saldo atual lido: {current_balance}")
-                    
-                    # Validar valor a adicionar
-                    if valor < 0:
-                        print(f"❌ Valor negativo detectado: {valor}")
-                        return False, "Valor negativo não permitido", current_balance
-                    
-                    # Calcular novo saldo
-                    try:
-                        new_balance = current_balance + valor
-                        if new_balance < 0:  # Proteção extra contra overflow
-                            print("⚠️ Novo saldo seria negativo, ajustando para 0")
-                            new_balance = 0
-                    except OverflowError as e:
-                        print(f"❌ Erro de overflow ao calcular novo saldo: {e}")
-                        return False, "Erro ao calcular novo saldo", current_balance
-                    
-                    print(f"Novo saldo calculado: {new_balance}")
-                    
-                    # Atualizar o arquivo
-                    user_data[balance_key] = new_balance
-                    
-                    # Salvar as alterações
-                    try:
-                        with open(user_bank_file, 'w', encoding='utf-8') as f:
-                            json.dump(user_data, f, indent=4)
-                    except Exception as e:
-                        print(f"❌ Erro ao salvar arquivo: {e}")
-                        return False, "Erro ao salvar alterações", current_balance
-                    
-                    print(f"✅ Saldo atualizado com sucesso para Steam ID {steam_id}:")
-                    print(f"   Saldo anterior: {current_balance}")
-                    print(f"   Valor adicionado: {valor}")
-                    print(f"   Novo saldo: {new_balance}")
-                    return True, "Saldo atualizado com sucesso", new_balance
-                    
-                except json.JSONDecodeError as e:
-                    print(f"❌ Erro ao ler arquivo JSON: {e}")
-                    print(f"Conteúdo do arquivo problemático: {open(user_bank_file, 'r').read()}")
-                    return False, "Erro ao ler arquivo de saldo", 0
-                except PermissionError as e:
-                    print(f"❌ Erro de permissão ao acessar arquivo: {e}")
-                    return False, "Erro de permissão ao acessar arquivo de saldo", 0
-                except Exception as e:
-                    print(f"❌ Erro ao acessar arquivo: {e}")
-                    traceback.print_exc()
-                    return False, f"Erro ao acessar arquivo: {str(e)}", 0
-                    
+            print("🔎 Procurando vendas recebidas enquanto o bot estava fora do ar...")
+            started = monotonic()
+            scanned = queued = 0
+            self._ceiling = after
+            async for message in channel.history(
+                limit=None, after=discord.Object(id=after), before=discord.Object(id=upper + 1), oldest_first=True
+            ):
+                scanned += 1
+                queued += await submit_sales_message(message)
+                self._ceiling = message.id
+            completed = True
+            self.last_run = datetime.now()
+            print(
+                f"✅ Catch-up do canal de vendas: {scanned} mensagens verificadas, "
+                f"{queued} anexos enviados ao pipeline em {monotonic() - started:.1f}s"
+            )
         except Exception as e:
-            print(f"❌ Erro inesperado ao atualizar saldo: {e}")
+            print(f"Erro no catch-up do canal de vendas: {e}")
             traceback.print_exc()
-            return False, f"Erro ao atualizar saldo: {str(e)}", 0
+        finally:
+            self._running = False
+            # Se o catch-up falhou, a marca d'água fica presa no último ponto lido até a próxima execução
+            if completed:
+                self._caught_up = True
+                self._ceiling = None
+                self._advance()
+
+    async def close(self):
+        for task in (self._task, self._save_task):
+            if task is not None:
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+        self._task = self._save_task = None
+        await self.save()
+
+# Criar instância global do catch-up do canal de vendas
+sales_catchup = SalesChannelCatchUp(user_db, max_age_hours=float(os.getenv('SALES_CATCHUP_MAX_AGE_HOURS', 72)))
+
+async def submit_sales_message(message: discord.Message) -> int:
+    """Envia os anexos de uma mensagem do canal de vendas ao pipeline. Retorna quantos foram enfileirados"""
+    await sales_catchup.use_channel(message.channel.id)
+    if not sales_catchup.track(message.id, len(message.attachments)):
+        return 0
+    queued = 0
+    for attachment in message.attachments:
+        print(f"Enfileirando anexo: {attachment.filename}")
+        if await sales_pipeline.submit(sales_monitor, attachment, on_done=functools.partial(sales_catchup.done, message.id)):
+            queued += 1
+    if queued < len(message.attachments):
+        # Anexos fora da fila não vão chamar done: a mensagem volta no próximo catch-up
+        sales_catchup.skip(message.id, len(message.attachments) - queued)
+    return queued
 
 @bot.event
 async def on_message(message):
@@ -1283,12 +5334,9 @@ async def on_message(message):
             print(f"Mensagem recebida no canal de confirmação de vendas: {message.id}")
             if message.attachments:
                 print(f"Arquivos anexados encontrados")
-                monitor = SalesConfirmationChannel(sales_confirmation_channel_id)
-                for attachment in message.attachments:
-                    print(f"Processando anexo: {attachment.filename}")
-                    await monitor.process_json_file(attachment)
             else:
                 print("Nenhum arquivo anexado encontrado na mensagem")
+            await submit_sales_message(message)
     except Exception as e:
         print(f"Erro no processamento da mensagem: {e}")
     
@@ -1377,19 +5425,4 @@ async def remove_role_safely(member: discord.Member, role: discord.Role) -> tupl
         print(f"Erro ao remover cargo: {e}")
         return False, f"Erro inesperado ao remover cargo: {str(e)}"
 
-def is_file_processed(purchase_id: str) -> bool:
-    """Verifica se um arquivo já foi processado"""
-    # Limpar cache antigo (mais de 1 hora)
-    current_time = time()
-    processed_files.update({
-        k: v for k, v in processed_files.items()
-        if current_time - v < 3600  # 1 hora
-    })
-    
-    return purchase_id in processed_files
-
-def mark_file_processed(purchase_id: str):
-    """Marca um arquivo como processado"""
-    processed_files[purchase_id] = time()
-
 bot.run(os.getenv('DISCORD_TOKEN')) 
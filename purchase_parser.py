@@ -0,0 +1,215 @@
+"""Interpretação dos anexos de venda em registros tipados, com validação do formato
+
+Executar `python purchase_parser.py` roda um benchmark com anexos sintéticos comparando
+o caminho antigo (json.loads + validate_json_structure + laço com prints) com parse_purchase.
+"""
+import json
+
+class PurchaseFormatError(ValueError):
+    """Anexo de venda com JSON inválido ou fora do esquema esperado"""
+
+class Purchase:
+    """Compra interpretada de um anexo de venda"""
+    __slots__ = ('purchase_id', 'user_id', 'valor_total', 'codigos', 'valores_processados',
+                 'product_count', 'ignored')
+
+    def __init__(self, purchase_id, user_id, valor_total: int, codigos: list[str],
+                 valores_processados: list[str], product_count: int, ignored: int):
+        self.purchase_id = purchase_id
+        self.user_id = user_id
+        self.valor_total = valor_total
+        self.codigos = codigos
+        self.valores_processados = valores_processados  # "produto_item" de cada valor somado
+        self.product_count = product_count
+        self.ignored = ignored  # Valores <= 0, inválidos ou repetidos
+
+    def __repr__(self):
+        return (f"Purchase(purchase_id={self.purchase_id!r}, user_id={self.user_id!r}, "
+                f"valor_total={self.valor_total}, codigos={len(self.codigos)})")
+
+def _fail(path: str, message: str, value):
+    raise PurchaseFormatError(f"{path}: {message}, recebido {type(value).__name__}")
+
+def _require(data: dict, key: str, path: str):
+    if key not in data:
+        raise PurchaseFormatError(f"{path}.{key}: campo obrigatório ausente")
+    return data[key]
+
+def validate_purchase(data):
+    """Confere o formato do anexo de venda; levanta PurchaseFormatError com o caminho do campo inválido"""
+    if type(data) is not dict:
+        _fail('$', 'objeto esperado', data)
+    for section in ('purchase', 'user'):
+        value = _require(data, section, '$')
+        if type(value) is not dict:
+            _fail(f"$.{section}", 'objeto esperado', value)
+        identifier = _require(value, 'id', f"$.{section}")
+        if not isinstance(identifier, (int, str)):
+            _fail(f"$.{section}.id", 'tipo não permitido', identifier)
+
+    products = _require(data, 'delivered_products', '$')
+    if type(products) is not list:
+        _fail('$.delivered_products', 'lista esperada', products)
+    for product in products:
+        if type(product) is not dict:
+            _fail('$.delivered_products[]', 'objeto esperado', product)
+        product_id = product.get('id')
+        if product_id is not None and not isinstance(product_id, (int, str)):
+            _fail('$.delivered_products[].id', 'tipo não permitido', product_id)
+        content_raw = product.get('content_raw')
+        if content_raw is not None and not isinstance(content_raw, str):
+            _fail('$.delivered_products[].content_raw', 'tipo não permitido', content_raw)
+        content = product.get('content')
+        if content is None:
+            continue
+        if type(content) is not list:
+            _fail('$.delivered_products[].content', 'lista esperada', content)
+        for item in content:
+            if type(item) is not dict:
+                _fail('$.delivered_products[].content[]', 'objeto esperado', item)
+
+def parse_purchase(raw) -> Purchase:
+    """Valida e interpreta o conteúdo (bytes ou str) de um anexo de venda"""
+    try:
+        data = json.loads(raw)
+    except ValueError as e:  # JSONDecodeError e UnicodeDecodeError
+        raise PurchaseFormatError(f"JSON inválido: {e}") from e
+    validate_purchase(data)
+
+    valor_total = 0
+    ignored = 0
+    codigos = []
+    valores_processados = []
+    seen = set()
+    products = data['delivered_products']
+    for product in products:
+        content = product.get('content')
+        if content:
+            product_id = product.get('id')
+            for item in content:
+                if item.get('type') != 'number':
+                    continue
+                try:
+                    valor = int(item.get('value', 0))
+                except (ValueError, TypeError, OverflowError):
+                    ignored += 1
+                    continue
+                item_id = f"{product_id}_{item.get('id')}"
+                if valor > 0 and item_id not in seen:
+                    seen.add(item_id)
+                    valores_processados.append(item_id)
+                    valor_total += valor
+                else:
+                    ignored += 1
+
+        content_raw = product.get('content_raw')
+        if content_raw:
+            codigos.append(content_raw)
+
+    return Purchase(
+        data['purchase']['id'], data['user']['id'], valor_total,
+        codigos, valores_processados, len(products), ignored
+    )
+
+def _legacy_parse(raw: bytes):
+    """Caminho anterior do bot, mantido apenas como referência para o benchmark"""
+    data = json.loads(raw.decode('utf-8'))
+    missing_fields = [field for field in ('purchase', 'user', 'delivered_products') if field not in data]
+    if missing_fields:
+        print(f"Campos obrigatórios ausentes: {', '.join(missing_fields)}")
+        return None
+    purchase_id = data.get('purchase', {}).get('id', 'N/A')
+    user_id = data.get('user', {}).get('id', 'N/A')
+    valor_total = 0
+    codigos = []
+    valores_processados = set()
+    print("\nProcessando produtos entregues:")
+    for product in data.get('delivered_products', []):
+        print(f"\nProduto ID: {product.get('id')}")
+        for item in product.get('content', []):
+            if item.get('type') == 'number':
+                try:
+                    valor = int(item.get('value', 0))
+                    item_id = f"{product.get('id')}_{item.get('id')}"
+                    if valor > 0 and item_id not in valores_processados:
+                        print(f"✅ Valor válido encontrado: {valor}")
+                        valor_total += valor
+                        valores_processados.add(item_id)
+                    else:
+                        print(f"⚠️ Valor ignorado: {valor} (valor <= 0 ou já processado)")
+                except (ValueError, TypeError) as e:
+                    print(f"❌ Valor inválido ignorado: {item.get('value')} - Erro: {e}")
+        content_raw = product.get('content_raw')
+        if content_raw:
+            codigos.append(content_raw)
+            print(f"Código adicionado: {content_raw[:10]}...")
+    return purchase_id, user_id, valor_total, codigos, valores_processados
+
+def synthetic_payload(purchase_id: int, products: int, items: int) -> bytes:
+    """Anexo de venda no formato da loja, com valores, textos e códigos"""
+    delivered = []
+    for product_id in range(1, products + 1):
+        content = [
+            {'id': item_id, 'type': 'number' if item_id % 2 else 'text',
+             'value': str(item_id * 10) if item_id % 2 else f"Item {item_id}"}
+            for item_id in range(1, items + 1)
+        ]
+        delivered.append({
+            'id': product_id,
+            'name': f"Pacote {product_id}",
+            'content': content,
+            'content_raw': f"CODE-{purchase_id}-{product_id:04d}-XXXX-YYYY"
+        })
+    payload = {
+        'purchase': {'id': purchase_id, 'created_at': '2024-01-01T00:00:00Z', 'total': '99.90'},
+        'user': {'id': f"user-{purchase_id % 500}", 'email': 'cliente@example.com'},
+        'delivered_products': delivered
+    }
+    return json.dumps(payload).encode('utf-8')
+
+def _benchmark(purchases: int, products: int, items: int, rounds: int):
+    import contextlib
+    import io
+    import os
+    from time import perf_counter
+
+    payloads = [synthetic_payload(purchase_id, products, items) for purchase_id in range(1, purchases + 1)]
+    size = sum(len(payload) for payload in payloads) / len(payloads)
+
+    # Os dois caminhos precisam chegar ao mesmo resultado
+    for payload in payloads[:10]:
+        with contextlib.redirect_stdout(io.StringIO()):
+            legacy = _legacy_parse(payload)
+        parsed = parse_purchase(payload)
+        assert legacy[2] == parsed.valor_total and legacy[3] == parsed.codigos
+        assert legacy[4] == set(parsed.valores_processados)
+
+    def measure(parse):
+        # Os prints do caminho antigo vão para o devnull: mede só o custo de formatar e escrever
+        best = float('inf')
+        with open(os.devnull, 'w', encoding='utf-8') as devnull, contextlib.redirect_stdout(devnull):
+            for _ in range(rounds):
+                started = perf_counter()
+                for payload in payloads:
+                    parse(payload)
+                best = min(best, perf_counter() - started)
+        return best / len(payloads) * 1e6
+
+    decode_us = measure(json.loads)
+    legacy_us = measure(_legacy_parse)
+    parsed_us = measure(parse_purchase)
+    print(f"{purchases} compras sintéticas, {products} produtos x {items} itens, {size / 1024:.1f} KB em média")
+    print(f"  somente json.loads: {decode_us:9.1f} µs/compra")
+    print(f"  caminho antigo:     {legacy_us:9.1f} µs/compra")
+    print(f"  parse_purchase:     {parsed_us:9.1f} µs/compra ({legacy_us / parsed_us:.1f}x mais rápido)")
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark da interpretação de anexos de venda")
+    parser.add_argument('--purchases', type=int, default=2000)
+    parser.add_argument('--products', type=int, default=5)
+    parser.add_argument('--items', type=int, default=4)
+    parser.add_argument('--rounds', type=int, default=5)
+    args = parser.parse_args()
+    _benchmark(args.purchases, args.products, args.items, args.rounds)